@@ -9,10 +9,14 @@ gtf_name="genCode44"
 tools=("LongGF" "JAFFAL" "FLAIR_fusion" "FusionSeeker" "CTAT-LR-Fusion" "pbfusion" "genion" "IFDlong")
 
 #tools=("IFDlong")
+# optional 4th/5th arguments (used by GFD_scheduler.py): comma separated tools and their core number
+if [ -n "$4" ]; then IFS=',' read -ra tools <<< "$4"; fi
 min_support=1 # Minimum read support for fusion calls
-corenum=50
+corenum=${5:-50}
 
 # obtain the absolute path
+script_dir=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+monitor_interval=1 # seconds between resource samples (GFD_monitor.py)
 
 reference_data_path=$script_dir/Reference_data
 # download from gencode: https://www.gencodegenes.org/human/
@@ -30,31 +34,6 @@ reference_cdna_selfalign=$reference_data_path/cdna.selfalign.tsv # for genion
 reference_genome_mmi=$reference_data_path/GRCh38.primary_assembly.genome.mmi # for pbfusion
 reference_gtf_bin=$reference_data_path/gencode.v44.primary_assembly.annotation.gtf.bin # for pbfusion
 
-# Convert memory usage to bytes
-convert_to_bytes() {
-  local value=$1
-  local unit=${value: -3}
-  local number=${value%$unit}
-
-  case $unit in
-    KiB)
-      echo $(echo "$number / 1024" | bc)
-      ;;
-    MiB)
-      echo $(echo "$number" | bc)
-      ;;
-    GiB)
-      echo $(echo "$number * 1024" | bc)
-      ;;
-    TiB)
-      echo $(echo "$number * 1024 * 1024" | bc)
-      ;;
-    *)
-      echo $number
-      ;;
-  esac
-}
-
 for tool_name in "${tools[@]}"; do
   echo "Running $tool_name..."
 
@@ -93,27 +72,10 @@ for tool_name in "${tools[@]}"; do
       ;;
   esac
 
-  start_time=$(date +%s)
-  max_memory_usage=0
-
-  # Monitor the container's memory usage
-  while [ "$(docker ps -q -f id=$container_id)" ]; do
-    current_memory_usage=$(docker stats --no-stream --format "{{.MemUsage}}" $container_id | awk '{print $1}')
-    current_memory_usage_mb=$(convert_to_bytes $current_memory_usage)
-    
-    if (( $(echo "$current_memory_usage_mb > $max_memory_usage" | bc -l) )); then
-      max_memory_usage=$current_memory_usage_mb
-    fi
-    
-  done
-
-  end_time=$(date +%s)
-  run_time=$((end_time - start_time))
-
-  echo "Tool: $tool_name, File: $file:" >> "$root/$tool_name/runtime_memory.txt"
-  echo "Total time (s): $run_time" >> "$root/$tool_name/runtime_memory.txt"
-  echo "Memory usage (Mb): $max_memory_usage" >> "$root/$tool_name/runtime_memory.txt"
-  echo "" >> "$root/$tool_name/runtime_memory.txt"
+  # Sample CPU, memory, page cache, IO and threads from the container's cgroup until it exits
+  # writes $root/$tool_name/metrics/$file.{tsv,json} and appends the runtime_memory.txt summary
+  python3 $script_dir/GFD_monitor.py --docker $container_id --start $start_time --interval $monitor_interval \
+    --tool $tool_name --dataset $file --out "$root/$tool_name/metrics/$file" --runtime-log "$root/$tool_name/runtime_memory.txt"
 
   docker rm $container_id
 
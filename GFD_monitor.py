@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Sample the resource use of one benchmark run at a fixed interval.
+
+The run is a docker container (--docker ID), a local process that is already
+running (--pid PID) or a command started by this script (everything after --).
+Counters are read from the run's own cgroup v2 directory when it has one (docker
+containers); otherwise they are summed over the process and its descendants from
+/proc. Page cache is only known from a cgroup.
+
+Writes PREFIX.tsv (one row per sample) and PREFIX.json (summary of the run).
+
+usage: python3 GFD_monitor.py --tool TOOL --dataset FILE --out PREFIX --docker CONTAINER_ID [--start EPOCH]
+       python3 GFD_monitor.py --tool TOOL --dataset FILE --out PREFIX -- command [args ...]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+COLUMNS = ['time_s', 'cpu_s', 'cpu_cores', 'rss_bytes', 'cache_bytes', 'read_bytes', 'write_bytes', 'threads']
+
+
+def read_keyed(path):
+    """Read a 'key value' file (cpu.stat, memory.stat) into a dict of ints."""
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, value = line.split()[:2]
+            values[key] = int(value)
+    return values
+
+
+def pid_cgroup(pid):
+    """Return the cgroup v2 directory of a process, or None (cgroup v1 or process gone)."""
+    try:
+        with open(f'/proc/{pid}/cgroup') as f:
+            for line in f:
+                hierarchy, _, path = line.rstrip('\n').split(':', 2)
+                if hierarchy == '0':
+                    path = os.path.join(CGROUP_ROOT, path.lstrip('/'))
+                    return path if os.path.isfile(os.path.join(path, 'cpu.stat')) else None
+    except OSError:
+        pass
+    return None
+
+
+class CgroupCounters:
+    """Counters of all tasks in one cgroup v2 directory."""
+
+    source = 'cgroup'
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def populated(self):
+        try:
+            return read_keyed(self._file('cgroup.events')).get('populated', 0) == 1
+        except OSError:
+            return False
+
+    def read(self):
+        try:
+            cpu = read_keyed(self._file('cpu.stat'))
+            memory = read_keyed(self._file('memory.stat'))
+            read_bytes = write_bytes = None
+            if os.path.isfile(self._file('io.stat')):  # only when the io controller is enabled
+                read_bytes = write_bytes = 0
+                with open(self._file('io.stat')) as f:
+                    for line in f:
+                        fields = dict(x.split('=') for x in line.split()[1:])
+                        read_bytes += int(fields.get('rbytes', 0))
+                        write_bytes += int(fields.get('wbytes', 0))
+            if os.path.isfile(self._file('pids.current')):
+                with open(self._file('pids.current')) as f:
+                    threads = int(f.read())
+            else:
+                with open(self._file('cgroup.threads')) as f:
+                    threads = len(f.read().split())
+        except OSError:
+            return None
+        return {'cpu_s': cpu['usage_usec'] / 1e6, 'rss_bytes': memory.get('anon', 0),
+                'cache_bytes': memory.get('file', 0), 'read_bytes': read_bytes,
+                'write_bytes': write_bytes, 'threads': threads}
+
+
+class ProcTreeCounters:
+    """Counters summed over a process and its descendants from /proc.
+
+    Processes that have exited keep their last seen CPU time and IO bytes, so the
+    totals never go down; a process that starts and ends between two samples is missed.
+    """
+
+    source = 'proc'
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.seen = {}
+
+    def _tree(self):
+        stats, children = {}, {}
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            fields = stat[stat.rindex(')') + 2:].split()  # fields from state (3rd) on
+            stats[int(name)] = fields
+            children.setdefault(int(fields[1]), []).append(int(name))
+        tree, todo = {}, [self.pid]
+        while todo:
+            pid = todo.pop()
+            if pid in stats and pid not in tree:
+                tree[pid] = stats[pid]
+                todo.extend(children.get(pid, []))
+        return tree
+
+    def read(self):
+        tree = self._tree()
+        if self.pid not in tree or tree[self.pid][0] == 'Z':
+            return None
+        rss = threads = 0
+        for pid, fields in tree.items():
+            read_bytes = write_bytes = 0
+            try:
+                with open(f'/proc/{pid}/io') as f:
+                    io = dict(line.split(': ') for line in f.read().splitlines())
+                read_bytes, write_bytes = int(io['read_bytes']), int(io['write_bytes'])
+            except (OSError, KeyError, ValueError):
+                read_bytes, write_bytes = self.seen.get(pid, (0, 0, 0))[1:]
+            self.seen[pid] = ((int(fields[11]) + int(fields[12])) / CLK_TCK, read_bytes, write_bytes)
+            threads += int(fields[17])
+            rss += int(fields[21]) * PAGE_SIZE
+        return {'cpu_s': sum(x[0] for x in self.seen.values()), 'rss_bytes': rss, 'cache_bytes': None,
+                'read_bytes': sum(x[1] for x in self.seen.values()),
+                'write_bytes': sum(x[2] for x in self.seen.values()), 'threads': threads}
+
+
+def pid_alive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return False
+    return stat[stat.rindex(')') + 2] != 'Z'
+
+
+def monitor(counters, alive, out, interval=1.0, start=None, info=None, finish=None):
+    """Sample counters every interval seconds while alive() is true.
+
+    Writes out.tsv and out.json and returns the summary. finish() is called once the
+    run has ended and may return values that replace the sampled ones (exit code,
+    exact end and CPU time from wait4).
+    """
+    start = time.time() if start is None else start
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    rows, prev = [], None
+    with open(out + '.tsv', 'w') as tsv:
+        tsv.write('\t'.join(COLUMNS) + '\n')
+        next_time = time.monotonic()
+        while alive():
+            values = counters.read()
+            now = time.time()
+            if values is not None:
+                values['time_s'] = now - start
+                values['cpu_cores'] = 0.0 if prev is None else \
+                    (values['cpu_s'] - prev['cpu_s']) / max(values['time_s'] - prev['time_s'], 1e-9)
+                rows.append(values)
+                prev = values
+                tsv.write('\t'.join('' if values[c] is None else f'{values[c]:.3f}' if isinstance(values[c], float)
+                                    else str(values[c]) for c in COLUMNS) + '\n')
+                tsv.flush()
+            next_time += interval
+            time.sleep(max(0.0, next_time - time.monotonic()))
+    end = time.time()
+
+    def peak(col):
+        values = [r[col] for r in rows if r[col] is not None]
+        return max(values) if values else None
+
+    def last(col):
+        values = [r[col] for r in rows if r[col] is not None]
+        return values[-1] if values else None
+
+    summary = dict(info or {})
+    summary.update({'source': counters.source, 'interval_s': interval, 'start': start, 'end': end,
+                    'wall_s': end - start, 'cpu_s': last('cpu_s'), 'peak_cpu_cores': peak('cpu_cores'),
+                    'peak_rss_bytes': peak('rss_bytes'), 'peak_cache_bytes': peak('cache_bytes'),
+                    'read_bytes': last('read_bytes'), 'write_bytes': last('write_bytes'),
+                    'peak_threads': peak('threads'), 'samples': len(rows), 'exit_code': None})
+    if finish is not None:
+        for key, value in finish().items():
+            if value is not None and (summary.get(key) is None or key not in ('cpu_s', 'peak_rss_bytes')
+                                      or value > summary[key]):
+                summary[key] = value
+    summary['wall_s'] = summary['end'] - start
+    summary['mean_cpu_cores'] = None if summary['cpu_s'] is None else summary['cpu_s'] / max(summary['wall_s'], 1e-9)
+    with open(out + '.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def docker_inspect(container_id, field):
+    res = subprocess.run(['docker', 'inspect', '-f', '{{' + field + '}}', container_id],
+                         capture_output=True, text=True)
+    return res.stdout.strip() if res.returncode == 0 else None
+
+
+def monitor_docker(container_id, out, interval=1.0, start=None, info=None):
+    pid = int(docker_inspect(container_id, '.State.Pid') or 0)
+    cgroup = pid_cgroup(pid) if pid > 0 else None
+    if cgroup is not None:
+        counters = CgroupCounters(cgroup)
+        alive = counters.populated
+    else:  # cgroup v1 or the container has already stopped
+        counters = ProcTreeCounters(pid)
+        alive = lambda: pid > 0 and pid_alive(pid)
+
+    def finish():
+        code = docker_inspect(container_id, '.State.ExitCode')
+        return {'exit_code': int(code) if code not in (None, '') else None}
+    return monitor(counters, alive, out, interval, start, dict(info or {}, backend='docker'), finish)
+
+
+def monitor_pid(pid, out, interval=1.0, start=None, info=None):
+    return monitor(ProcTreeCounters(pid), lambda: pid_alive(pid), out, interval, start,
+                   dict(info or {}, backend='pid'))
+
+
+def monitor_command(command, out, interval=1.0, start=None, info=None, **popen_args):
+    """Start command and sample it until it exits; the exit code and rusage come from wait4."""
+    start = time.time() if start is None else start
+    proc = subprocess.Popen(command, **popen_args)
+    ended = {}
+
+    def reap():
+        # blocking wait4 so that the end time does not depend on the sampling interval
+        _, status, rusage = os.wait4(proc.pid, 0)
+        ended.update(end=time.time(), rusage=rusage)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    waiter = threading.Thread(target=reap, daemon=True)
+    waiter.start()
+
+    def finish():
+        waiter.join()
+        rusage = ended['rusage']
+        return {'exit_code': proc.returncode, 'end': ended['end'], 'cpu_s': rusage.ru_utime + rusage.ru_stime,
+                'peak_rss_bytes': rusage.ru_maxrss * 1024}
+    return monitor(ProcTreeCounters(proc.pid), waiter.is_alive, out, interval, start,
+                   dict(info or {}, backend='local', command=list(command)), finish)
+
+
+def append_runtime_log(path, summary):
+    """Append the run in the format GFD_main.sh has always written to runtime_memory.txt."""
+    peak = summary['peak_rss_bytes']
+    with open(path, 'a') as f:
+        f.write(f"Tool: {summary.get('tool')}, File: {summary.get('dataset')}:\n")
+        f.write(f"Total time (s): {round(summary['wall_s'])}\n")
+        f.write(f"Memory usage (Mb): {0 if peak is None else round(peak / 2 ** 20)}\n\n")
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    command = []
+    if '--' in argv:
+        command = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    parser = argparse.ArgumentParser(description='sample CPU, memory, IO and threads of one benchmark run',
+                                     usage='python3 GFD_monitor.py --tool T --dataset D --out PREFIX (--docker ID | --pid PID | -- command ...)')
+    parser.add_argument('--docker', help='id of a running docker container')
+    parser.add_argument('--pid', type=int, help='pid of a running local process (its descendants are included)')
+    parser.add_argument('--tool', default='', help='tool name written to the summary')
+    parser.add_argument('--dataset', default='', help='dataset name written to the summary')
+    parser.add_argument('--out', required=True, help='output prefix, writes PREFIX.tsv and PREFIX.json')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between samples')
+    parser.add_argument('--start', type=float, help='epoch time the run was launched (default: now)')
+    parser.add_argument('--runtime-log', help='also append total time and peak memory to this runtime_memory.txt')
+    args = parser.parse_args(argv)
+    if sum([args.docker is not None, args.pid is not None, len(command) > 0]) != 1:
+        parser.error('give exactly one of --docker, --pid or -- command')
+
+    info = {'tool': args.tool, 'dataset': args.dataset}
+    if args.docker:
+        summary = monitor_docker(args.docker, args.out, args.interval, args.start, info)
+    elif args.pid:
+        summary = monitor_pid(args.pid, args.out, args.interval, args.start, info)
+    else:
+        summary = monitor_command(command, args.out, args.interval, args.start, info)
+    if args.runtime_log:
+        append_runtime_log(args.runtime_log, summary)
+    print(json.dumps(summary))
+    sys.exit(summary['exit_code'] if command and summary['exit_code'] is not None else 0)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Run the tool x dataset benchmark matrix concurrently within a node budget.
+
+Each tool gets a core and memory reservation learned from the metrics JSONs of past
+runs (written by GFD_monitor.py to ROOT/TOOL/metrics/). Runs are ordered by their
+expected size (cores x past wall time, then memory) and started first-fit whenever
+their reservation fits in the free cores and memory of the node. At most one run per
+dataset is running at a time: the run_<tool>.sh scripts gunzip /dataset/FILE.fastq.gz in
+place and gzip and remove the fastq again at the end, so two tools on one dataset would
+delete each other's input. The schedule is written to a TSV with the time each run
+waited in the queue kept apart from its run time, so the benchmark timings are not
+affected by the packing.
+
+Backends:
+  docker  runs "GFD_main.sh ROOT FILE SEQ_TYPE TOOL CORES" (one container, monitored by GFD_monitor.py)
+  local   runs --command, formatted with {root} {tool} {dataset} {seq_type} {cores}, as a local
+          process monitored by GFD_monitor.py; used to test the scheduler without docker
+
+usage: python3 GFD_scheduler.py --root ROOT --datasets datasets.tsv [--tools LongGF,JAFFAL] [--cores 64] [--mem-gb 256]
+datasets.tsv has one dataset per line: FILE<TAB>SEQ_TYPE
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from GFD_monitor import monitor_command
+
+TOOLS = ["LongGF", "JAFFAL", "FLAIR_fusion", "FusionSeeker", "CTAT-LR-Fusion", "pbfusion", "genion", "IFDlong"]
+SCHEDULE_COL = ['tool', 'dataset', 'seq_type', 'cores', 'mem_bytes', 'submit', 'start', 'end',
+                'queue_wait_s', 'run_s', 'cpu_s', 'peak_rss_bytes', 'exit_code']
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def node_memory():
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def read_datasets(path):
+    datasets = []
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                dataset, seq_type = line.split()[:2]
+                datasets.append((dataset, seq_type))
+    return datasets
+
+
+def learn_profiles(history_dirs, tools, node_cores, node_mem, default_cores, default_mem, mem_margin=0.2):
+    """Core and memory reservation of each tool from the metrics JSONs of past runs.
+
+    cores: highest sampled CPU use (cores) of any successful run, rounded up
+    mem_bytes: highest peak RSS of any successful run plus mem_margin
+    wall_s: median wall time, only used to order the runs
+    Tools without history get the defaults. Reservations are capped at the node budget.
+    """
+    runs = {tool: [] for tool in tools}
+    for history_dir in history_dirs:
+        for path in glob.glob(os.path.join(history_dir, '*', 'metrics', '*.json')):
+            with open(path) as f:
+                summary = json.load(f)
+            if summary.get('tool') in runs and summary.get('exit_code') in (0, None):
+                runs[summary['tool']].append(summary)
+
+    profiles = {}
+    for tool in tools:
+        cores = [r['peak_cpu_cores'] for r in runs[tool] if r.get('peak_cpu_cores')]
+        mem = [r['peak_rss_bytes'] for r in runs[tool] if r.get('peak_rss_bytes')]
+        wall = sorted(r['wall_s'] for r in runs[tool] if r.get('wall_s'))
+        profiles[tool] = {
+            'cores': min(max(math.ceil(max(cores)), 1) if cores else default_cores, node_cores),
+            'mem_bytes': min(int(max(mem) * (1 + mem_margin)) if mem else default_mem, node_mem),
+            'wall_s': wall[len(wall) // 2] if wall else None,
+            'runs': len(runs[tool]),
+        }
+    return profiles
+
+
+def make_jobs(datasets, tools, profiles):
+    jobs = [{'tool': tool, 'dataset': dataset, 'seq_type': seq_type,
+             'cores': profiles[tool]['cores'], 'mem_bytes': profiles[tool]['mem_bytes'],
+             'est_s': profiles[tool]['wall_s'] or 0.0}
+            for dataset, seq_type in datasets for tool in tools]
+    # largest runs first (first-fit decreasing)
+    return sorted(jobs, key=lambda j: (j['cores'] * j['est_s'], j['mem_bytes'], j['cores']), reverse=True)
+
+
+def schedule(jobs, node_cores, node_mem, run_job, on_done=None, max_running=None):
+    """Start jobs first-fit while their reservation fits the free cores and memory
+    and no other job on the same dataset is running (the tools unpack the input in place).
+
+    run_job(job) runs one job to the end and returns its GFD_monitor summary.
+    Returns the jobs with submit/start/end, queue_wait_s and run_s filled in.
+    """
+    submit = time.time()
+    pending, running, done = list(jobs), {}, []
+    free = {'cores': node_cores, 'mem_bytes': node_mem}
+    busy = set()  # datasets with a running job
+
+    def start(job):
+        job['start'] = time.time()
+        try:
+            job['summary'] = run_job(job)
+        finally:
+            job['end'] = time.time()
+        return job
+
+    with ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as pool:
+        while pending or running:
+            for job in list(pending):
+                if max_running is not None and len(running) >= max_running:
+                    break
+                if job['dataset'] in busy:
+                    continue
+                if job['cores'] <= free['cores'] and job['mem_bytes'] <= free['mem_bytes']:
+                    pending.remove(job)
+                    busy.add(job['dataset'])
+                    free['cores'] -= job['cores']
+                    free['mem_bytes'] -= job['mem_bytes']
+                    job['submit'] = submit
+                    running[pool.submit(start, job)] = job
+            if not running:  # cannot happen: reservations are capped at the node budget
+                raise ValueError(f"job does not fit the node: {pending[0]}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                free['cores'] += job['cores']
+                free['mem_bytes'] += job['mem_bytes']
+                busy.discard(job['dataset'])
+                try:
+                    future.result()
+                except Exception as e:
+                    job['summary'] = {'exit_code': None, 'error': repr(e)}
+                job['queue_wait_s'] = job['start'] - job['submit']
+                job['run_s'] = job['summary'].get('wall_s', job['end'] - job['start'])
+                done.append(job)
+                if on_done is not None:
+                    on_done(job)
+    return done
+
+
+def docker_runner(root):
+    # GFD_main.sh runs the one tool with corenum=cores and writes its metrics with GFD_monitor.py
+    def run_job(job):
+        subprocess.run(['bash', os.path.join(script_dir, 'GFD_main.sh'), root, job['dataset'], job['seq_type'],
+                        job['tool'], str(job['cores'])], check=False)
+        with open(os.path.join(root, job['tool'], 'metrics', job['dataset'] + '.json')) as f:
+            return json.load(f)
+    return run_job
+
+
+def local_runner(root, command, interval=1.0):
+    def run_job(job):
+        fields = dict(job, root=root)
+        out = os.path.join(root, job['tool'], 'metrics', job['dataset'])
+        info = {'tool': job['tool'], 'dataset': job['dataset'], 'cores': job['cores'],
+                'queue_wait_s': job['start'] - job['submit']}
+        return monitor_command(['bash', '-c', command.format(**fields)], out, interval, job['start'], info)
+    return run_job
+
+
+def write_row(f, job):
+    summary = job['summary']
+    values = dict(job, cpu_s=summary.get('cpu_s'), peak_rss_bytes=summary.get('peak_rss_bytes'),
+                  exit_code=summary.get('exit_code'))
+    f.write('\t'.join('' if values[c] is None else f'{values[c]:.3f}' if isinstance(values[c], float)
+                      else str(values[c]) for c in SCHEDULE_COL) + '\n')
+    f.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run the tool x dataset benchmark matrix concurrently within a node budget')
+    parser.add_argument('--root', required=True, help='dataset directory (the root argument of GFD_main.sh)')
+    parser.add_argument('--datasets', required=True, help='TSV of FILE and SEQ_TYPE, one dataset per line')
+    parser.add_argument('--tools', default=','.join(TOOLS), help='comma separated tools (default: all)')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='cores of the node to use')
+    parser.add_argument('--mem-gb', type=float, help='memory of the node to use in GB (default: MemTotal)')
+    parser.add_argument('--history', action='append', help='roots whose TOOL/metrics/*.json are used for the profiles (default: --root)')
+    parser.add_argument('--default-cores', type=int, default=50, help='reservation of a tool without history')
+    parser.add_argument('--default-mem-gb', type=float, default=32, help='reservation of a tool without history')
+    parser.add_argument('--mem-margin', type=float, default=0.2, help='added to the past peak RSS')
+    parser.add_argument('--max-running', type=int, help='upper limit of concurrent runs')
+    parser.add_argument('--backend', choices=['docker', 'local'], default='docker')
+    parser.add_argument('--command', help='command of the local backend, formatted with {root} {tool} {dataset} {seq_type} {cores}')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between resource samples of the local backend')
+    parser.add_argument('--out', help='schedule TSV (default: ROOT/schedule.tsv)')
+    args = parser.parse_args()
+    if args.backend == 'local' and not args.command:
+        parser.error('--backend local needs --command')
+
+    tools = args.tools.split(',')
+    node_mem = int(args.mem_gb * 2 ** 30) if args.mem_gb else node_memory()
+    profiles = learn_profiles(args.history or [args.root], tools, args.cores, node_mem,
+                              min(args.default_cores, args.cores), int(args.default_mem_gb * 2 ** 30), args.mem_margin)
+    for tool in tools:
+        p = profiles[tool]
+        print(f"{tool}: {p['cores']} cores, {p['mem_bytes'] / 2 ** 30:.1f} GB ({p['runs']} past runs)")
+    jobs = make_jobs(read_datasets(args.datasets), tools, profiles)
+    if args.backend == 'docker':
+        run_job = docker_runner(args.root)
+    else:
+        run_job = local_runner(args.root, args.command, args.interval)
+
+    out_path = args.out or os.path.join(args.root, 'schedule.tsv')
+    with open(out_path, 'w') as f:
+        f.write('\t'.join(SCHEDULE_COL) + '\n')
+        done = schedule(jobs, args.cores, node_mem, run_job, lambda job: write_row(f, job), args.max_running)
+    failed = [j for j in done if j['summary'].get('exit_code') != 0]
+    print(f"{len(done)} runs, {len(failed)} failed -> {out_path}")
+    sys.exit(1 if failed else 0)
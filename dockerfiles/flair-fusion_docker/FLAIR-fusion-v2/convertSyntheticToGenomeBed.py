@@ -1,109 +1,127 @@
 
 import sys
+import numpy as np
 
 ###TEKT2,chr1,36085562,36084093--CTAG1A,chrX,154586406,154586816	0	1879	TEKT2-201--CTAG1A-202_CTAG1A--TEKT2	1000	+	0	1879	0	4	56,208,126,291,	0,776,1069,1588,
 
 ##LETM1,chr4,1833896,1856156--USP2,chr11,119377497,119355214	0	44543	LETM1-201--USP2-201_LETM1--USP2	1000	+	0	44543	0	17	288,61,451,144,138,815,51,124,112,111,65,104,81,79,108,121,1708,	0,6947,14359,19584,21174,26236,39523,40097,40415,40623,40920,41505,41696,41922,42167,42450,42835,
-# print('hi')
 #'.'.join(sys.argv[1].split('.')[:-5]) +
 
-isoreadsup = {}
-freadsfinal = set()
+CHUNKSIZE = 100000
+
+###read map is read once: isoforms get an integer index with their read count, supporting reads point at their isoform index
+###reads stay keyed by name, the reads file below can only be matched by read name so a string lookup is needed there anyway
+isoindex, isosupport, readiso = {}, [], {}
 for line in open('.'.join(sys.argv[1].split('.')[:-4]) + '.syntheticAligned-flair.collapse.combined.isoform.read.map.txt'):
-    line = line.split('\t')
-    isoreadsup[line[0]] = len(line[1].split(','))
-    if len(line[1].split(',')) > 1:
-        for i in line[1].split(','):
-            freadsfinal.add(i)
-            
+    line = line.rstrip('\n').split('\t')
+    reads = line[1].split(',')
+    isoindex[line[0]] = len(isosupport)
+    isosupport.append(len(reads))
+    if len(reads) > 1:
+        for r in reads: readiso[r] = isoindex[line[0]]
+isosupport = np.array(isosupport, dtype=np.int64)
 
-if sys.argv[2].split('.')[-1] == 'fastq' or sys.argv[2].split('.')[-1] == 'fq':
-    out5 = open('.'.join(sys.argv[2].split('.')[:-1]) + '-isoSupport.fastq', 'w')
-    last = False
-    for line in open(sys.argv[2]):
-        if line[0] == '@':
-            if line.lstrip('@').split(' ')[0] in freadsfinal:
-                last = True
-            else:
-                last = False
-        if last: out5.write(line)
-elif sys.argv[2].split('.')[-1] == 'fasta' or sys.argv[2].split('.')[-1] == 'fa':
-    out5 = open('.'.join(sys.argv[2].split('.')[:-1]) + '-isoSupport.fasta', 'w')
+
+def writeSupportedReads(readfile, outfile, header):
+    out5 = open(outfile, 'w')
     last = False
-    for line in open(sys.argv[2]):
-        if line[0] == '>':
-            if line.rstrip().lstrip('>').split(' ')[0] in freadsfinal:
-                last = True
-            else:
-                last = False
+    for line in open(readfile):
+        if line[0] == header:
+            last = line.rstrip().lstrip(header).split(' ')[0] in readiso
         if last: out5.write(line)
+    out5.close()
 
 
+if sys.argv[2].split('.')[-1] == 'fastq' or sys.argv[2].split('.')[-1] == 'fq':
+    writeSupportedReads(sys.argv[2], '.'.join(sys.argv[2].split('.')[:-1]) + '-isoSupport.fastq', '@')
+elif sys.argv[2].split('.')[-1] == 'fasta' or sys.argv[2].split('.')[-1] == 'fa':
+    writeSupportedReads(sys.argv[2], '.'.join(sys.argv[2].split('.')[:-1]) + '-isoSupport.fasta', '>')
 
-out = open('.'.join(sys.argv[1].split('.')[:-4]) + '.genomeAligned-flair.collapse.isoforms.bed', 'w') #'sim-nice-10x-gencode38-fusion-sim-test-06-12-2023corrleft-fusionOnly.genomeAligned.flair.collapse.isoforms.bed', 'w')
-for line in open(sys.argv[1]): #'sim-nice-10x-gencode38-fusion-sim-test-06-12-2023corrleft-fusionOnly.syntheticAligned-flair.collapse.isoforms.bed'):
-    line = line.split('\t')
-    iso, start, esizes, estarts = line[3], int(line[1]), [int(x) for x in line[10].split(',')[:-1]], [int(x) for x in line[11].split(',')[:-1]]
-    if isoreadsup[iso] > 1:
-        chimera = line[0].split('--')
+
+contigs = {}
+def parseSyntheticContig(name):
+    ##(5' chr, 5' bp, 5' outer, 3' chr, 3' bp, 3' outer) for gene.chr.bp.outer--gene.chr.bp.outer
+    if name not in contigs:
+        chimera = name.split('--')
         fivechr, fivebp, fiveouter = chimera[0].split('.')[-3:]
         threechr, threebp, threeouter = chimera[1].split('.')[-3:]
-        fivebp, fiveouter, threebp, threeouter = int(fivebp), int(fiveouter), int(threebp), int(threeouter)
-        breakpoint = abs(fiveouter-fivebp)
-        # outline5 = [fivechr, None, None, iso, 1000, None, None, None, 0, 0, [], []]
-
-        ###check if isoform actually crosses fusion breakpoint, don't convert coordinates otherwise
-        if start < breakpoint and breakpoint < int(line[2]):
-            introns5, exons5 = [], []
-            introns3, exons3 = [0], []
-            lastexonend = 0
-            start3 = None
-            for i in range(len(esizes)):
-                if start + estarts[i] < breakpoint:
-                    introns5.append(estarts[i]-lastexonend)
-                    exons5.append(esizes[i])
-                    lastexonend = estarts[i] + esizes[i]
-                else:
-                    if not start3: start3 = (start + estarts[i])-breakpoint
-                    else: introns3.append(estarts[i]-lastexonend)
-                    exons3.append(esizes[i])
-                    lastexonend = estarts[i] + esizes[i]
-            #print(iso, start3, exons3, introns3)
-            if fivebp > fiveouter: ##5' gene is + direction
-                tot5len, g5estarts = 0, []
-                for i in range(len(exons5)):
-                    g5estarts.append(tot5len + introns5[i])
-                    tot5len += introns5[i] + exons5[i]
-                outline5 = [fivechr, str(fiveouter+start), str(fiveouter+start+tot5len), iso, '1000', '+',
-                            str(fiveouter+start), str(fiveouter+start+tot5len), '0',
-                            str(len(exons5)), ','.join([str(x) for x in exons5]), ','.join([str(x) for x in g5estarts])]
-            else: #5' gene is in - direction
-                tot5len, g5estarts = 0, []
-                for i in range(len(exons5)-1, -1, -1): #loop backwards through gene
-                    g5estarts.append(tot5len)
-                    tot5len += introns5[i] + exons5[i]
-                outline5 = [fivechr, str(fiveouter - (start+tot5len)), str(fiveouter - start), iso, '1000', '-',
-                            str(fiveouter - (start+tot5len)), str(fiveouter - start), '0',
-                            str(len(exons5)), ','.join([str(x) for x in exons5[::-1]]), ','.join([str(x) for x in g5estarts])]
-            if threebp < threeouter: #3' gene is in + direction
-                tot3len, g3estarts = 0, []
-                for i in range(len(exons3)):
-                    g3estarts.append(tot3len + introns3[i])
-                    tot3len += introns3[i] + exons3[i]
-                outline3 = [threechr, str(threebp + start3), str(threebp + start3 + tot3len), iso, '1000', '+',
-                            str(threebp + start3), str(threebp + start3 + tot3len), '0',
-                            str(len(exons3)), ','.join([str(x) for x in exons3]), ','.join([str(x) for x in g3estarts])]
-            else: #3' gene is in - direction
-                tot3len, g3estarts = 0, []
-                for i in range(len(exons3)-1, -1, -1): #loop backwards through gene
-                    g3estarts.append(tot3len)
-                    tot3len += introns3[i] + exons3[i]
-                outline3 = [threechr, str(threebp - (start3+tot3len)), str(threebp - start3), iso, '1000', '-',
-                            str(threebp - (start3+tot3len)), str(threebp - start3), '0',
-                            str(len(exons3)), ','.join([str(x) for x in exons3[::-1]]), ','.join([str(x) for x in g3estarts])]
-            out.write('\t'.join(outline5) + '\n')
-            out.write('\t'.join(outline3) + '\n')
+        contigs[name] = (fivechr, int(fivebp), int(fiveouter), threechr, int(threebp), int(threeouter))
+    return contigs[name]
+
+
+def blockStr(a):
+    return ','.join(map(str, a.tolist()))
+
+
+def convertChunk(rows, out):
+    ###rows are bed lines of isoforms with >1 supporting read, exon blocks of all rows are concatenated into flat arrays
+    n = len(rows)
+    names = [parseSyntheticContig(r[0]) for r in rows]
+    start = np.array([int(r[1]) for r in rows], dtype=np.int64)
+    end = np.array([int(r[2]) for r in rows], dtype=np.int64)
+    fivebp = np.array([c[1] for c in names], dtype=np.int64)
+    fiveouter = np.array([c[2] for c in names], dtype=np.int64)
+    threebp = np.array([c[4] for c in names], dtype=np.int64)
+    threeouter = np.array([c[5] for c in names], dtype=np.int64)
+    breakpoint = np.abs(fiveouter - fivebp)
+    nblocks = np.array([int(r[9]) for r in rows], dtype=np.int64)
+    esizes = np.array([int(x) for r in rows for x in r[10].split(',')[:-1]], dtype=np.int64)
+    estarts = np.array([int(x) for r in rows for x in r[11].split(',')[:-1]], dtype=np.int64)
+    first = np.concatenate([[0], np.cumsum(nblocks)[:-1]])
+    last = first + nblocks - 1
+    rowid = np.repeat(np.arange(n), nblocks)
+
+    ##split each row's blocks at the breakpoint, rows are shifted apart so one searchsorted over the flat array does all rows
+    rowshift = np.concatenate([[0], np.cumsum(end + 1)[:-1]])
+    split = np.searchsorted(start[rowid] + estarts + rowshift[rowid], breakpoint + rowshift, side='left')
+    n5 = split - first
+    ###check if isoform actually crosses fusion breakpoint and has blocks on both sides, don't convert coordinates otherwise
+    keep = (start < breakpoint) & (breakpoint < end) & (n5 > 0) & (split <= last)
+    split = np.minimum(split, last)
+
+    eends = estarts + esizes
+    tot5len = eends[np.maximum(split - 1, first)]
+    start3 = start + estarts[split] - breakpoint
+    tot3len = eends[last] - estarts[split]
+    ##block starts relative to the genomic start of their half, - direction halves count back from the half's end
+    rel5plus = estarts
+    rel5minus = tot5len[rowid] - eends
+    rel3plus = estarts - estarts[split][rowid]
+    rel3minus = tot3len[rowid] - (eends - estarts[split][rowid])
+
+    five5plus = fivebp > fiveouter  ##5' gene is + direction
+    three3plus = threebp < threeouter  ##3' gene is + direction
+    g5start = np.where(five5plus, fiveouter + start, fiveouter - (start + tot5len))
+    g3start = np.where(three3plus, threebp + start3, threebp - (start3 + tot3len))
+
+    for i in np.flatnonzero(keep).tolist():
+        r = rows[i]
+        s5, s3 = slice(first[i], split[i]), slice(split[i], last[i] + 1)
+        if five5plus[i]:
+            sizes5, starts5, strand5 = esizes[s5], rel5plus[s5], '+'
+        else:
+            sizes5, starts5, strand5 = esizes[s5][::-1], rel5minus[s5][::-1], '-'
+        if three3plus[i]:
+            sizes3, starts3, strand3 = esizes[s3], rel3plus[s3], '+'
+        else:
+            sizes3, starts3, strand3 = esizes[s3][::-1], rel3minus[s3][::-1], '-'
+        gs5, ge5 = str(g5start[i]), str(g5start[i] + tot5len[i])
+        gs3, ge3 = str(g3start[i]), str(g3start[i] + tot3len[i])
+        out.write('\t'.join([names[i][0], gs5, ge5, r[3], '1000', strand5, gs5, ge5, '0',
+                             str(len(sizes5)), blockStr(sizes5), blockStr(starts5)]) + '\n')
+        out.write('\t'.join([names[i][3], gs3, ge3, r[3], '1000', strand3, gs3, ge3, '0',
+                             str(len(sizes3)), blockStr(sizes3), blockStr(starts3)]) + '\n')
+
+
+###isoforms are converted in chunks and written as they are done
+out = open('.'.join(sys.argv[1].split('.')[:-4]) + '.genomeAligned-flair.collapse.isoforms.bed', 'w')
+rows = []
+for line in open(sys.argv[1]):
+    line = line.rstrip('\n').split('\t')
+    if isosupport[isoindex[line[3]]] > 1:
+        rows.append(line)
+    if len(rows) >= CHUNKSIZE:
+        convertChunk(rows, out)
+        rows = []
+if len(rows) > 0: convertChunk(rows, out)
 out.close()
-#
-# out = open('test.txt', 'w')
-# out.write('hi')
@@ -46,6 +46,16 @@ parser.add_argument('-q', '--runPreprocessing', action='store_true', dest='q',
                     help='whether to run preprocessing steps (intron to genome and homology reference making)')
 parser.add_argument('-m', '--alignTranscriptome', action='store_true', dest='m',
                     help='whether to align reads to transcriptome, if this is not selected, need to give .bam file')
+parser.add_argument('-j', '--supportedIsoPairs', action='store_true', dest='j',
+                    help='only annotate synthetic fusion isoform pairs whose junction exons are supported by chimeric read breakpoints')
+parser.add_argument('-c', '--maxIsoPairs', action='store', dest='c', default='0',
+                    help='maximum number of isoform pairs annotated per synthetic fusion (0 = no cap)')
+parser.add_argument('-w', '--workers', action='store', dest='w', default=1, type=int,
+                    help='number of synthetic contig shards to run flair correct/collapse on in parallel (1 = single run)')
+parser.add_argument('-n', '--genomeRealign', action='store_true', dest='n',
+                    help='realign isoform supporting reads to the genome with minimap2 instead of lifting over their synthetic genome alignments')
+parser.add_argument('-u', '--chimeraState', action='store', dest='u', default="",
+                    help='chimera state file (.pkl) for incremental calling: -r is one new batch of reads, its chimeric reads are added to the state and fusions are called from all batches so far')
 # /private/groups/brookslab/reference_annotations/
 args = parser.parse_args()
 overallstart = time.time()
@@ -113,7 +123,8 @@ if not os.path.isfile(args.s + '.bai'):
     raise Exception('bam file index does not exist, index your file please')
 
 start = time.time()
-subprocess.call([sys.executable, path + '/removeParalogsGetChim-07-18-23.py', '-r', args.r, '-s', args.s, '-e', args.e, '-p', args.p, '-b', args.b, '-l', args.l, '-a', args.a, '-o', prefix])
+chimargs = ['-t', args.u] if args.u else []
+subprocess.call([sys.executable, path + '/removeParalogsGetChim-07-18-23.py', '-r', args.r, '-s', args.s, '-e', args.e, '-p', args.p, '-b', args.b, '-l', args.l, '-a', args.a, '-o', prefix] + chimargs)
 print('base fusion finding done')
 print('total fusion finding time: ', time.time()-start)
 
@@ -121,7 +132,9 @@ if args.i: #want fusion isoforms and further filtering
     if not os.path.isfile(args.g):
         raise Exception('genome file does not exist')
     start = time.time()
-    subprocess.call([sys.executable, path + '/make_synthetic_fusion_reference-06-27-2023.py', '-g', args.g, '-a', args.a, '-r', prefix + 'chimericBreakpoints.tsv', '-o', prefix])
+    synthargs = ['-g', args.g, '-a', args.a, '-r', prefix + 'chimericBreakpoints.tsv', '-o', prefix, '-m', args.c]
+    if args.j: synthargs += ['-s', '-b', prefix + 'chimericReadBreakpoints.tsv']
+    subprocess.call([sys.executable, path + '/make_synthetic_fusion_reference-06-27-2023.py'] + synthargs)
     print('synthetic fusion genome and annotation creation done')
 
     process = subprocess.Popen('minimap2 -ax splice --secondary=no -G 1000k ' + prefix + '-syntheticFusionGenome.fa ' + prefix +
@@ -131,29 +144,41 @@ if args.i: #want fusion isoforms and further filtering
     print(process.communicate()[0].strip())
     print('realignment of fusion reads to synthetic genome done')
 
-    subprocess.call(
-        ['flair', 'correct', '-q', prefix + '-fusionOnly.syntheticAligned.bed',
-         '-g', prefix + '-syntheticFusionGenome.fa',
-         '-f', prefix + '-syntheticReferenceAnno.gtf',
-         '--output', prefix + '-fusionOnly.syntheticAligned-flair'])
-
-    subprocess.call(
-        ['flair', 'collapse', '-q', prefix + '-fusionOnly.syntheticAligned-flair_all_corrected.bed',
-         '-r', prefix + '-fusionOnly.' + args.r.split('.')[-1],
-         '-g', prefix + '-syntheticFusionGenome.fa',
-         '--gtf', prefix + '-syntheticReferenceAnno.gtf',
-         '--annotation_reliant', 'generate', '--generate_map', '--check_splice',
-         '--output', prefix + '-fusionOnly.syntheticAligned-flair.collapse'])
+    if args.w > 1:
+        if subprocess.call([sys.executable, path + '/shardSyntheticFlair.py', '-o', prefix,
+                            '-r', prefix + '-fusionOnly.' + args.r.split('.')[-1], '-w', str(args.w)]) != 0:
+            sys.exit('flair correct/collapse failed in a synthetic contig shard')
+    else:
+        subprocess.call(
+            ['flair', 'correct', '-q', prefix + '-fusionOnly.syntheticAligned.bed',
+             '-g', prefix + '-syntheticFusionGenome.fa',
+             '-f', prefix + '-syntheticReferenceAnno.gtf',
+             '--output', prefix + '-fusionOnly.syntheticAligned-flair'])
+
+        subprocess.call(
+            ['flair', 'collapse', '-q', prefix + '-fusionOnly.syntheticAligned-flair_all_corrected.bed',
+             '-r', prefix + '-fusionOnly.' + args.r.split('.')[-1],
+             '-g', prefix + '-syntheticFusionGenome.fa',
+             '--gtf', prefix + '-syntheticReferenceAnno.gtf',
+             '--annotation_reliant', 'generate', '--generate_map', '--check_splice',
+             '--output', prefix + '-fusionOnly.syntheticAligned-flair.collapse'])
     print('flair collapse done')
     # print(path + '/convertSyntheticToGenomeBed.py', prefix + '-fusionOnly.syntheticAligned-flair.collapse.isoforms.bed', prefix + '-fusionOnly ' + args.r.split('.')[-1])
     subprocess.call([sys.executable, path + '/convertSyntheticToGenomeBed.py', prefix + '-fusionOnly.syntheticAligned-flair.collapse.isoforms.bed', prefix + '-fusionOnly.' + args.r.split('.')[-1]])
     print('synthetic converted to genome positions')
-    process = subprocess.Popen(
-        'minimap2 -ax splice -N 4 ' + args.g + ' ' + prefix +
-        '-fusionOnly-isoSupport.' + args.r.split('.')[-1] + ' | samtools view -bS - | samtools sort - -o ' + prefix + '-fusionOnly-isoSupport.genomeAligned.bam;' +
-        ' samtools index ' + prefix + '-fusionOnly-isoSupport.genomeAligned.bam',
-        stdout=subprocess.PIPE, shell=True)
-    print(process.communicate()[0].strip())
+    if args.n:
+        process = subprocess.Popen(
+            'minimap2 -ax splice -N 4 ' + args.g + ' ' + prefix +
+            '-fusionOnly-isoSupport.' + args.r.split('.')[-1] + ' | samtools view -bS - | samtools sort - -o ' + prefix + '-fusionOnly-isoSupport.genomeAligned.bam;' +
+            ' samtools index ' + prefix + '-fusionOnly-isoSupport.genomeAligned.bam',
+            stdout=subprocess.PIPE, shell=True)
+        print(process.communicate()[0].strip())
+    else:
+        if subprocess.call([sys.executable, path + '/liftSyntheticToGenomeBam.py', '-s', prefix + '-fusionOnly.syntheticAligned.bam',
+                            '-g', args.g, '-r', prefix + '-fusionOnly-isoSupport.' + args.r.split('.')[-1],
+                            '-o', prefix + '-fusionOnly-isoSupport.genomeAligned.bam']) != 0:
+            sys.exit('lifting the synthetic alignments to the genome failed')
+    print('isoform supporting reads placed on genome')
     #minimap2 -ax splice --secondary=no -G 1000k GRCm39.primary_assembly.genome.fa vollmers-mouse-r10-r2c2-all-fusionOnly-isoSupport.fasta | samtools view -bS - | samtools sort - -o vollmers-mouse-r10-r2c2-all-fusionOnly-isoSupport.bam
     print('fusion isoform finding done')
     print('total isoform finding time: ', time.time() - start)
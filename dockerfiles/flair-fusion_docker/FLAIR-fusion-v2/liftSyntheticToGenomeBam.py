@@ -0,0 +1,186 @@
+import sys, os, argparse
+import pysam
+
+parser = argparse.ArgumentParser(description='FLAIR-fusion 2.0 parse options',
+                                 usage='python3 liftSyntheticToGenomeBam.py -s syntheticAligned.bam -g genome.fa -r reads.[fq/fa] -o genomeAligned.bam')
+parser.add_argument('-s', '--syntheticBam', action='store', dest='s', default="",
+                    help='reads aligned to the synthetic fusion genome (-fusionOnly.syntheticAligned.bam)')
+parser.add_argument('-g', '--genome', action='store', dest='g', default="",
+                    help='path to genome, only the chromosome names and lengths of its .fai index are used for the bam header')
+parser.add_argument('-r', '--reads', action='store', dest='r', default="",
+                    help='.fa or fq file of reads to keep (-fusionOnly-isoSupport), if not given all aligned reads are lifted')
+parser.add_argument('-o', '--output', action='store', dest='o', default="",
+                    help='sorted, indexed genome bam to write')
+args = parser.parse_args()
+
+###synthetic contigs are labelled gene.chr.bp.outer--gene.chr.bp.outer, the 5' half covers [0, abs(outer-bp)) and the
+###3' half starts right after it. A half is in genome + direction if the bp is downstream of outer for the 5' gene
+###(upstream for the 3' gene), otherwise it was reverse complemented when the synthetic genome was built
+
+REFOPS, QUERYOPS = {0, 2, 3, 7, 8}, {0, 1, 4, 7, 8}
+revcomp = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
+
+def parseSyntheticContig(name):
+    chimera = name.split('--')
+    fivechr, fivebp, fiveouter = chimera[0].split('.')[-3:]
+    threechr, threebp, threeouter = chimera[1].split('.')[-3:]
+    fivebp, fiveouter, threebp, threeouter = int(fivebp), int(fiveouter), int(threebp), int(threeouter)
+    breakpoint = abs(fiveouter - fivebp)
+    ##(chr, genome coord of synthetic position offset, is + direction) for each half
+    five = (fivechr, fiveouter, fivebp > fiveouter)
+    three = (threechr, threebp, threebp < threeouter)
+    return breakpoint, five, three
+
+
+def splitCigarAtBreakpoint(s, breakpoint):
+    ###returns [left, right] halves as (refstart, refend, qstart, qend, ops) in synthetic coords, query coords are on SEQ
+    halves = [[None, None, None, None, []], [None, None, None, None, []]]
+    r, q = s.reference_start, 0
+    for op, length in s.cigartuples:
+        if op == 5: continue  # hard clips are added back on the outside at the end
+        while length > 0:
+            side = 0 if r < breakpoint else 1
+            if op in REFOPS and side == 0 and r + length > breakpoint: thislen = breakpoint - r
+            else: thislen = length
+            if op == 4:
+                q += thislen
+            else:
+                h = halves[side]
+                if op in {0, 7, 8}:
+                    if h[0] is None: h[0], h[2] = r, q
+                    h[1], h[3] = r + thislen, q + thislen
+                    h[4].append((op, thislen))
+                elif h[0] is not None:  # indels/introns before the first match of a half are dropped, they become clip or shift
+                    h[4].append((op, thislen))
+                if op in REFOPS: r += thislen
+                if op in QUERYOPS: q += thislen
+            length -= thislen
+    out = []
+    for h in halves:
+        if h[0] is None: out.append(None)
+        else:
+            ops = h[4]
+            while ops[-1][0] not in {0, 7, 8}: ops.pop()  # trailing indels/introns
+            out.append(h)
+    return out
+
+
+def liftHalf(half, contigHalf, synthOffset, seqlen, hardclips):
+    chrom, genomeOffset, isPlus = contigHalf
+    refstart, refend, qstart, qend, ops = half
+    cigar = [(4, qstart)] if qstart > 0 else []
+    cigar += ops
+    if seqlen - qend > 0: cigar.append((4, seqlen - qend))
+    if hardclips[0] > 0: cigar.insert(0, (5, hardclips[0]))
+    if hardclips[1] > 0: cigar.append((5, hardclips[1]))
+    if isPlus:
+        pos = genomeOffset + (refstart - synthOffset)
+        return chrom, pos, cigar, False
+    else:
+        pos = genomeOffset - (refend - synthOffset)
+        return chrom, pos, cigar[::-1], True
+
+
+def genomeLengths(genome, outdir):
+    ###chromosome names and lengths from genome.fa.fai, or from a .fai built in outdir. The genome itself is never
+    ###indexed in place, it is usually a read-only mount (/Reference/genome.fa)
+    faiPaths = [genome + '.fai', os.path.join(outdir, os.path.basename(genome) + '.fai')]
+    for fai in faiPaths:
+        if os.path.isfile(fai) and os.path.getmtime(fai) >= os.path.getmtime(genome):
+            return [(line.split('\t')[0], int(line.split('\t')[1])) for line in open(fai)]
+    ##one pass over the genome, same 5 columns as samtools faidx so other tools can use it
+    records, name = [], None
+    offset = 0
+    with open(genome, 'rb') as f:
+        for line in f:
+            if line[:1] == b'>':
+                if name is not None: records.append((name, length, seqstart, linebases, linewidth))
+                name, length, seqstart, linebases, linewidth = line[1:].split()[0].decode(), 0, offset + len(line), 0, 0
+            elif name is not None:
+                if linebases == 0: linebases, linewidth = len(line.rstrip(b'\r\n')), len(line)
+                length += len(line.rstrip(b'\r\n'))
+            offset += len(line)
+    if name is not None: records.append((name, length, seqstart, linebases, linewidth))
+    tmp = faiPaths[1] + '.tmp' + str(os.getpid())
+    with open(tmp, 'w') as out:
+        for r in records: out.write('\t'.join([str(x) for x in r]) + '\n')
+    os.replace(tmp, faiPaths[1])
+    return [(r[0], r[1]) for r in records]
+
+
+def cigarString(cigar):
+    return ''.join([str(l) + 'MIDNSHP=X'[op] for op, l in cigar])
+
+
+def alignedLen(cigar):
+    return sum([l for op, l in cigar if op in {0, 7, 8}])
+
+
+keepReads = None
+if args.r:
+    keepReads = set()
+    isfastq = args.r.split('.')[-1] in ['fastq', 'fq']
+    for i, line in enumerate(open(args.r)):
+        if (isfastq and i % 4 == 0) or (not isfastq and line[0] == '>'):
+            keepReads.add(line[1:].rstrip().split(' ')[0])
+
+header = {'HD': {'VN': '1.6', 'SO': 'unsorted'},
+          'SQ': [{'SN': c, 'LN': l} for c, l in genomeLengths(args.g, os.path.dirname(os.path.abspath(args.o)))],
+          'PG': [{'ID': 'liftSyntheticToGenomeBam', 'PN': 'liftSyntheticToGenomeBam', 'CL': ' '.join(sys.argv)}]}
+
+synthfile = pysam.AlignmentFile(args.s, 'rb')
+tmpout = args.o + '.unsorted.bam'
+out = pysam.AlignmentFile(tmpout, 'wb', header=header)
+contigs = {}
+totLifted, totSplit, totSkipped = 0, 0, 0
+for s in synthfile.fetch(until_eof=True):
+    if s.is_unmapped or s.is_secondary: continue
+    if keepReads is not None and s.query_name not in keepReads: continue
+    if s.reference_name not in contigs: contigs[s.reference_name] = parseSyntheticContig(s.reference_name)
+    breakpoint, five, three = contigs[s.reference_name]
+    halves = splitCigarAtBreakpoint(s, breakpoint)
+    seqlen = s.query_length
+    hardclips = (s.cigartuples[0][1] if s.cigartuples[0][0] == 5 else 0,
+                 s.cigartuples[-1][1] if s.cigartuples[-1][0] == 5 else 0)
+    lifted = []
+    if halves[0]: lifted.append(liftHalf(halves[0], five, 0, seqlen, hardclips))
+    if halves[1]: lifted.append(liftHalf(halves[1], three, breakpoint, seqlen, hardclips))
+    if len(lifted) == 0:
+        totSkipped += 1
+        continue
+    totLifted += 1
+    if len(lifted) > 1: totSplit += 1
+    ##longest half keeps the original primary/supplementary flag, the other one is supplementary
+    primary = max(range(len(lifted)), key=lambda i: alignedLen(lifted[i][2]))
+    for i, (chrom, pos, cigar, flip) in enumerate(lifted):
+        a = pysam.AlignedSegment(out.header)
+        a.query_name = s.query_name
+        a.flag = s.flag & ~(0x10 | 0x800)
+        isReverse = s.is_reverse != flip
+        if isReverse: a.flag |= 0x10
+        if i != primary or s.is_supplementary: a.flag |= 0x800
+        a.reference_name = chrom
+        a.reference_start = pos
+        a.mapping_quality = s.mapping_quality
+        if s.query_sequence:
+            if flip:
+                a.query_sequence = s.query_sequence.translate(revcomp)[::-1]
+                if s.query_qualities is not None: a.query_qualities = s.query_qualities[::-1]
+            else:
+                a.query_sequence = s.query_sequence
+                if s.query_qualities is not None: a.query_qualities = s.query_qualities
+        a.cigartuples = cigar
+        a.set_tags([t for t in s.get_tags(with_value_type=True) if t[0] not in {'NM', 'MD', 'SA', 'ts', 'cs', 'ds'}])
+        others = [lifted[j] for j in range(len(lifted)) if j != i]
+        if len(others) > 0:
+            a.set_tag('SA', ''.join([','.join([o[0], str(o[1] + 1), '-' if s.is_reverse != o[3] else '+',
+                                                cigarString(o[2]), str(s.mapping_quality), '0']) + ';' for o in others]))
+        out.write(a)
+out.close()
+synthfile.close()
+
+pysam.sort('-o', args.o, tmpout)
+pysam.index(args.o)
+os.remove(tmpout)
+print('lifted alignments, split across breakpoint, not lifted', totLifted, totSplit, totSkipped)
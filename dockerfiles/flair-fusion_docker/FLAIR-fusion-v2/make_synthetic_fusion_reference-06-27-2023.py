@@ -8,11 +8,37 @@ parser.add_argument('-g', '--genome', action='store', dest='g', default="", help
 parser.add_argument('-a', '--anno', action='store', dest='a', default="", help='path to anno.gtf')
 parser.add_argument('-o', '--output', action='store', dest='o',
                     help='output file name base, if not specified, will be derived from reads file name. This will prefix all output files.')
+parser.add_argument('-s', '--supportedIsoPairs', action='store_true', dest='s',
+                    help='only annotate 5\'/3\' isoform pairs whose junction-adjacent exons are supported by chimeric read breakpoints')
+parser.add_argument('-b', '--readBreakpoints', action='store', dest='b', default="",
+                    help='per-read breakpoints (chimericReadBreakpoints.tsv), if not given the breakpoints in -r are used')
+parser.add_argument('-w', '--junctionWindow', action='store', dest='w', default=10, type=int,
+                    help='slack (bp) allowed between a read breakpoint and the intron flanking the junction-adjacent exon')
+parser.add_argument('-m', '--maxIsoPairs', action='store', dest='m', default=0, type=int,
+                    help='maximum number of isoform pairs annotated per fusion, best supported pairs are kept (0 = no cap)')
 args = parser.parse_args()
 
 prefix = '.'.join(args.r.split('.')[:-2])
 if args.o: prefix = args.o
 
+def junctionSupport(exons, finalBp, keepBelow, readBps, window):
+    ###count read breakpoints falling in the intron next to the exon that borders the fusion junction
+    ###exons are genomic and sorted left-right, keepBelow means this half of the gene lies left of the breakpoint
+    exons = sorted(exons)
+    if keepBelow:
+        kept = [i for i in range(len(exons)) if exons[i][1] < finalBp]
+        if len(kept) == 0: return 0
+        j = kept[-1]
+        lo = exons[j][1] - window
+        hi = exons[j+1][0] + window if j+1 < len(exons) else float('inf')
+    else:
+        kept = [i for i in range(len(exons)) if exons[i][0] > finalBp]
+        if len(kept) == 0: return 0
+        j = kept[0]
+        lo = exons[j-1][1] - window if j > 0 else float('-inf')
+        hi = exons[j][0] + window
+    return len([r for r in readBps if lo <= r <= hi])
+
 def revComp(seq):
     newseq = ''
     comp = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C', 'N':'N'}
@@ -42,6 +68,14 @@ for line in open(args.r):#'31-01-2023DRR059313-transcriptomeChimericBreakpoints-
         for g in fusion:
             fgeneslist.add(g)
 
+readBP = {}
+if args.b:
+    for line in open(args.b):
+        line = line.rstrip('\n').split('\t')
+        fusion = tuple(line[0].split('--'))
+        if fusion not in readBP: readBP[fusion] = {"5'gene":[], "3'gene":[]}
+        readBP[fusion][line[2]].extend([int(x) for x in line[3].split(',') if x != ''])
+
 ##load in genomic sequence
 genome = {}
 last = None
@@ -94,10 +128,15 @@ for line in open(args.a):#'/private/groups/brookslab/reference_annotations/genco
 out = open(prefix + '-syntheticFusionGenome.fa', 'w')#'syntheticFusionGenomeAttempt4.fa', 'w')
 annoOut = open(prefix + '-syntheticReferenceAnno.gtf', 'w')#'syntheticReferenceAnnoAttempt1.gtf', 'w')
 bpOut = open(prefix + '-syntheticBreakpointLoc.bed', 'w')#'syntheticFusionBreakpointLoc.bed', 'w')
+if args.s or args.m > 0:
+    pairCountOut = open(prefix + '-syntheticIsoPairCounts.tsv', 'w')
+    pairCountOut.write('\t'.join(['fusionName', 'allPairs', 'unsupportedPruned', 'capPruned', 'written', 'supportFallback']) + '\n')
+totPairs, totUnsupported, totCapped, totWritten, totFallback = 0, 0, 0, 0, 0
 for fusion in allBP:
     labels, sequence = [], []
     seqlen = 0
     isosByEnd = {"5'gene":{}, "3'gene":{}}
+    isoSupport = {"5'gene":{}, "3'gene":{}}
     startLoc = 0
     for end in ["5'gene", "3'gene"]:
         gene, thisChr = allBP[fusion][end][0][0], allBP[fusion][end][0][1]
@@ -119,8 +158,13 @@ for fusion in allBP:
         if fgenes[gene]['bounds'][3] == '-':
             sequence[-1] = revComp(sequence[-1])
         ###NEED TO ADD ALTERNATIVE ANNOTATION FOR ALTERNATIVE BREAKPOINTS, MAKE EXTRA TRANSCRIPT ANNOTATION
+        if fusion in readBP and len(readBP[fusion][end]) > 0: endReadBps = readBP[fusion][end]
+        else: endReadBps = [x[2] for x in allBP[fusion][end]]
+        keepBelow = (fgenes[gene]['bounds'][3] == '+') == (end == "5'gene")
         for tname in transcripts[gene]:
             isosByEnd[end][tname] = []
+            if args.s or args.m > 0:
+                isoSupport[end][tname] = junctionSupport(transcripts[gene][tname], finalBp, keepBelow, endReadBps, args.w)
             # if 'CCDC6' in tname:
             #     print(tname, end, fgenes[gene]['bounds'][3], medianBp, medianOuter, finalBp, finalOuter, transcripts[gene][tname])
             if fgenes[gene]['bounds'][3] == '+':
@@ -157,19 +201,44 @@ for fusion in allBP:
     # annoOut.write('\t'.join(['--'.join(labels), 'SYNTHFUSION', 'gene', '1', str(len(''.join(sequence))+1), '.', '+', '.','gene_id "' + '--'.join(fusion) + '"']) + '\n')
     annoOut.write('\t'.join(['--'.join(labels), 'SYNTHFUSION', 'gene', '1', str(seqlen+1), '.', '+', '.','gene_id "' + '--'.join(fusion) + '"']) + '\n')
 
+    isoPairs = []
     for fiveIso in isosByEnd["5'gene"]:
         if len(isosByEnd["5'gene"][fiveIso]) > 0:
             for threeIso in isosByEnd["3'gene"]:
                 if len(isosByEnd["3'gene"][threeIso]) > 0:
-                    annoOut.write('\t'.join(['--'.join(labels), 'SYNTHFUSION', 'transcript', str(isosByEnd["5'gene"][fiveIso][0][0]+1), str(isosByEnd["3'gene"][threeIso][-1][-1]), '.', '+', '.','; '.join(['gene_id "' + '--'.join(fusion) + '"', 'transcript_id "' + '--'.join([fiveIso, threeIso]) + '"'])]) + '\n')
-                    for exon in isosByEnd["5'gene"][fiveIso]:
-                        annoOut.write('\t'.join(['--'.join(labels), 'SYNTHFUSION', 'exon', str(exon[0]+1),str(exon[1]), '.', '+', '.', '; '.join(['gene_id "' + '--'.join(fusion) + '"', 'transcript_id "' + '--'.join([fiveIso, threeIso]) + '"'])]) + '\n')
-                    for exon in isosByEnd["3'gene"][threeIso]:
-                        annoOut.write('\t'.join(['--'.join(labels), 'SYNTHFUSION', 'exon', str(exon[0]+1),str(exon[1]), '.', '+', '.','; '.join(['gene_id "' + '--'.join(fusion) + '"', 'transcript_id "' + '--'.join([fiveIso, threeIso]) + '"'])]) + '\n')
+                    isoPairs.append((fiveIso, threeIso))
+    allPairs = len(isoPairs)
+    supportFallback = False
+    if args.s:
+        supportedPairs = [x for x in isoPairs if isoSupport["5'gene"][x[0]] > 0 and isoSupport["3'gene"][x[1]] > 0]
+        ##no pair is supported (e.g. breakpoints off the annotated exons), keep them all so the fusion still gets transcripts
+        if len(supportedPairs) > 0: isoPairs = supportedPairs
+        elif allPairs > 0:
+            supportFallback = True
+            totFallback += 1
+            print('no supported isoform pair, keeping all pairs for', '--'.join(fusion))
+    unsupportedPruned = allPairs - len(isoPairs)
+    if args.m > 0 and len(isoPairs) > args.m:
+        ##sort is stable, so equally supported pairs keep annotation order
+        isoPairs = sorted(isoPairs, key=lambda x: isoSupport["5'gene"][x[0]] + isoSupport["3'gene"][x[1]], reverse=True)[:args.m]
+    capPruned = allPairs - unsupportedPruned - len(isoPairs)
+    totPairs, totUnsupported, totCapped, totWritten = totPairs + allPairs, totUnsupported + unsupportedPruned, totCapped + capPruned, totWritten + len(isoPairs)
+    if args.s or args.m > 0:
+        pairCountOut.write('\t'.join(['--'.join(fusion), str(allPairs), str(unsupportedPruned), str(capPruned), str(len(isoPairs)), str(int(supportFallback))]) + '\n')
+    for fiveIso, threeIso in isoPairs:
+        annoOut.write('\t'.join(['--'.join(labels), 'SYNTHFUSION', 'transcript', str(isosByEnd["5'gene"][fiveIso][0][0]+1), str(isosByEnd["3'gene"][threeIso][-1][-1]), '.', '+', '.','; '.join(['gene_id "' + '--'.join(fusion) + '"', 'transcript_id "' + '--'.join([fiveIso, threeIso]) + '"'])]) + '\n')
+        for exon in isosByEnd["5'gene"][fiveIso]:
+            annoOut.write('\t'.join(['--'.join(labels), 'SYNTHFUSION', 'exon', str(exon[0]+1),str(exon[1]), '.', '+', '.', '; '.join(['gene_id "' + '--'.join(fusion) + '"', 'transcript_id "' + '--'.join([fiveIso, threeIso]) + '"'])]) + '\n')
+        for exon in isosByEnd["3'gene"][threeIso]:
+            annoOut.write('\t'.join(['--'.join(labels), 'SYNTHFUSION', 'exon', str(exon[0]+1),str(exon[1]), '.', '+', '.','; '.join(['gene_id "' + '--'.join(fusion) + '"', 'transcript_id "' + '--'.join([fiveIso, threeIso]) + '"'])]) + '\n')
 
 
 
 # out.close()
 annoOut.close()
 bpOut.close()
+if args.s or args.m > 0:
+    pairCountOut.close()
+print('isoform pairs, pruned unsupported, pruned by cap, written', totPairs, totUnsupported, totCapped, totWritten)
+if args.s: print('fusions without a supported isoform pair, annotated with all pairs', totFallback)
 
@@ -1,4 +1,4 @@
-import re, time, sys, os, pysam, argparse
+import re, time, sys, os, pysam, argparse, pickle
 from collections import defaultdict
 from statistics import median
 
@@ -49,6 +49,8 @@ parser.add_argument('-a', '--anno', action='store', dest='a',
                     help='path to anno.gtf')
 parser.add_argument('-o', '--output', action='store', dest='o',
                     help='output file name base, if not specified, will be derived from reads file name. This will prefix all output files.')
+parser.add_argument('-t', '--chimeraState', action='store', dest='t', default="",
+                    help='chimera state file (.pkl) for incremental calling: the reads in -r/-s are added to it as a new batch and the fusions are called again from all batches so far')
 args = parser.parse_args()
 args.b = int(args.b)
 args.l = int(args.l)
@@ -100,38 +102,125 @@ print('intron to genome reference loaded')
 
 flagbinary = {'0': 0, '2048': 0, '16': 1, '2064': 1, '256': 0, '272': 1}
 
-# aligncount = {}
-# alignlen = {}
-timestart = time.time()
-alignlen = defaultdict(lambda: defaultdict(list))
-##NEW VERSION WITH PYSAM
-##this now uses bam, not sam file
-samfile = pysam.AlignmentFile(args.s,
-                              "rb")  # "sim-avg-10x-gencode38-fusion-sim-test-06-12-2023.transcriptomeAligned.sorted.bam", "rb")
-for s in samfile:
-    if s.is_mapped:
-        readname = s.query_name
-        geneinfo = s.reference_name.split('|')
-        genename, tname = geneinfo[5] + '*' + geneinfo[1], geneinfo[4]
-        # if genename == 'Gm49410*ENSMUSG00000115979.2' or genename == 'Apol7a*ENSMUSG00000010601.15':
-        tstart, tend = s.reference_start, s.reference_end
-        # fastqstart, fastqend = s.query_alignment_start, s.query_alignment_end ###THIS DOESN'T WORK, IGNORES HARD-CLIPPED BASES
-        cigar = s.cigartuples
-        readlen = s.infer_read_length()
-        if cigar[0][0] == 0:
-            fastqstart = 0  # 'M':
-        else:
-            fastqstart = cigar[0][1]
-        if cigar[-1][0] == 0:
-            fastqend = readlen
-        else:
-            fastqend = readlen - cigar[-1][1]
-        if s.is_reverse:
-            fastqstart, fastqend = readlen - fastqstart, readlen - fastqend
-        thisalignlen = s.get_cigar_stats()[0][0]
-        alignlen[readname][genename].append([fastqstart, fastqend, thisalignlen, tname, tstart, tend])
-print(time.time() - timestart)
-print('alignment file processed')
+
+def readAlignments(bampath):
+    # aligncount = {}
+    # alignlen = {}
+    timestart = time.time()
+    alignlen = defaultdict(lambda: defaultdict(list))
+    ##NEW VERSION WITH PYSAM
+    ##this now uses bam, not sam file
+    samfile = pysam.AlignmentFile(bampath,
+                                  "rb")  # "sim-avg-10x-gencode38-fusion-sim-test-06-12-2023.transcriptomeAligned.sorted.bam", "rb")
+    for s in samfile:
+        if s.is_mapped:
+            readname = s.query_name
+            geneinfo = s.reference_name.split('|')
+            genename, tname = geneinfo[5] + '*' + geneinfo[1], geneinfo[4]
+            # if genename == 'Gm49410*ENSMUSG00000115979.2' or genename == 'Apol7a*ENSMUSG00000010601.15':
+            tstart, tend = s.reference_start, s.reference_end
+            # fastqstart, fastqend = s.query_alignment_start, s.query_alignment_end ###THIS DOESN'T WORK, IGNORES HARD-CLIPPED BASES
+            cigar = s.cigartuples
+            readlen = s.infer_read_length()
+            if cigar[0][0] == 0:
+                fastqstart = 0  # 'M':
+            else:
+                fastqstart = cigar[0][1]
+            if cigar[-1][0] == 0:
+                fastqend = readlen
+            else:
+                fastqend = readlen - cigar[-1][1]
+            if s.is_reverse:
+                fastqstart, fastqend = readlen - fastqstart, readlen - fastqend
+            thisalignlen = s.get_cigar_stats()[0][0]
+            alignlen[readname][genename].append([fastqstart, fastqend, thisalignlen, tname, tstart, tend])
+    print(time.time() - timestart)
+    print('alignment file processed')
+    return alignlen
+
+
+def keepChimericReads(alignlen):
+    ##only reads aligned to more than one gene are looked at after this, so only these are kept (and saved in the chimera state)
+    return {r: dict(alignlen[r]) for r in alignlen if len(alignlen[r].keys()) > 1}
+
+
+def writeSelectedReads(readsfiles, readnames, outfile):
+    ##writes the fastq/fasta records of the given reads from one reads file or a list of them (all of one format), returns the output file name
+    if isinstance(readsfiles, str): readsfiles = [readsfiles]
+    if len(readsfiles) == 0: return None
+    if readsfiles[0].split('.')[-1] == 'fastq' or readsfiles[0].split('.')[-1] == 'fq':
+        outfile += '.fastq'
+        out5 = open(outfile, 'w')
+        for readsfile in readsfiles:
+            last = False
+            for line in open(readsfile):
+                if line[0] == '@':
+                    if line.lstrip('@').split(' ')[0] in readnames:
+                        last = True
+                    else:
+                        last = False
+                if last: out5.write(line)
+    elif readsfiles[0].split('.')[-1] == 'fasta' or readsfiles[0].split('.')[-1] == 'fa':
+        outfile += '.fasta'
+        out5 = open(outfile, 'w')
+        for readsfile in readsfiles:
+            last = False
+            for line in open(readsfile):
+                if line[0] == '>':
+                    if line.rstrip().lstrip('>').split(' ')[0] in readnames:
+                        last = True
+                    else:
+                        last = False
+                if last: out5.write(line)
+    else:
+        return None
+    out5.close()
+    return outfile
+
+
+###incremental mode: the state keeps the alignments of chimeric reads from every batch so far (reads are assumed to be in one batch only)
+###a new batch only needs its own bam and reads parsed, calling below is then rerun on the chimeric reads, which are a small part of all reads
+###in incremental mode chimeras, genes and reads are looked at in sorted order (ordered below), so the calls from the state are the
+###same as one run over all batches. The calling is not limited to the chimeras of the new batch (paralog and genome distance groups
+###span chimeras), so each batch costs as much as calling once on the chimeric reads of all batches so far
+if args.t:
+    if os.path.isfile(args.t):
+        state = pickle.load(open(args.t, 'rb'))
+    else:
+        state = {'batches': [], 'alignedReads': 0, 'alignlen': {}, 'reads': []}
+    batch = os.path.realpath(args.r)
+    if batch in state['batches']:
+        print('batch already in chimera state, calling again', batch)
+    else:
+        batchalignlen = readAlignments(args.s)
+        state['alignedReads'] += len(batchalignlen.keys())
+        batchalignlen = keepChimericReads(batchalignlen)
+        for r in batchalignlen:
+            if r in state['alignlen']:
+                for g in batchalignlen[r]:
+                    state['alignlen'][r].setdefault(g, []).extend(batchalignlen[r][g])
+            else:
+                state['alignlen'][r] = batchalignlen[r]
+        ##each batch gets its own reads file, named by the batch number, which is only in the state once the state is replaced below
+        ##so a run that stops before that writes the same file again when the batch is rerun, and no reads are added twice
+        readsfile = writeSelectedReads(args.r, batchalignlen, args.t + '.chimericReads.' + str(len(state['batches'])))
+        if readsfile: state['reads'].append(readsfile)
+        state['batches'].append(batch)
+        pickle.dump(state, open(args.t + '.tmp', 'wb'))
+        os.replace(args.t + '.tmp', args.t)
+        print('batches, chimeric reads in chimera state', len(state['batches']), len(state['alignlen'].keys()))
+    alignedReads, alignlen, readsfile = state['alignedReads'], state['alignlen'], state['reads']
+else:
+    alignlen = readAlignments(args.s)
+    alignedReads = len(alignlen.keys())
+    alignlen = keepChimericReads(alignlen)
+    readsfile = args.r
+
+
+def ordered(items, key=None):
+    ##sorted in incremental mode, otherwise the order of a one-shot run is kept as it always was
+    if args.t: return sorted(items, key=key)
+    return list(items)
 
 ###save start and end positions on fastq read
 ##while going through chim, get outside start and end positions for each gene for each read
@@ -143,14 +232,15 @@ print('alignment file processed')
 
 chimToReads = {}
 totChimReads = 0
-for r in alignlen:
+for r in ordered(alignlen):
     if len(alignlen[r].keys()) > 1:
         totChimReads += 1
         chimname = frozenset(alignlen[r].keys())
         if chimname not in chimToReads: chimToReads[chimname] = set()
         chimToReads[chimname].add(r)
+chimToReads = {c: chimToReads[c] for c in ordered(chimToReads, key=sorted)}
 print('chimeras compressed')
-print('total aligned reads, chimeric fraction', len(alignlen.keys()), totChimReads / len(alignlen.keys()))
+print('total aligned reads, chimeric fraction', alignedReads, totChimReads / alignedReads)
 print('total chimeras, chimeric reads', len(chimToReads.keys()), totChimReads)
 
 
@@ -160,7 +250,7 @@ def removeParalogs(chimToReads, alignlen):
     tempParaSets = {}
     for chim in chimToReads:
         if len(chimToReads[chim]) > 0:  ##removed #more than one read support
-            genes = list(chim)
+            genes = ordered(chim)
             # print('genes', genes)
             paralogSets1 = []
             for g in genes:
@@ -261,7 +351,7 @@ def removeParalogs(chimToReads, alignlen):
                     chimname.append(list(group)[0])
                 else:
                     geneToAlignLen = {}
-                    for gene in group:
+                    for gene in ordered(group):
                         geneToAlignLen[gene] = []
                         for read in tempParaSets2[frozenParaSets]:
                             if gene in alignlen[
@@ -293,7 +383,7 @@ rejectOut = open(prefix + '-rejectedChimerasAfterParaRemoved.tsv', 'w')
 genomeCloseRemovedChimToReads = {}
 for chim in paraRemovedChimToReads:
     if len(paraRemovedChimToReads[chim]) > 1:
-        genes = list(chim)
+        genes = ordered(chim)
         # if 'ZNF765' in genes: print('paraRemovedChimToReads', genes)
         groupsGenomeDist = []
         done = set()
@@ -315,7 +405,7 @@ for chim in paraRemovedChimToReads:
                         groupsGenomeDist.append(frozenset({g2, }))
                     done.add(frozenset((g1, g2)))
         finalGroupsGenomeDist = []
-        groupsGenomeDist = sorted(list(set(groupsGenomeDist)), key=len, reverse=True)
+        groupsGenomeDist = sorted(ordered(set(groupsGenomeDist), key=sorted), key=len, reverse=True)
         # print('initial groups', groupsGenomeDist)
         if len(groupsGenomeDist) != len(genes):
             while len(groupsGenomeDist) > 0:
@@ -344,7 +434,7 @@ for chim in paraRemovedChimToReads:
                         chimname.append(list(group)[0])
                     else:
                         geneToAlignLen = {}
-                        for gene in group:
+                        for gene in ordered(group):
                             geneToAlignLen[gene] = []
                             for read in paraRemovedChimToReads[chim]:
                                 if gene in alignlen[
@@ -380,13 +470,14 @@ out = open(prefix + '-fusionReadCounts.tsv',
            'w')  # 'sim-nice-10x-gencode38-fusion-sim-test-06-12-2023.transcriptomeAligned-readCounts-para-genomedist-fastqdist-removed-keep-1rs-combine-chim.tsv', 'w')
 out3 = open(prefix + 'genomeChunksToCut.bed', 'w')
 out4 = open(prefix + 'chimericBreakpoints.tsv', 'w')
+out7 = open(prefix + 'chimericReadBreakpoints.tsv', 'w') ##per-read breakpoints, used to prune synthetic isoform pairs
 out6 = open(prefix + 'fusionWithSupportingReads.tsv', 'w')
 
 # fusionReads = set()
 readToFusion = {}
 # check fastq distance between alignments
 for chimname in genomeCloseRemovedChimToReads:
-    genes = list(chimname)
+    genes = ordered(chimname)
     fastqdistoverlap = False
     fastqdistpaircomp = {}
     if len(genomeCloseRemovedChimToReads[chimname]) >= args.l:  # default read support = 3
@@ -425,7 +516,7 @@ for chimname in genomeCloseRemovedChimToReads:
             for gene in genes:
                 geneToGenomePos[gene] = {'bp': [], 'outer': []}
                 geneToOuterTPos[gene] = []
-            for read in genomeCloseRemovedChimToReads[chimname]:
+            for read in ordered(genomeCloseRemovedChimToReads[chimname]):
                 allBestTPos = []
                 for gene in genes:
                     if gene in alignlen[read]:  ##[locs[0], locs[1], thisalignlen, tname, tstart, tend]
@@ -473,7 +564,7 @@ for chimname in genomeCloseRemovedChimToReads:
             if min(temp) > 1:
                 geneOrder = sorted([(median(geneToOuterTPos[g]), g) for g in geneToOuterTPos.keys()])
                 fusionname = '--'.join([x[1] for x in geneOrder])
-                chimoutlines, bedoutlines = '', ''
+                chimoutlines, bedoutlines, readbpoutlines = '', '', ''
                 bpatendofgene = False
 
                 # print(geneToGenomePos)
@@ -496,6 +587,8 @@ for chimname in genomeCloseRemovedChimToReads:
                     chimoutlines += '\t'.join(
                         [fusionname, gene, fusionend, genePos[gene][0], str(coord[0]), str(coord[1]),
                          str(len(genomeCloseRemovedChimToReads[chimname]))]) + '\n'
+                    readbpoutlines += '\t'.join(
+                        [fusionname, gene, fusionend, ','.join([str(x) for x in geneToGenomePos[gene]['bp']])]) + '\n'
                     coord.sort()
 
                     ###DONT LIKE SAVING END AS TEXT, SHOULD JUST SAVE GENE ORDER AS NUMBERS - FIRST GENE IS 0, etc
@@ -508,6 +601,7 @@ for chimname in genomeCloseRemovedChimToReads:
                     #     out3.write('\t'.join([genePos[gene][0], str(coord[0]), str(coord[1]), '-'.join(genes) + '--' + gene]) + '\n')
                 # if not bpatendofgene:
                 out4.write(chimoutlines)
+                out7.write(readbpoutlines)
                 out3.write(bedoutlines)
 
                 chimAfterFastqDistRemoved += 1
@@ -515,7 +609,7 @@ for chimname in genomeCloseRemovedChimToReads:
 
                 out.write('-'.join(genes) + '\t' + str(len(genomeCloseRemovedChimToReads[chimname])) + '\n')
                 # fusionReads = fusionReads | genomeCloseRemovedChimToReads[chimname]
-                out6.write('-'.join(genes) + '\t' + ','.join(genomeCloseRemovedChimToReads[chimname]) + '\n')
+                out6.write('-'.join(genes) + '\t' + ','.join(ordered(genomeCloseRemovedChimToReads[chimname])) + '\n')
                 for i in genomeCloseRemovedChimToReads[chimname]: readToFusion[i] = '-'.join(genes)
             else:
                 rejectOut.write('--'.join(genes) + '\t' + 'edgeOfGene' + '\n')
@@ -530,24 +624,4 @@ print('chim, reads after removing fastq dist', chimAfterFastqDistRemoved, readsA
 # print(readToFusion)
 
 if chimAfterFastqDistRemoved > 0:
-    if args.r.split('.')[-1] == 'fastq' or args.r.split('.')[-1] == 'fq':
-        out5 = open(prefix + '-fusionOnly.fastq', 'w')
-        last = False
-        for line in open(args.r):
-            if line[0] == '@':
-                if line.lstrip('@').split(' ')[0] in readToFusion:
-                    last = True
-                else:
-                    last = False
-            if last: out5.write(line)
-    elif args.r.split('.')[-1] == 'fasta' or args.r.split('.')[-1] == 'fa':
-        out5 = open(prefix + '-fusionOnly.fasta', 'w')
-        last = False
-        for line in open(args.r):
-            if line[0] == '>':
-                if line.rstrip().lstrip('>').split(' ')[0] in readToFusion:
-                    last = True
-                else:
-                    last = False
-            if last: out5.write(line)
-
+    writeSelectedReads(readsfile, readToFusion, prefix + '-fusionOnly')
@@ -0,0 +1,188 @@
+import sys, os, argparse, glob, shutil, subprocess
+from multiprocessing.pool import ThreadPool
+
+parser = argparse.ArgumentParser(description='FLAIR-fusion 2.0 parse options',
+                                 usage='python3 shardSyntheticFlair.py -o prefix -r reads.[fq/fa] -w workers')
+parser.add_argument('-o', '--output', action='store', dest='o', default="",
+                    help='output file name base used by fusionfindingpipeline.py')
+parser.add_argument('-r', '--reads', action='store', dest='r', default="",
+                    help='fusion reads realigned to the synthetic genome (-fusionOnly.[fa/fq])')
+parser.add_argument('-w', '--workers', action='store', dest='w', default=4, type=int,
+                    help='number of shards run at the same time')
+parser.add_argument('-k', '--keepShards', action='store_true', dest='k',
+                    help='keep the per-shard folder after merging')
+args = parser.parse_args()
+
+###synthetic fusion contigs that share no reads are independent, so flair correct/collapse can run on groups of contigs
+###contigs that share a read are kept in one shard, so every read is assigned to isoforms by one collapse run only
+###the outputs are merged back to the names a single run over the whole synthetic genome writes, in synthetic genome contig order
+
+prefix = args.o
+readext = args.r.split('.')[-1]
+genome = prefix + '-syntheticFusionGenome.fa'
+anno = prefix + '-syntheticReferenceAnno.gtf'
+bed = prefix + '-fusionOnly.syntheticAligned.bed'
+correctBase = prefix + '-fusionOnly.syntheticAligned-flair'
+collapseBase = prefix + '-fusionOnly.syntheticAligned-flair.collapse'
+sharddir = prefix + '-fusionOnly.shards/'
+
+##count reads per contig so shards get similar amounts of work, and join contigs that share a read (union-find)
+contigReads, contigRank = {}, {}
+for line in open(genome):
+    if line[0] == '>':
+        contig = line[1:].rstrip().split(' ')[0]
+        contigReads[contig], contigRank[contig] = 0, len(contigRank)
+parent, readContig = {}, {}
+
+
+def findGroup(contig):
+    while parent[contig] != contig:
+        parent[contig] = parent[parent[contig]]
+        contig = parent[contig]
+    return contig
+
+
+for line in open(bed):
+    line2 = line.rstrip('\n').split('\t')
+    if line2[0] not in contigReads: continue
+    contigReads[line2[0]] += 1
+    parent.setdefault(line2[0], line2[0])
+    if line2[3] in readContig:
+        a, b = findGroup(readContig[line2[3]]), findGroup(line2[0])
+        if a != b: parent[max(a, b, key=contigRank.get)] = min(a, b, key=contigRank.get)
+    else:
+        readContig[line2[3]] = line2[0]
+
+groups = {}
+for contig in parent:
+    groups.setdefault(findGroup(contig), []).append(contig)
+groupReads = {g: sum(contigReads[c] for c in groups[g]) for g in groups}
+nshards = max(1, min(args.w, len(groups)))
+shardLoad, contigToShard = [0] * nshards, {}
+for g in sorted(groups, key=lambda g: (-groupReads[g], contigRank[g])):
+    i = shardLoad.index(min(shardLoad))
+    for contig in groups[g]: contigToShard[contig] = i
+    shardLoad[i] += groupReads[g]
+print('synthetic contigs, contig groups sharing reads, shards', len(contigToShard), len(groups), nshards)
+
+if os.path.isdir(sharddir): shutil.rmtree(sharddir)
+shardBase = []
+for i in range(nshards):
+    os.makedirs(sharddir + 'shard' + str(i))
+    shardBase.append(sharddir + 'shard' + str(i) + '/' + prefix.split('/')[-1])
+
+
+def splitByContig(infile, suffix, getContig):
+    outs = [open(shardBase[i] + suffix, 'w') for i in range(nshards)]
+    last = None
+    for line in open(infile):
+        contig = getContig(line)
+        if contig is not None: last = contigToShard.get(contig)
+        if last is not None: outs[last].write(line)
+    for o in outs: o.close()
+
+
+splitByContig(genome, '-syntheticFusionGenome.fa', lambda line: line[1:].rstrip().split(' ')[0] if line[0] == '>' else None)
+splitByContig(anno, '-syntheticReferenceAnno.gtf', lambda line: line.split('\t')[0] if line[0] != '#' else None)
+splitByContig(bed, '-fusionOnly.syntheticAligned.bed', lambda line: line.split('\t')[0])
+
+##every read is in exactly one shard (the shard of all contigs it aligned to)
+outs = [open(shardBase[i] + '-fusionOnly.' + readext, 'w') for i in range(nshards)]
+header = '@' if readext in ['fastq', 'fq'] else '>'
+this = None
+for line in open(args.r):
+    if line[0] == header:
+        contig = readContig.get(line[1:].rstrip().split(' ')[0])
+        this = contigToShard[contig] if contig is not None else None
+    if this is not None: outs[this].write(line)
+for o in outs: o.close()
+
+
+def runShard(base):
+    ##returns the shard and the return codes of flair correct and collapse (collapse is not run if correct failed)
+    correct = subprocess.call(
+        ['flair', 'correct', '-q', base + '-fusionOnly.syntheticAligned.bed',
+         '-g', base + '-syntheticFusionGenome.fa',
+         '-f', base + '-syntheticReferenceAnno.gtf',
+         '--output', base + '-fusionOnly.syntheticAligned-flair'],
+        stdout=subprocess.DEVNULL)
+    if correct != 0: return base, correct, None
+    collapse = subprocess.call(
+        ['flair', 'collapse', '-q', base + '-fusionOnly.syntheticAligned-flair_all_corrected.bed',
+         '-r', base + '-fusionOnly.' + readext,
+         '-g', base + '-syntheticFusionGenome.fa',
+         '--gtf', base + '-syntheticReferenceAnno.gtf',
+         '--annotation_reliant', 'generate', '--generate_map', '--check_splice',
+         '--output', base + '-fusionOnly.syntheticAligned-flair.collapse'],
+        stdout=subprocess.DEVNULL)
+    return base, correct, collapse
+
+
+pool = ThreadPool(nshards)
+failed = []
+for base, correct, collapse in pool.imap_unordered(runShard, shardBase):
+    if correct != 0 or collapse != 0:
+        failed.append(base.split('/')[-2])
+        print('flair correct/collapse failed for', base.split('/')[-2], 'return codes', correct, collapse)
+    else:
+        print('flair correct/collapse done for', base.split('/')[-2])
+pool.close()
+pool.join()
+if failed:
+    ##no merged output, a partial merge would look like a complete run
+    sys.exit('flair failed in ' + str(len(failed)) + ' of ' + str(nshards) + ' shards, shard outputs kept in ' + sharddir)
+
+
+##record names (bed name column) -> contig, to place records whose first field is not a contig (isoforms.fa, read map)
+nameToContig = {}
+for base in shardBase:
+    for f in glob.glob(base + '-fusionOnly.syntheticAligned-flair*.bed'):
+        for line in open(f):
+            line2 = line.rstrip('\n').split('\t')
+            if len(line2) > 3 and line2[0] in contigRank: nameToContig[line2[3]] = line2[0]
+
+
+def lineContig(line):
+    ##contig of a line that starts a record, None for lines that continue the record above (sequence lines)
+    first = line.rstrip('\n').split('\t')[0]
+    if first in contigRank: return first
+    if first[:1] == '>': first = first[1:].split(' ')[0]
+    return nameToContig.get(first)
+
+
+def readRecords(path):
+    ##records of one shard file as (contig rank, lines); lines before the first record are returned separately
+    head, records = [], []
+    for line in open(path):
+        contig = lineContig(line)
+        if contig is not None: records.append((contigRank[contig], [line]))
+        elif records: records[-1][1].append(line)
+        else: head.append(line)
+    return head, records
+
+
+def mergeOutputs(shardSuffix, outBase, sep):
+    ###merge every file the shards wrote with this base name, correct names its outputs base_*, collapse names them base.*
+    ###records are put back in synthetic genome contig order (the records of one contig come from one shard, in its order)
+    ###lines before the first record (headers) are written once
+    suffixes = set()
+    for base in shardBase:
+        for f in glob.glob(base + shardSuffix + '*'):
+            if os.path.isfile(f): suffixes.add(f[len(base + shardSuffix):])
+    for suffix in sorted(suffixes):
+        if suffix[:1] != sep: continue
+        head, records = None, []
+        for base in shardBase:
+            if os.path.isfile(base + shardSuffix + suffix):
+                shardHead, shardRecords = readRecords(base + shardSuffix + suffix)
+                if head is None: head = shardHead
+                records.extend(shardRecords)
+        records.sort(key=lambda r: r[0])
+        with open(outBase + suffix, 'w') as out:
+            out.writelines(head or [])
+            for rank, lines in records: out.writelines(lines)
+
+
+mergeOutputs('-fusionOnly.syntheticAligned-flair', correctBase, '_')
+mergeOutputs('-fusionOnly.syntheticAligned-flair.collapse', collapseBase, '.')
+if not args.k: shutil.rmtree(sharddir)
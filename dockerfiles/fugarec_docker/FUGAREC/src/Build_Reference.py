@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+# FUGAREC が読む参照の表と index を作る
+#   {genome}_{gtf}.tab.usecol : name,chrom,strand,txStart,txEnd,name2 (transcriptごと。UCSC の genePred と同じ0始まりの座標)
+#   {genome}_{gtf}.tab.exon   : gene,chrom,exstart,exend (遺伝子ごとに重複を除いたexon)
+#   {genome}_{gtf}.index.npz  : 遺伝子の区間index, exonのindexと表, transcript -> 遺伝子の整数map
+#   {genome}_{gtf}.manifest.json : 上の3ファイルの sha256。表を書き換えると index は使われず、表から作り直す
+# GTF を渡すと2つの表をGTFから作る。渡さなければ既にある表から index と manifest だけを作る
+# name は GTF の transcript_id (GENCODE の transcriptome.fa の "|" 区切りの1番目)、name2 は gene_name (無ければ gene_id)
+# --index-dir DIR: index と manifest を表の隣ではなく DIR に書く (表の場所に書き込めないとき。読む側は環境変数 FUGAREC_INDEX_DIR=DIR で探す)
+# --if-needed: 表と合う index が既にあれば何もしない (run_FUGAREC.sh が毎回呼ぶ)
+# usage: python Build_Reference.py reference_data_path genome_name gtf_name [genes.gtf] [--index-dir DIR] [--if-needed]
+import sys
+import os
+import pandas as pd
+from fugarec_utils import reference_files, file_sha256, write_reference_index, find_reference_index
+from gap_realigner import load_exon
+
+GTF_COL = ['chrom', 'source', 'feature', 'start', 'end', 'score', 'strand', 'frame', 'attribute']
+
+
+def gtf_attribute(attr, key):
+    return attr.str.extract(f'{key} "([^"]*)"', expand=False)
+
+
+def read_gtf_exon(source_gtf_path):
+    # GTF の exon の行を transcript_id, gene, chrom, strand, exstart (0始まり), exend で読む
+    gtf = pd.read_csv(source_gtf_path, sep='\t', comment='#', header=None, names=GTF_COL,
+                      usecols=['chrom', 'feature', 'start', 'end', 'strand', 'attribute'], dtype={'chrom': str})
+    exon = gtf[gtf['feature'] == 'exon'].reset_index(drop=True)
+    gene = gtf_attribute(exon['attribute'], 'gene_name')
+    exon['gene'] = gene.fillna(gtf_attribute(exon['attribute'], 'gene_id'))
+    exon['transcript_id'] = gtf_attribute(exon['attribute'], 'transcript_id')
+    exon['exstart'] = exon['start'] - 1
+    exon['exend'] = exon['end']
+    return exon.dropna(subset=['transcript_id'])[['transcript_id', 'gene', 'chrom', 'strand', 'exstart', 'exend']]
+
+
+def make_usecol_table(exon):
+    # transcript の範囲は exon の最小の start から最大の end まで (GTF の順)
+    tx = exon.groupby('transcript_id', sort=False).agg(chrom=('chrom', 'first'), strand=('strand', 'first'),
+                                                       txStart=('exstart', 'min'), txEnd=('exend', 'max'), name2=('gene', 'first'))
+    return tx.reset_index().rename(columns={'transcript_id': 'name'})[['name', 'chrom', 'strand', 'txStart', 'txEnd', 'name2']]
+
+
+def make_exon_table(exon):
+    return exon[['gene', 'chrom', 'exstart', 'exend']].drop_duplicates().reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    index_dir=None
+    if '--index-dir' in sys.argv:
+        i=sys.argv.index('--index-dir')
+        index_dir=sys.argv[i+1]
+        del sys.argv[i:i+2]
+    if_needed='--if-needed' in sys.argv
+    if if_needed:
+        sys.argv.remove('--if-needed')
+    reference_data_path=sys.argv[1]
+    genome_name=sys.argv[2]
+    gtf_name=sys.argv[3]
+    source_gtf_path=sys.argv[4] if len(sys.argv) > 4 else None
+
+    prefix = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}")
+    files = reference_files(prefix, index_dir)
+    if if_needed and source_gtf_path is None:
+        found, _ = find_reference_index(prefix, [None, index_dir] if index_dir is not None else None)
+        if found is not None:
+            print(f'index is up to date: {found["index"]}')
+            sys.exit(0)
+    source = None
+    if source_gtf_path is not None:
+        exon = read_gtf_exon(source_gtf_path)
+        make_usecol_table(exon).to_csv(files['usecol'], index=False)
+        make_exon_table(exon).to_csv(files['exon'], index=False)
+        source = {'gtf': os.path.abspath(source_gtf_path), 'sha256': file_sha256(source_gtf_path)}
+    for key in ['usecol', 'exon']:
+        if not os.path.exists(files[key]):
+            sys.exit(f'{files[key]} not found (give the GTF as the 4th argument to make it)')
+
+    write_reference_index(prefix, load_exon(files['exon'], files['usecol']), source, index_dir)
+    for key in ['usecol', 'exon', 'index', 'manifest']:
+        print(f'{key}: {files[key]}')
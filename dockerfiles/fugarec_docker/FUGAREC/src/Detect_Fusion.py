@@ -1,17 +1,6 @@
 #!/usr/bin/env python
 # coding: utf-8
 import sys
-root = sys.argv[1]
-TARGET=sys.argv[2] #TARGET="MCF7"
-reference_data_path=sys.argv[3]
-genome_name=sys.argv[4] #"hg38"
-gtf_name=sys.argv[5] #"genCode44"
-
-# root = "/data2/chimericRNA_detection/datasets/real_data/K562"
-# TARGET="MCF7" #TARGET="MCF7"
-# reference_data_path="/data2/chimericRNA_detection/code/Reference_data"
-# genome_name="hg38" #"hg38"
-# gtf_name="genCode44" #"genCode44"
 
 mapping_rate_criteria_trans=0.99
 buffer=15
@@ -29,6 +18,10 @@ gap_mapping_rate_cutoff=0.5
 gap_evalue_cutoff=0.05
 buffer=15
 
+# 中間ファイルのうち Detect_Fusion で使う列 (parquet ならこの列だけ読む)
+genome_intermediate_col=['Qname','Qlen','dir','Tname','mapQ','Nth_hit','gene','exstart','diff_s','exend','diff_e','Qstart_fix','Qend_fix','Tstart_fix','Tend_fix']
+gap_intermediate_col=['Qname','length']
+
 
 # ## 関数のインポート
 
@@ -47,6 +40,7 @@ from pathlib import Path
 import itertools
 from collections import Counter
 from glob import glob 
+from fugarec_utils import build_interval_index, annotate_intervals, load_bed_index, load_gene_index, load_exon_index, load_tx2gene, split_tname, snap_exon_boundary, add_Nth_hit, judge_cross_over_v3, pair_fusioncand, pair_gap, read_paf_filtered, filter_qstart_qend_not_unique, partition_filter, resolve_clst_final, read_intermediate, add_g1_g2_clst_col_v3, add_clst_count_v2
 #import matplotlib.pyplot as plt
 #import collections
 #mport pandas_bj
@@ -81,24 +75,6 @@ def rm_cross_over(df_fusioncand,buffer=buffer):
     #print('クロスオーバーで除く本数は{}本'.format(df_fusioncand.shape[0] - df_fusioncand_rmcross.shape[0]))
     return df_fusioncand_rmcross,drop_rid
 
-def judge_cross_over_v3(mmap2_paired,buffer,s,e):
-    ##print('クエリ側のクロスオーバーの判定')
-    rids=[]
-    if mmap2_paired['Nth_hit'].value_counts()[1] != mmap2_paired['Nth_hit'].value_counts()[2]:
-        drop_rid_nopaired = pd.DataFrame(mmap2_paired.groupby('Qname')['Nth_hit'].nunique() == 1).query('Nth_hit==True').index
-        mmap2_paired = mmap2_paired.query('Qname not in @drop_rid_nopaired')
-    for x,rid in enumerate(tqdm(mmap2_paired.Qname.unique())): #read_idごと
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        N=mmap2_paired_sub.Nth_hit.min()
-        first_end_pos = int(mmap2_paired_sub.query('Nth_hit==@N')[e].max())
-        try:
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit==@N+1')[s].min())
-        except:
-            assert mmap2_paired_sub['Nth_hit'].nunique()==2 ,'Nth_hitが3以上です'
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit!=@N')[s].min())
-        if first_end_pos - buffer > second_start_pos:
-            rids.append(rid)
-    return rids
     
 
 
@@ -121,69 +97,11 @@ def cul_mapping_GAP(df):
     return df_out
 
 
-def get_gene_name_start_end(gtf,chr,s,e,buffer=15):
-    gtf['len']=gtf['end']-gtf['start']
-    multi_hit_flg=0
-    gtf_sub1=gtf.query('chr==@chr & start-@buffer <= @s <= end + @buffer and chr==@chr & start-@buffer <= @e <= end+@buffer') #gtfの中にstart,endともに張り付いている
-    if len(gtf_sub1) >= 1:
-        gtf_sub1= gtf_sub1.sort_values('len',ascending=False)
-        g_tmp = gtf_sub1['gene'].unique()
-        g_multi="||".join(g_tmp)
-        #g=g_tmp[0]
-        if len(g_tmp) > 1:
-            multi_hit_flg=1
-            g_multi="||".join(g_tmp)
-    else:
-        gtf_sub2=gtf.query('chr==@chr & start-@buffer <= @s <= end+@buffer') #gtfの中にstartのみ張り付いている
-        gtf_sub3=gtf.query('chr==@chr & start-@buffer <= @e <= end+@buffer') #gtfの中にendのみ張り付いている
-        if len(gtf_sub2)>=1: 
-            gtf_sub2= gtf_sub2.sort_values('len',ascending=False)
-            g_tmp = gtf_sub2['gene'].unique()
-            g_multi="||".join(g_tmp)
-            #g=g_tmp[0]
-            if len(g_tmp) > 1:
-                multi_hit_flg=1
-        elif len(gtf_sub3)>=1: 
-            gtf_sub3= gtf_sub3.sort_values('len',ascending=False)
-            g_tmp = gtf_sub3['gene'].unique()
-            g_multi="||".join(g_tmp)
-            #g=g_tmp[0]
-            if len(g_tmp)>1:
-                multi_hit_flg=1
-        else:
-            #g='no_hit'
-            g_multi='intron'
-        
-    return pd.Series(g_multi)
-
 def prep_gtf(gtf):
     gtf['gene_3char'] = gtf['name2'].str[0:3]
     gtf = gtf.rename(columns={"name2": "gene", 'chrom': 'chr','txStart': 'start', 'txEnd': 'end'}).sort_values(['chr', 'start'])
     return gtf
 
-def add_Nth_hit(mmap2_paired_in,X=Nth_hit_buffer): #30から変更
-    ##print('Nth hitの判定')
-    mmap2_paired = mmap2_paired_in.sort_values(['Qname','Qstart','Qend','mapQ','match_rate'],ascending=[True,True,True,False,False])
-    res=[]
-    for x,rid in tqdm(enumerate(mmap2_paired.Qname.unique())): #read_idごと
-        counter=1 #Nth
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        for n,(_,r) in enumerate(mmap2_paired_sub.iterrows()): #同じread_idでの複数ヒット
-            if n==0:
-                res.append(1)
-            else:
-                if (mmap2_paired_sub.iloc[n-1]["Qstart"] >= mmap2_paired_sub.iloc[n]['Qstart'] - X):
-                    counter+=0
-                    res.append(counter)
-                elif (mmap2_paired_sub.iloc[n-1]["Qend"] >= mmap2_paired_sub.iloc[n]['Qend'] -X ): 
-                    counter+=0
-                    res.append(counter)
-                else:
-                    counter+=1
-                    res.append(counter)
-    mmap2_paired["Nth_hit"] = res
-    return mmap2_paired
-
 def filter_out_Nth_hit_ov2(df):
     cond = df.groupby("Qname").Nth_hit.max() == 2
     filterd_qid = cond[cond].index
@@ -206,55 +124,14 @@ def cul_fusioncand_v4_4refseq(mmap2_paired):
     col = ["Qname","Qstart","Qend","dir", "Tname", "Tstart", "Tend", "mapQ","match_rate", "mapping_rate","gene"]
     out_col = ["hit_rid", "Qstart1","Qend1","dir1", "chr1", "start1", "end1", "mapQ1", "match_rate1", "mapping_rate1","g1","Qstart2","Qend2","dir2", "chr2",
                "start2", "end2", "mapQ2", "match_rate2", 'mapping_rate2', "g2","gap_len",'gap_rate']
-    arr=[]
-    for rid in tqdm(mmap2_paired.Qname.unique()):
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        if mmap2_paired_sub.Nth_hit.nunique()==2:
-            mmap2_paired_sub_Nth1= mmap2_paired_sub.query('Nth_hit==1')
-            mmap2_paired_sub_Nth2= mmap2_paired_sub.query('Nth_hit==2')
-            for i in range(len(mmap2_paired_sub_Nth1)):
-                for j in range(len(mmap2_paired_sub_Nth2)):
-                    flont_fp = list(mmap2_paired_sub_Nth1.iloc[i][col]) 
-                    rear_fp = list(mmap2_paired_sub_Nth2.iloc[j][col])[1:]
-                    gap_len =  mmap2_paired_sub_Nth2.iloc[j]['Qstart']- mmap2_paired_sub_Nth1.iloc[i]['Qend']
-                    gap_rate =  gap_len / mmap2_paired_sub_Nth1.iloc[i]['Qlen']
-                    res = flont_fp + rear_fp + [gap_len] + [gap_rate] 
-                    arr.append(res)
-                    
-        else:
-            pass
-    df_fusioncand=pd.DataFrame(arr)
-    df_fusioncand.columns=out_col
-    df_fusioncand = df_fusioncand.drop_duplicates()
-    return df_fusioncand
+    return pair_fusioncand(mmap2_paired, col, out_col)
 
 def cul_fusioncand_v4_quick(mmap2_paired):
     ##print('---------------融合点の計算----------------')
     col = ["Qname","Qstart","Qend","dir", "Tname", "Tstart", "Tend", "mapQ","match_rate", "mapping_rate"]
     out_col = ["hit_rid", "Qstart1","Qend1","dir1", "chr1", "start1", "end1", "mapQ1", "match_rate1", "mapping_rate1","Qstart2","Qend2","dir2", "chr2",
                "start2", "end2", "mapQ2", "match_rate2", 'mapping_rate2', "gap_len",'gap_rate']
-    arr=[]
-    for rid in tqdm(mmap2_paired.Qname.unique()):
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        if mmap2_paired_sub.Nth_hit.nunique()==2:
-            mmap2_paired_sub_Nth1= mmap2_paired_sub.query('Nth_hit==1')
-            mmap2_paired_sub_Nth2= mmap2_paired_sub.query('Nth_hit==2')
-            for i in range(len(mmap2_paired_sub_Nth1)):
-                for j in range(len(mmap2_paired_sub_Nth2)):
-                    flont_fp = list(mmap2_paired_sub_Nth1.iloc[i][col]) 
-                    rear_fp = list(mmap2_paired_sub_Nth2.iloc[j][col])[1:]
-                    gap_len =  mmap2_paired_sub_Nth2.iloc[j]['Qstart']- mmap2_paired_sub_Nth1.iloc[i]['Qend']
-                    gap_rate =  gap_len / mmap2_paired_sub_Nth1.iloc[i]['Qlen']
-                    res = flont_fp + rear_fp + [gap_len] + [gap_rate] 
-                    arr.append(res)
-                    
-        else:
-            pass
-            ### 3箇所以上にマッピングされるものは候補から除外
-        df_fusioncand=pd.DataFrame(arr)
-        df_fusioncand.columns=out_col
-        df_fusioncand = df_fusioncand.drop_duplicates()
-    return df_fusioncand
+    return pair_fusioncand(mmap2_paired, col, out_col)
 
 
 def prep_paf_edge_4gaponly(path):
@@ -271,24 +148,10 @@ def prep_paf_edge_4gaponly(path):
         return df
 
 def prep_subseq_read_gaponly(df_in):
-    res_df=pd.DataFrame()
-    ##print('----start prep_subseq_read gap only -------')
     df = df_in[['Qname','Qlen' ,'Qstart', 'Qend','Nth_hit']].drop_duplicates()
     out_col=['Qname', 'Qstart', 'Qend']
-    for rid in tqdm(df.Qname.unique()):
-        df_sub = df.query('Qname in @rid')
-        Nths = df_sub.Nth_hit.nunique()
-        if Nths==2: 
-            df_sub1=df_sub.query('Nth_hit == 1')
-            df_sub2=df_sub.query('Nth_hit == 2')
-            N=0
-            for (_,r1) in df_sub1.iterrows():
-                for (_,r2) in df_sub2.iterrows():
-                    res = pd.Series([rid, int(r1['Qend']),int(r2['Qstart'])],index=out_col)
-                    res_df = res_df.append(res,ignore_index=True)
-                    N=N+1
-
-    res_df = res_df.astype({'Qend':int,'Qstart':int}).sort_values(['Qname','Qstart','Qend'])[out_col].drop_duplicates(subset=['Qname','Qstart','Qend'])
+    res_df = pair_gap(df,'Qstart','Qend')
+    res_df = res_df.sort_values(['Qname','Qstart','Qend'])[out_col].drop_duplicates(subset=['Qname','Qstart','Qend'])
     assert res_df.Qname.nunique()==df.Qname.nunique()
     return res_df
 
@@ -331,49 +194,45 @@ def filter_out_Nth_hit(df,N):
     return df_out
 
 
-def filter_refseq_paf(local_file_path_refseq,gtf_path,N=1):
-    gtf = pd.read_csv(gtf_path, usecols=[0,5],names=['Tname','gene'],header=0,index_col=False)
-    paf_col = ["Qname", "Qlen", "Qstart", "Qend", "dir", "Tname","Tlen", "Tstart", "Tend", "match", "block", "mapQ"]
-    mmap2_refseq = pd.read_table(local_file_path_refseq, index_col=False, header=None,names=paf_col, usecols=range(0, 12)).drop('Tlen', axis=1)
-    # mmap2_refseq['Tname'] = mmap2_refseq['Tname'].str.split("_").str[2]
-    mmap2_refseq['Tname'] = mmap2_refseq['Tname'].str.split("|").str[0]
-    mmap2_refseq = pd.merge(mmap2_refseq, gtf,how='left')
-    
-    #1geneにしか当たらないリードをdrop
-    cond1=mmap2_refseq.groupby('Qname')['gene'].nunique()!=N
-    filterd_qid1=cond1[cond1].index
-    mmap2_refseq_cand1=mmap2_refseq.query('Qname in @filterd_qid1')
-    
-    #startとendが一致しているものは落とす
-    cond2 = (mmap2_refseq_cand1.groupby('Qname')['Qstart'].nunique() != 1) & (mmap2_refseq_cand1.groupby('Qname')['Qend'].nunique() != 1)
-    filterd_qid2=cond2[cond2].index
-    mmap2_refseq_cand2=mmap2_refseq_cand1.query('Qname in @filterd_qid2')
+def make_refseq_chunk_filter(gtf_path,N=1):
+    # refseqのPAFの chunk から候補readの行を選ぶ関数 (filter_refseq_paf と Prefilter_PAF.py で共通)
+    tx2gene = load_tx2gene(gtf_path)
+
+    def filter_refseq_chunk(mmap2_refseq):
+        # mmap2_refseq['Tname'] = mmap2_refseq['Tname'].str.split("_").str[2]
+        mmap2_refseq['Tname'] = split_tname(mmap2_refseq['Tname'], "|", 0)
+        mmap2_refseq = pd.merge(mmap2_refseq, tx2gene,how='left')
+        #1geneにしか当たらないリードをdrop
+        mmap2_refseq_cand1 = mmap2_refseq[mmap2_refseq.groupby('Qname',observed=True)['gene_code'].transform('nunique')!=N].drop(columns='gene_code')
+        #startとendが一致しているものは落とす
+        return filter_qstart_qend_not_unique(mmap2_refseq_cand1)
+    return filter_refseq_chunk
+
+def filter_refseq_paf(local_file_path_refseq,gtf_path,N=1,part=0,n_part=1):
+    filter_refseq_chunk = make_refseq_chunk_filter(gtf_path,N)
+    # PAFはchunkごとに読み、readごとのフィルタを通った行だけを残す (n_part>1 なら part 番目のパーティションのreadだけ)
+    mmap2_refseq_cand2 = read_paf_filtered(local_file_path_refseq, partition_filter(filter_refseq_chunk, part, n_part))
     mmap2_refseq_cand2['match_rate'] = (mmap2_refseq_cand2['match']) / (mmap2_refseq_cand2['Qend']-mmap2_refseq_cand2['Qstart']+1)
     mmap2_refseq_cand2['mapping_rate'] = (mmap2_refseq_cand2['Qend']-mmap2_refseq_cand2['Qstart']+1)/mmap2_refseq_cand2['Qlen']
-    cond2 = (mmap2_refseq_cand2.groupby('Qname')['Qstart'].nunique() != 1) & (mmap2_refseq_cand2.groupby('Qname')['Qend'].nunique() != 1)
-    filterd_qid2=cond2[cond2].index
-    mmap2_refseq_cand2=mmap2_refseq_cand2.query('Qname in @filterd_qid2').sort_values('Qname')
+    mmap2_refseq_cand2=mmap2_refseq_cand2.sort_values('Qname',kind='stable') #read内はPAFの行順
     multi_gene_id=mmap2_refseq_cand2.Qname.unique()
     
-    return multi_gene_id,mmap2_refseq, mmap2_refseq_cand2
+    return multi_gene_id, mmap2_refseq_cand2
 
 def prep_paf_file_v3(paffile_path, filterd_qid, Nth_hit_flg=1):
-    paf_col = ["Qname", "Qlen", "Qstart", "Qend", "dir", "Tname","Tlen", "Tstart", "Tend", "match", "block", "mapQ"]
-    mmap2 = pd.read_table(paffile_path, index_col=False, header=None,names=paf_col, usecols=range(0, 12)).drop('Tlen', axis=1)
-    if len(filterd_qid)!=0: 
-        mmap2_cand1=mmap2.query('Qname in @filterd_qid')
-    else:
-        mmap2_cand1=mmap2.copy()
-    cond3 = (mmap2_cand1.groupby('Qname')['Qstart'].nunique() != 1) & (mmap2_cand1.groupby('Qname')['Qend'].nunique() != 1)
-    filterd_qid3 = cond3[cond3].index
-    mmap2_cand2 = mmap2_cand1.query('Qname in @filterd_qid3')
+    def filter_genome_chunk(mmap2):
+        if len(filterd_qid)!=0: 
+            mmap2=mmap2[mmap2['Qname'].isin(filterd_qid)]
+        return filter_qstart_qend_not_unique(mmap2)
+
+    # PAFはchunkごとに読み、refseqで候補になったreadかつQstart,Qendが1種類ではないreadの行だけを残す
+    mmap2_cand2 = read_paf_filtered(paffile_path, filter_genome_chunk)
     mmap2_cand2['Qhit']=mmap2_cand2['Qend']-mmap2_cand2['Qstart']+1
     mmap2_cand2['match_rate'] = (mmap2_cand2['match']) / (mmap2_cand2['Qend']-mmap2_cand2['Qstart']+1)
     mmap2_cand2['mapping_rate'] = (mmap2_cand2['Qend']-mmap2_cand2['Qstart']+1)/mmap2_cand2['Qlen']
     if Nth_hit_flg==1:
-        mmap2['Tname'] = mmap2['Tname'].str.split("_").str[2]
-        mmap2_cand2 = add_Nth_hit(mmap2_cand2)
-    return mmap2,mmap2_cand2
+        mmap2_cand2 = add_Nth_hit(mmap2_cand2,Nth_hit_buffer)
+    return mmap2_cand2
 
 def flging_gap_use_read(df):
     Qnames=df.query('gene==gene_gap').Qname.unique()
@@ -393,28 +252,7 @@ def cul_fusioncand_v4(mmap2_paired):
     #          "start2", "end2", "mapQ2", "match_rate2", 'mapping_rate2', "gap_len",'gap_rate']
     out_col = ["hit_rid", "Qstart1","Qend1","dir1", "chr1", "start1", "end1", "mapQ1","gene1","Qstart2","Qend2","dir2", "chr2",
                "start2", "end2", "mapQ2", "gene2","gap_len",'gap_rate']
-    arr=[]
-    for rid in tqdm(mmap2_paired.Qname.unique()):
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        if mmap2_paired_sub.Nth_hit.nunique()==2:
-            mmap2_paired_sub_Nth1= mmap2_paired_sub.query('Nth_hit==1')
-            mmap2_paired_sub_Nth2= mmap2_paired_sub.query('Nth_hit==2')
-            for i in range(len(mmap2_paired_sub_Nth1)):
-                for j in range(len(mmap2_paired_sub_Nth2)):
-                    flont_fp = list(mmap2_paired_sub_Nth1.iloc[i][col]) 
-                    rear_fp = list(mmap2_paired_sub_Nth2.iloc[j][col])[1:]
-                    gap_len =  mmap2_paired_sub_Nth2.iloc[j]['Qstart']- mmap2_paired_sub_Nth1.iloc[i]['Qend']
-                    gap_rate =  gap_len / mmap2_paired_sub_Nth1.iloc[i]['Qlen']
-                    res = flont_fp + rear_fp + [gap_len] + [gap_rate] 
-                    arr.append(res)
-                    
-        else:
-            pass
-            ### 3箇所以上にマッピングされるものは候補から除外
-        df_fusioncand=pd.DataFrame(arr)
-        df_fusioncand.columns=out_col
-        df_fusioncand = df_fusioncand.drop_duplicates()
-    return df_fusioncand
+    return pair_fusioncand(mmap2_paired, col, out_col)
 
 def change_order_g1g2_v3(df_fusioncand_in,type):
     df_fusioncand = df_fusioncand_in.copy()
@@ -442,20 +280,8 @@ def get_major_clst(clst1,count1,clst2,count2):
         return clst2
 
 def make_descendants_table(df,df_count):
-    import networkx as nx
-    x=df
-    G = nx.DiGraph()
-    G.add_weighted_edges_from([tuple(x) for x in x.values])
-    nx.info(G)
-    df_descendants=pd.DataFrame(columns=['clst_1st','clst_final'])
-    for node in G.nodes():
-        descendant=nx.descendants(G, node)
-        if len(descendant)==0:
-            descendant_=node
-        else:
-            descendant_=(list(descendant)[0])
-        var_ser=pd.Series([node,descendant_],index=df_descendants.columns)
-        df_descendants=df_descendants.append( var_ser, ignore_index=True )
+    # clst_1st -> clst_final を最後までたどった major クラスタを clst_final にする (1回で収束するので繰り返さない)
+    df_descendants=pd.DataFrame({'clst_1st':df.iloc[:,0].to_numpy(),'clst_final':resolve_clst_final(df.iloc[:,0],df.iloc[:,1])})
     df_descendants=df_descendants.query('clst_1st!=clst_final')
     df_descendants=pd.merge(df_descendants,df_count.drop_duplicates(),on='clst_1st',how='left')
     return df_descendants
@@ -476,47 +302,16 @@ def re_clst_miner2major_v3(df_in,clst_col,clst_count_col,g1_r,g2_r,dont_reclust_
         
     
     df_clst_count_in=df_clst_count[[clst_col,clst_count_col]].drop_duplicates()
-    df_clst_f2_upd = make_descendants_table(df_clst_f2,df_clst_count_in) ##ネットワーク使ってアップデート
-    df_clst_f2_upd2 = make_descendants_table(df_clst_f2_upd,df_clst_count_in)
-    df_clst_f2_upd3 = make_descendants_table(df_clst_f2_upd2,df_clst_count_in)
-    assert df_clst_f2_upd3.equals(df_clst_f2_upd2)
+    df_clst_f2_upd3 = make_descendants_table(df_clst_f2,df_clst_count_in)
      
     df_out = pd.merge(df,df_clst_f2_upd3,on=[clst_col,clst_count_col],how='left')
     df_out.loc[df_out.clst_final.isna(),'clst_final']=df_out[clst_col]
     return df_out
 
-def get_cytoband_start_end(cytoband,chr,s,e,buffer=15):
-    cytoband['len']=cytoband['end']-cytoband['start']
-    cytoband_col="chr_pq"
-    multi_hit_flg=0
-    gtf_sub1=cytoband.query('chr==@chr & start-@buffer <= @s <= end + @buffer and chr==@chr & start-@buffer <= @e <= end+@buffer') #gtfの中にstart,endともに張り付いている
-    if len(gtf_sub1) >= 1:
-        gtf_sub1= gtf_sub1.sort_values('len',ascending=False)
-        g_tmp = gtf_sub1[cytoband_col].unique()
-        g_multi="||".join(g_tmp)
-        #g=g_tmp[0]
-        if len(g_tmp) > 1:
-            multi_hit_flg=1
-            g_multi="||".join(g_tmp)
-    else:
-        cytoband2=cytoband.query('chr==@chr & start-@buffer <= @s <= end+@buffer') #gtfの中にstartのみ張り付いている
-        cytoband3=cytoband.query('chr==@chr & start-@buffer <= @e <= end+@buffer') #gtfの中にendのみ張り付いている
-        if len(cytoband2)>=1: 
-            cytoband2= cytoband2.sort_values('len',ascending=False)
-            g_tmp = cytoband2[cytoband_col].unique()
-            g_multi="||".join(g_tmp)
-            #g=g_tmp[0]
-            if len(g_tmp) > 1:
-                multi_hit_flg=1
-        elif len(cytoband3)>=1: 
-            cytoband3= cytoband3.sort_values('len',ascending=False)
-            g_tmp = cytoband3[cytoband_col].unique()
-            g_multi="||".join(g_tmp)
-            #g=g_tmp[0]
-            if len(g_tmp)>1:
-                multi_hit_flg=1
-        
-    return pd.Series(g_multi)
+def get_cytoband_start_end_v2(cytoband_index,chrs,s,e,buffer=15):
+    # get_cytoband_start_end を全行まとめて計算する (cytoband_index = load_bed_index(cytoband_path, 'chr_pq'))
+    # 優先順位は遺伝子と同じ。どのbandにも当たらない行は NaN
+    return annotate_intervals(cytoband_index, chrs, s, e, buffer, no_hit=np.nan)
 
 def add_TF_columns_genename_v2(true_gA,true_gB, g1, g2):
     res=0;index=9999
@@ -531,22 +326,42 @@ def add_TF_columns_genename_v2(true_gA,true_gB, g1, g2):
     return pd.Series([res,index])
 
 
-def make_breakpoint_divX(X,by=10000):
-    bp=X
-    chr1=bp.split("___")[0].split("__")[0]
-    pos1=bp.split("___")[0].split("__")[1]
-    chr2=bp.split("___")[1].split("__")[0]
-    pos2=bp.split("___")[1].split("__")[1]
-    pos1_div=str(my_round_int(int(pos1) / by))
-    pos2_div=str(my_round_int(int(pos2) / by))
-    res=chr1+ "__" + pos1_div + "___" +chr2+ "__" + pos2_div
-    return res
+def make_breakpoint_divX(df,by=10000):
+    # breakpoint の位置を by で丸めた bin (my_round_int と同じ四捨五入)。クラスタのキー name_key は (染色体, bin, 染色体, bin) の番号
+    df['bp_bin1']=(((df['bp_pos1']/by)*2+1)//2).astype(np.int64)
+    df['bp_bin2']=(((df['bp_pos2']/by)*2+1)//2).astype(np.int64)
+    df['name_key']=df.groupby(['bp_chr1','bp_bin1','bp_chr2','bp_bin2'],sort=False,observed=True).ngroup()
+    return df
+
+def render_bp(chr1,pos1,chr2,pos2):
+    # 出力用の "chr1__pos1___chr2__pos2" の文字列
+    return chr1.astype(str)+"__"+pos1.astype(str)+"___"+chr2.astype(str)+"__"+pos2.astype(str)
+
+def bp_str_order(chr_col,pos_col):
+    # "chr__pos" の文字列を比べたときと同じ順になる整数 (染色体の順, posを10桁に右詰めした値, posの桁数)
+    pos=pos_col.to_numpy(np.int64)
+    ndigit=np.maximum(np.searchsorted(10**np.arange(19),pos,side='right'),1)
+    return (chr_col.cat.codes.to_numpy(np.int64)*10**10+pos*10**(10-ndigit))*11+ndigit
+
+def sort_bp_pair(df):
+    # 2つの breakpoint を "chr__pos" の文字列で比べた昇順に入れ替える
+    swap=bp_str_order(df['bp_chr1'],df['bp_pos1'])>bp_str_order(df['bp_chr2'],df['bp_pos2'])
+    for col1,col2 in [('bp_chr1','bp_chr2'),('bp_pos1','bp_pos2')]:
+        tmp=df[col1].copy()
+        df[col1]=df[col1].where(~swap,df[col2])
+        df[col2]=df[col2].where(~swap,tmp)
+    return df
 
 def prep_blat_edge_4gaponly(path,topscore=1):
     df=pd.read_table(path,names=["Qname","Tname","identity","alignment_length","mismatches","gap_openings","Qstart","Qend","Tstart","Tend","evalue","bitscore"])
+    return select_blat_edge_4gaponly(df,topscore)
+
+def select_blat_edge_4gaponly(df,topscore=1):
+    # blast8形式のgapのヒット (pblatの出力 / realign_gaps_local の戻り値) から read ごとに evalue 最小のヒットを選ぶ
     if topscore==1:
         df=df.sort_values(['Qname','evalue','bitscore'],ascending=[True,True,False])
-        df=(df.groupby(['Qname'],as_index=False).apply(select,col='evalue',kind='min'))
+        # read ごとに evalue 最小の行 (select(col='evalue',kind='min') と同じ、pandas 3 の groupby.apply は Qname 列を渡さない)
+        df=df[df['evalue']==df.groupby('Qname')['evalue'].transform('min')].drop_duplicates()
 
     else:
         pass
@@ -569,23 +384,8 @@ def select(df, **kwargs):  # colに列名,kindに最大もしくは最小
     return val_r
 
 def add_exon_s_e(df,gtf_exon_path):
-    df=df.assign(gene2=df['gene'].str.split("\|\|")).explode('gene2')
-    df_exon=pd.read_csv(gtf_exon_path)
-    df_merged=pd.merge(df,df_exon[['gene','exstart','exend']],left_on='gene2',right_on="gene")
-    df_merged['diff_s']=abs(df_merged['Tstart']-df_merged['exstart'])
-    df_merged['diff_e']=abs(df_merged['exend']-df_merged['Tend'])
-
-    tmp1=df_merged.groupby(['Qname','Nth_hit'],as_index=False).diff_s.min()
-    tmp2=df_merged.groupby(['Qname','Nth_hit'],as_index=False).diff_e.min()
-    df_merged_t=pd.merge(df_merged,tmp1,how='inner')
-    df_start=df_merged_t[['Qname','Nth_hit','exstart','diff_s']].drop_duplicates()
-    df_merged_t=pd.merge(df_merged,tmp2,how='inner')
-    df_end=df_merged_t[['Qname','Nth_hit','exend','diff_e']].drop_duplicates()
-    df_s_e=pd.merge(df_start,df_end)
-    df_out=pd.merge(df,df_s_e).sort_values(['Qname','Nth_hit'])
-    df_out['diff_s']=df_out['Tstart']-df_out['exstart']
-    df_out['diff_e']=df_out['exend']-df_out['Tend']
-    return df_out
+    # Tstart,Tend に一番近いエキソンの端 (exstart,exend) と diff_s,diff_e を付ける。エキソンの表は1回だけ読んで遺伝子ごとにソートしておく
+    return snap_exon_boundary(df, load_exon_index(gtf_exon_path))
 
 def fix_start_end(df_in):
     df=df_in.copy()
@@ -607,136 +407,14 @@ def fix_start_end(df_in):
     return df
             
 
-def judge_cross_over_v3(mmap2_paired,buffer,s,e):
-    ##print('クエリ側のクロスオーバーの判定')
-    rids=[]
-    if mmap2_paired['Nth_hit'].value_counts()[1] != mmap2_paired['Nth_hit'].value_counts()[2]:
-        drop_rid_nopaired = pd.DataFrame(mmap2_paired.groupby('Qname')['Nth_hit'].nunique() == 1).query('Nth_hit==True').index
-        mmap2_paired = mmap2_paired.query('Qname not in @drop_rid_nopaired')
-    for x,rid in enumerate(tqdm(mmap2_paired.Qname.unique())): #read_idごと
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        N=mmap2_paired_sub.Nth_hit.min()
-        first_end_pos = int(mmap2_paired_sub.query('Nth_hit==@N')[e].max())
-        try:
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit==@N+1')[s].min())
-        except:
-            assert mmap2_paired_sub['Nth_hit'].nunique()==2 ,'Nth_hitが3以上です'
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit!=@N')[s].min())
-        if first_end_pos - buffer > second_start_pos:
-            rids.append(rid)
-    return rids
 
-def add_exon_s_e(df,gtf_exon_path):
-    df=df.assign(gene2=df['gene'].str.split("\|\|")).explode('gene2')
-    df_exon=pd.read_csv(gtf_exon_path)
-    df_merged=pd.merge(df,df_exon[['gene','exstart','exend']],left_on='gene2',right_on="gene")
-    df_merged['diff_s']=abs(df_merged['Tstart']-df_merged['exstart'])
-    df_merged['diff_e']=abs(df_merged['exend']-df_merged['Tend'])
-
-    tmp1=df_merged.groupby(['Qname','Nth_hit'],as_index=False).diff_s.min()
-    tmp2=df_merged.groupby(['Qname','Nth_hit'],as_index=False).diff_e.min()
-    df_merged_t=pd.merge(df_merged,tmp1,how='inner')
-    df_start=df_merged_t[['Qname','Nth_hit','exstart','diff_s']].drop_duplicates()
-    df_merged_t=pd.merge(df_merged,tmp2,how='inner')
-    df_end=df_merged_t[['Qname','Nth_hit','exend','diff_e']].drop_duplicates()
-    df_s_e=pd.merge(df_start,df_end)
-    df_out=pd.merge(df,df_s_e).sort_values(['Qname','Nth_hit'])
-    df_out['diff_s']=df_out['Tstart']-df_out['exstart']
-    df_out['diff_e']=df_out['exend']-df_out['Tend']
-    return df_out
-
-def fix_start_end(df_in):
-    df=df_in.copy()
-    df[['Qstart_fix','Qend_fix','Tstart_fix','Tend_fix']]=df[['Qstart','Qend','Tstart','Tend']].copy()
-    #Nth1 dir +
-    df.loc[(df['Nth_hit']==1) & (df['dir']=="+"),"Tend_fix"]=df['exend']
-    df.loc[(df['Nth_hit']==1) & (df['dir']=="+"),'Qend_fix']=df['Qend']+df['diff_e']
-    #Nth1 dir -
-    df.loc[(df['Nth_hit']==1) & (df['dir']=="-"),"Tstart_fix"]=df['exstart']
-    df.loc[(df['Nth_hit']==1) & (df['dir']=="-"),'Qend_fix']=df['Qend']+df['diff_s']
-    #df.loc[(df['Nth_hit']==1) & (df['dir']=="-")]
-
-    #Nth2 dir +
-    df.loc[(df['Nth_hit']==2) & (df['dir']=="+"),"Tstart_fix"]=df['exstart']
-    df.loc[(df['Nth_hit']==2) & (df['dir']=="+"),'Qstart_fix']=df['Qstart']-df['diff_s']
-    #Nth1 dir -
-    df.loc[(df['Nth_hit']==2) & (df['dir']=="-"),"Tend_fix"]=df['exend']
-    df.loc[(df['Nth_hit']==2) & (df['dir']=="-"),'Qstart_fix']=df['Qstart']-df['diff_e']
-    return df
-            
 def prep_subseq_read_gaponly_v2(df_in):
-    res_df=pd.DataFrame()
-    ##print('----start prep_subseq_read gap only -------')
-    df = df_in[['Qname','Qlen' ,'Qstart_fix', 'Qend_fix','Nth_hit']].drop_duplicates()
-    out_col=['Qname', 'Qstart', 'Qend']
-    for rid in tqdm(df.Qname.unique()):
-        df_sub = df.query('Qname in @rid')
-        Nths = df_sub.Nth_hit.nunique()
-        if Nths==2: 
-            df_sub1=df_sub.query('Nth_hit == 1')
-            df_sub2=df_sub.query('Nth_hit == 2')
-            N=0
-            for (_,r1) in df_sub1.iterrows():
-                for (_,r2) in df_sub2.iterrows():
-                    res = pd.Series([rid, int(r1["Qend_fix"]),int(r2["Qstart_fix"])],index=out_col)
-                    res_df = res_df.append(res,ignore_index=True)
-                    N=N+1
-    return res_df
-
-def judge_cross_over_v3(mmap2_paired,buffer,s,e):
-    ##print('クエリ側のクロスオーバーの判定')
-    rids=[]
-    if mmap2_paired['Nth_hit'].value_counts()[1] != mmap2_paired['Nth_hit'].value_counts()[2]:
-        drop_rid_nopaired = pd.DataFrame(mmap2_paired.groupby('Qname')['Nth_hit'].nunique() == 1).query('Nth_hit==True').index
-        mmap2_paired = mmap2_paired.query('Qname not in @drop_rid_nopaired')
-    for x,rid in enumerate(tqdm(mmap2_paired.Qname.unique())): #read_idごと
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        N=mmap2_paired_sub.Nth_hit.min()
-        first_end_pos = int(mmap2_paired_sub.query('Nth_hit==@N')[e].max())
-        try:
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit==@N+1')[s].min())
-        except:
-            assert mmap2_paired_sub['Nth_hit'].nunique()==2 ,'Nth_hitが3以上です'
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit!=@N')[s].min())
-        if first_end_pos - buffer > second_start_pos:
-            rids.append(rid)
-    return rids
-    
-def split_bp(bp):
-    chr1=bp.split("___")[0].split("__")[0]
-    pos1=int(bp.split("___")[0].split("__")[1])
-    chr2=bp.split("___")[1].split("__")[0]
-    pos2=int(bp.split("___")[1].split("__")[1])
-    return pd.Series(list([chr1,pos1,chr2,pos2]))
-
-def make_bp_clst_mode(df):
-    df[["name2_chr1","name2_pos1","name2_chr2","name2_pos2"]]=df['name2'].apply(lambda x:split_bp(x))
-    df['g1_g2_clst'] = df['g1_clst'] + "--" + df["g2_clst"]
-    
-    tmp=pd.DataFrame(df.groupby('g1_g2_clst',as_index=True)['name2_pos1'].apply(lambda x: x.mode())).reset_index().drop('level_1',axis=1).rename(columns={'name2_pos1':'name2_pos1_mode'})
-    tmp2=pd.DataFrame(df.groupby('g1_g2_clst',as_index=True)['name2_pos2'].apply(lambda x: x.mode())).reset_index().drop('level_1',axis=1).rename(columns={"name2_pos2":'name2_pos2_mode'})
-    df_bp_mode=pd.merge(tmp,tmp2)
-    df=pd.merge(df,df_bp_mode,how='left',on='g1_g2_clst')
-    df["name2_clst"]=df['name2_chr1']+"__"+df['name2_pos1_mode'].astype(str)+"___"+df['name2_chr2']+"__"+df['name2_pos2_mode'].astype(str)
-    df=df.drop(['name2_chr1','name2_chr2','name2_pos1','name2_pos2'],axis=1)
-    return df
+    # Nth_hit==1 の Qend_fix から Nth_hit==2 の Qstart_fix までを gap とする (全ペア)
+    return pair_gap(df_in,'Qstart_fix','Qend_fix')
 
 def cul_gaplen(df_in,Qstart,Qend):
-    df = df_in[['Qname','Qlen' ,Qstart, Qend,'Nth_hit']].drop_duplicates()
-    res_df=pd.DataFrame()
-    for rid in tqdm(df.Qname.unique()):
-        df_sub = df.query('Qname in @rid')
-        Nths = df_sub.Nth_hit.nunique()
-        if Nths==2: 
-            df_sub1=df_sub.query('Nth_hit == 1')
-            df_sub2=df_sub.query('Nth_hit == 2')
-            N=0
-            for (_,r1) in df_sub1.iterrows():
-                for (_,r2) in df_sub2.iterrows():
-                    res = pd.Series([rid, int(r2[Qstart])-int(r1[Qend])],index=['rid','gaplen'])
-                    res_df = res_df.append(res,ignore_index=True)
-                    N=N+1
-    return res_df
+    res_df = pair_gap(df_in,Qstart,Qend)
+    return pd.DataFrame({'rid':res_df['Qname'],'gaplen':res_df['Qend']-res_df['Qstart']})
 
 def bp_update_v3(df_in):
     df=df_in.copy()
@@ -777,194 +455,180 @@ def bp_update_v4(df_in):
     return df
 
 def make_name_col_nodev(df):
-    tmp = df.query('dir1=="+" & dir2 == "+"')
-    tmp["name2"] = tmp["chr1"] + "__" + tmp["end1"].astype(str) + "___" +  tmp["chr2"] + "__" + tmp["start2"].astype(str)
-    tmp2 = df.query('dir1=="+"& dir2 == "-"')
-    tmp2["name2"]= tmp2["chr1"] + "__" + tmp2["end1"].astype(str) + "___" + tmp2["chr2"] + "__" + tmp2["end2"].astype(str)
-    tmp3 = df.query('dir1=="-" & dir2 == "+"')
-    tmp3["name2"] = tmp3["chr1"] + "__" + tmp3["start1"].astype(str) + "___" + tmp3["chr2"] + "__" + tmp3["start2"].astype(str)
-    tmp4 = df.query('dir1=="-" & dir2 == "-"')
-    tmp4["name2"]= tmp4["chr1"] + "__" + tmp4["start1"].astype(str) + "___" + tmp4["chr2"] + "__" + tmp4["end2"].astype(str)
-    df=pd.concat([tmp,tmp2], ignore_index=True, axis=0)
-    df=pd.concat([df,tmp3], ignore_index=True, axis=0)
-    df=pd.concat([df,tmp4], ignore_index=True, axis=0)
+    # breakpoint を整数の列で持つ。bp_chr1,bp_chr2 は染色体の Categorical ("chr__" の文字列順)
+    # dir1 が + なら end1、- なら start1、dir2 が + なら start2、- なら end2 (行は元の ++,+-,-+,-- の concat と同じ順)
+    dir_code=np.select([(df['dir1']=="+")&(df['dir2']=="+"),(df['dir1']=="+")&(df['dir2']=="-"),(df['dir1']=="-")&(df['dir2']=="+"),(df['dir1']=="-")&(df['dir2']=="-")],[0,1,2,3],-1)
+    order=np.argsort(dir_code,kind='stable')
+    df=df.iloc[order[dir_code[order]>=0]].reset_index(drop=True)
+    chrom=sorted(pd.unique(pd.concat([df['chr1'],df['chr2']])),key=lambda x:x+"__")
+    df['bp_chr1']=pd.Categorical(df['chr1'],categories=chrom)
+    df['bp_pos1']=np.where(df['dir1']=="+",df['end1'],df['start1']).astype(np.int64)
+    df['bp_chr2']=pd.Categorical(df['chr2'],categories=chrom)
+    df['bp_pos2']=np.where(df['dir2']=="+",df['start2'],df['end2']).astype(np.int64)
     return df
 
-def add_g1_g2_clst_col_v3(df_fusioncand_clst_tmp,clst_col,g1_col,g2_col,out_g1_col,out_g2_col,out_g1_pct_col,out_g2_pct_col,criteria):
-   res_df=pd.DataFrame()
-   for clst in df_fusioncand_clst_tmp[clst_col].unique():
-      df_fusioncand_clust_sub= df_fusioncand_clst_tmp[df_fusioncand_clst_tmp[clst_col]==clst]
-      ratio1 = df_fusioncand_clust_sub[g1_col].value_counts(normalize=True)
-      ratio2 = df_fusioncand_clust_sub[g2_col].value_counts(normalize=True)
-      cond1 = ratio1 >= criteria
-      cond2 = ratio2 >= criteria
-      g1_multi_clst="_".join(list((cond1.index[cond1])))
-      g2_multi_clst="_".join(list((cond2.index[cond2])))
-      g1_multi_clst_pct="_".join(list((ratio1[cond1].round(2)*100).astype(int).astype(str) + '%'))
-      g2_multi_clst_pct="_".join(list((ratio2[cond2].round(2)*100).astype(int).astype(str) + '%'))
-      #g1_multi_clst_pct=ratio1[cond1][0].round(2)
-      #g2_multi_clst_pct=ratio2[cond2][0].round(2)
-      
-      df_fusioncand_clust_sub[out_g1_col]=g1_multi_clst
-      df_fusioncand_clust_sub[out_g2_col]=g2_multi_clst
-      df_fusioncand_clust_sub[out_g1_pct_col]=g1_multi_clst_pct
-      df_fusioncand_clust_sub[out_g2_pct_col]=g2_multi_clst_pct
-      #res_df = res_df.append(df_fusioncand_clust_sub)
-      res_df=pd.concat([res_df,df_fusioncand_clust_sub], ignore_index=True, axis=0)
-
-   return res_df
-def add_clst_count_v2(df,clst_col,support_flg=1):
-    df_clst_count = df[clst_col].value_counts().to_frame().reset_index().rename(columns={"count": "clst_count"})
-    df_out=pd.merge(df,df_clst_count,on=clst_col)
-    if support_flg==1:
-        df_out["support_read"]=df_out.apply(lambda x:int(x["clst_count"])*float(x['g1_clst_pct'].split("_")[0].replace("%",""))*float(x['g2_clst_pct'].split("_")[0].replace("%",""))*0.01*0.01,axis=1)
-    else:
-        pass
-    assert df[clst_col].nunique()==df_out[clst_col].nunique()
-    return df_out
-
 def make_bp_clst_mode_v2(df):
-    df[["name2_chr1","name2_pos1","name2_chr2","name2_pos2"]]=df['name2'].apply(lambda x:split_bp(x))
-    tmp1=df.groupby('g1_g2_clst',as_index=True)['name2_pos1'].value_counts().to_frame().rename(columns={"count":"name2_pos1_count"}).reset_index().rename(columns={'name2_pos1':'name2_pos1_mode'})#.drop_duplicates("g1_g2_clst")
-    tmp2=df.groupby('g1_g2_clst',as_index=True)['name2_pos2'].value_counts().to_frame().rename(columns={"count":"name2_pos2_count"}).reset_index().rename(columns={'name2_pos2':'name2_pos2_mode'})#.drop_duplicates("g1_g2_clst")
-    tmp3=pd.merge(tmp1.groupby('g1_g2_clst')["name2_pos1_mode"].apply(list).to_frame().reset_index(),tmp1.groupby('g1_g2_clst')["name2_pos1_count"].apply(list).to_frame().reset_index()).rename(columns={'name2_pos1_mode':'name2_pos1_mode_list','name2_pos1_count':'name2_pos1_count_list'})
-    tmp4=pd.merge(tmp2.groupby('g1_g2_clst')["name2_pos2_mode"].apply(list).to_frame().reset_index(),tmp2.groupby('g1_g2_clst')["name2_pos2_count"].apply(list).to_frame().reset_index()).rename(columns={'name2_pos2_mode':'name2_pos2_mode_list','name2_pos2_count':'name2_pos2_count_list'})
-    df_bp_mode=pd.merge(tmp1.drop_duplicates("g1_g2_clst"),pd.merge(tmp2.drop_duplicates("g1_g2_clst"),pd.merge(tmp3,tmp4)))
-    df=pd.merge(df,df_bp_mode,how='left',on='g1_g2_clst')
-    df["name2_clst"]=df['name2_chr1']+"__"+df['name2_pos1_mode'].astype(str)+"___"+df['name2_chr2']+"__"+df['name2_pos2_mode'].astype(str)
-    df=df.drop(['name2_chr1','name2_chr2','name2_pos1','name2_pos2'],axis=1)
+    # g1_g2_clst ごとの bp_pos1,bp_pos2 の最頻値 (同数なら小さい位置) と件数
+    for i in ['1','2']:
+        count=df.groupby(['g1_g2_clst',f'bp_pos{i}']).size().rename(f'name2_pos{i}_count').reset_index()
+        mode=count.sort_values(['g1_g2_clst',f'name2_pos{i}_count',f'bp_pos{i}'],ascending=[True,False,True]).drop_duplicates('g1_g2_clst')
+        df=pd.merge(df,mode.rename(columns={f'bp_pos{i}':f'name2_pos{i}_mode'}),how='left',on='g1_g2_clst')
     return df
 
+def detect_fusion(mmap2_Nth2_rmcross_rmdir, edge_start_end_ov, mmap2_gap, mmap2_refseq, gene_index, TARGET, cytoband_index=None):
+    # mmap2_Nth2_rmcross_rmdir, edge_start_end_ov: Prep_Gap-Realignment の結果 (intermediate/{TARGET}_genome.csv, gap_4make_edge.csv と同じ列)
+    # mmap2_gap: select_blat_edge_4gaponly 済みのgapのヒット, mmap2_refseq: filter_refseq_paf 済みのrefseq
+    # cytoband_index: load_bed_index(cytoband_path, 'chr_pq')。渡すと name2_clst の breakpoint の cytoband を bp1_cytoband, bp2_cytoband 列に付ける
+    out_col=['TARGET','hit_rid','g1_clst','g2_clst','g1_g2_clst','name','name2_clst','support_read']
+    edge_start_end_ov = edge_start_end_ov.rename(columns={'length':'gap_len_tmp'})
+    mmap2_Nth2_rmcross_rmdir=mmap2_Nth2_rmcross_rmdir.reset_index(drop=True).rename(columns={'Qstart':'Qstart_org',"Qend":"Qend_org","Tstart":"Tstart_org","Tend":"Tend_org","Qstart_fix":"Qstart","Qend_fix":"Qend","Tstart_fix":"Tstart","Tend_fix":"Tend"})
+
+    #gapがヒットする遺伝子名を取得
+    mmap2_gap=pd.merge(mmap2_gap,edge_start_end_ov[['Qname','gap_len_tmp']],on="Qname")
+    mmap2_gap['gap_mapping_rate']=mmap2_gap['alignment_length']/mmap2_gap['gap_len_tmp']
+    mmap2_gap=mmap2_gap.query('gap_mapping_rate>=@gap_mapping_rate_cutoff').query('evalue<=@gap_evalue_cutoff')
+    mmap2_gap['gene_gap']=annotate_intervals(gene_index, mmap2_gap['Tname'],mmap2_gap['Tstart'],mmap2_gap['Tend'])
+    mmap2_gap_use=filterout_multigene_hit(mmap2_gap,"gene_gap").query('gene_gap!="intron"')
+
+    ### gapの配列を使ってフィルタ----------------------------------------------------------------------------------------------------------
+    ### gapの配列の結果とgap長をマージ
+    mmap2_Nth2_rmcross_rmdup_gap =pd.merge(mmap2_Nth2_rmcross_rmdir,mmap2_gap_use[['Qname','Tname','Tend','Tstart','gene_gap','alignment_length']],on=['Qname','Tname'],how='left',suffixes=['','_gap'])
+    mmap2_Nth2_rmcross_rmdup_gap = pd.merge(mmap2_Nth2_rmcross_rmdup_gap,edge_start_end_ov[['Qname','gap_len_tmp']],how='left',on=['Qname'])
+
+    # genoem とgap でgene名が同じもののみ採用する
+    mmap2_Nth2_rmcross_rmdup_gap=mmap2_Nth2_rmcross_rmdup_gap.query('gene!="intron"') #gap_len_tmpが50より大きく、gapもヒットしないものはdrop
+    mmap2_Nth2_rmcross_rmdup_gap_use=flging_gap_use_read_v2(mmap2_Nth2_rmcross_rmdup_gap)
+    mmap2_Nth2_rmcross_rmdup_gap_use["gene_gap_equal"]=mmap2_Nth2_rmcross_rmdup_gap_use.apply(lambda x:check_gene_genegap(x["gene"],x['gene_gap']),axis=1)
+
+    # gapでヒットするupdate
+    mmap2_Nth2_rmcross_rmdup_gap_use=bp_update_v3(mmap2_Nth2_rmcross_rmdup_gap_use)  #v24.4.2.2
+    mmap2_Nth2_rmcross_rmdup_gap_use=fix_start_end(mmap2_Nth2_rmcross_rmdup_gap_use)  #v24.4.2
+
+    #  フラグメントの融合のペアを算出-----------------------------------------------------------------------------------------
+    df_fusioncand_g = cul_fusioncand_v4(mmap2_Nth2_rmcross_rmdup_gap_use)
+
+    #  genome側のクロスオーバー除去----------------------------------------------------------------------------------------
+    df_fusioncand_g,drop_rid_cross_over_genome = rm_cross_over(df_fusioncand_g)
+    df_fusioncand_g=df_fusioncand_g.astype({"start1":int,"end1":int,"start2":int,"end2":int})
+
+    ### gapでフィルタ---------------------------------------------------------------------------------------------------------
+    df_fusioncand_g_gap = pd.merge(df_fusioncand_g,mmap2_gap_use[['Qname','gene_gap']],left_on="hit_rid",right_on="Qname",how='left')
+    df_fusioncand_g_gap_use=df_fusioncand_g_gap.copy()
+
+    # gapと遺伝子名が違うものは除去
+    df_fusioncand_g_gap_use=pd.merge(df_fusioncand_g_gap_use,mmap2_Nth2_rmcross_rmdup_gap_use.groupby('Qname',as_index=False)['gene_gap_equal'].max(),how="left").drop("Qname",axis=1)
+    df_fusioncand_g_gap_use = df_fusioncand_g_gap_use.query('-1*@buffer<=gap_len<=@gap_len_cutoff or gene_gap_equal==1') #v24.4.2.3
+
+    # ### breakpointを特定---------------------------------------------------------------------------------------------------------
+    df_fusioncand_g_gap_use= make_name_col_nodev(df_fusioncand_g_gap_use)
+    df_fusioncand_g_gap_use = change_order_g1g2_v3(df_fusioncand_g_gap_use,"genome").rename(columns={'gene1':'g1','gene2':'g2'})
+
+    #breakpointの順番入れ替え
+    df_fusioncand_g_gap_use=sort_bp_pair(df_fusioncand_g_gap_use)
+
+    ### 2geneに当たるもののみ採用
+    df_fusioncand_g_gap_use_2gene  = filter_only_2pairofgene(df_fusioncand_g_gap_use,'g1','g2')
+
+    # # #intronにヒットするものやg1・g2が包含されるものは除く（除ききれなかったスプライシング）
+    df_fusioncand_g_gap_use_2gene_filtered = df_fusioncand_g_gap_use_2gene.query('g1!="intron"&g2!="intron"')
+    df_fusioncand_g_gap_use_2gene_filtered = df_fusioncand_g_gap_use_2gene_filtered[df_fusioncand_g_gap_use_2gene_filtered.apply(lambda x: (x['g1'] not in x['g2']) and ( x['g2'] not in x['g1']),axis=1)]
+
+    ### transcriptの結果を使うための前処理
+    ##intronにヒットするものやg1・g2が包含されるものは除く
+    rid = df_fusioncand_g_gap_use_2gene_filtered.hit_rid.unique()
+    mmap2_refseq_use = mmap2_refseq.query('Qname in @rid')
+    mmap2_refseq_use = mmap2_refseq_use.drop_duplicates(subset=['Qname','gene'])
+    mmap2_refseq_use = add_Nth_hit(mmap2_refseq_use,Nth_hit_buffer)
+    df_fusioncand_r = cul_fusioncand_v4_4refseq(mmap2_refseq_use)
+    df_refseq_r_tmp = df_fusioncand_r[['hit_rid','g1','g2']].drop_duplicates()
+    df_fusioncand_g_gap_use_2gene_filtered_refseq = pd.merge(df_fusioncand_g_gap_use_2gene_filtered,df_refseq_r_tmp,on='hit_rid',suffixes=['','_r'],how='inner')
+
+    ### genomeのみ検出を捨てる
+    df_fusioncand_g_gap_use_2gene_filtered_refseq.query('g1_r.notna() and g2_r.notna()',inplace=True)
+    df_fusioncand_g_gap_use_2gene_filtered_refseq[['g1_r','g2_r']] = df_fusioncand_g_gap_use_2gene_filtered_refseq.apply(lambda x: sorted(pd.Series([x['g1_r'], x['g2_r']]), reverse=False), axis=1,result_type='expand')
+
+    # ##refsqも同様g1・g2が包含されるものは除く
+    df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered = df_fusioncand_g_gap_use_2gene_filtered_refseq[df_fusioncand_g_gap_use_2gene_filtered_refseq.apply(lambda x: (x['g1_r'] not in x['g2_r']) and ( x['g2_r'] not in x['g1_r']),axis=1)]
+    df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered['diff_refseq']=df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered.apply(lambda x:drop_different_genepair_reseq(x['g1'],x['g2'],x['g1_r'],x['g2_r']),axis=1)
+    df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered = df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered.query('diff_refseq==0')
+
+    ### クラスタリング準備--------------------------------------------------------------------------------------------------------------------------------
+    df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered=make_breakpoint_divX(df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered,clst_bp)
+
+    df_fusioncand_4clst=df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered.query('mapQ1!=0&mapQ2!=0')
+    df_fusioncand_4clst=df_fusioncand_4clst.query('-1*@buffer<=gap_len<=@gap_len_cutoff or gene_gap_equal==1')
+    df_fusioncand_4clst = add_g1_g2_clst_col_v3(df_fusioncand_4clst, 'name_key', 'g1_r', 'g2_r', 'g1_clst', 'g2_clst', 'g1_clst_pct', 'g2_clst_pct',clst_percent_cutoff)
+
+    df_fusioncand_4clst_major=df_fusioncand_4clst.query('g1_clst!=""').query('g2_clst!=""')
+    df_fusioncand_4clst_major=add_clst_count_v2(df_fusioncand_4clst_major, 'name_key',1).sort_values(['clst_count','gap_len'],ascending=[False,True])
+    df_fusioncand_4clst_major=df_fusioncand_4clst_major.drop_duplicates("hit_rid")
+    df_fusioncand_4clst_major['g1_g2_clst'] = df_fusioncand_4clst_major['g1_clst'] + "--" + df_fusioncand_4clst_major["g2_clst"]
+
+    #bpを最頻値で
+    df_fusioncand_4clst_major_bp=make_bp_clst_mode_v2(df_fusioncand_4clst_major)
+
+    ## データ出力 -------------------------------------------------------------------------------------------------------------------------------
+    df_fusioncand_4clst_major_bp.insert(0, 'TARGET', TARGET)   
+    df_out=df_fusioncand_4clst_major_bp.drop_duplicates(['hit_rid','g1_g2_clst'])
+    df_out['name']=render_bp(df_out['bp_chr1'],df_out['bp_bin1'],df_out['bp_chr2'],df_out['bp_bin2'])
+    df_out['name2_clst']=render_bp(df_out['bp_chr1'],df_out['name2_pos1_mode'],df_out['bp_chr2'],df_out['name2_pos2_mode'])
+    if cytoband_index is not None:
+        for i in [1,2]:
+            df_out[f'bp{i}_cytoband']=get_cytoband_start_end_v2(cytoband_index,df_out[f'bp_chr{i}'],df_out[f'name2_pos{i}_mode'],df_out[f'name2_pos{i}_mode'])
+        out_col=out_col+['bp1_cytoband','bp2_cytoband']
+    df_out=df_out[out_col]
+    return df_out
 
 
-
-#input
-paf_dir = os.path.join(root, "FUGAREC")
-paffile_name = f"{TARGET}_{genome_name}.paf"
-paffile_name_refseq=f"{TARGET}_refseq.paf"
-gap_genome_blat_name = f"{TARGET}_gap_blat_min15_stp5.psl"
-paffile_path = os.path.join(paf_dir, paffile_name)
-paffile_refseq_path = os.path.join(paf_dir, paffile_name_refseq)
-gap_genome_blat_path = os.path.join(paf_dir, gap_genome_blat_name)
-
-#outdir
-res_file_dir = paf_dir
-intermediate_file_dir = os.path.join(res_file_dir, "intermediate")
-res_genome_dir = os.path.join(res_file_dir, "genome")
-res_genome_path = os.path.join(res_genome_dir, f"{TARGET}_df_fusioncand_genome.csv")
-res_refseq_path = os.path.join(res_genome_dir, f"{TARGET}_df_fusioncand_refseq.csv")
-res_4_edge_alignment_dir = os.path.join(res_file_dir, "for_edge_alignment")
-for_make_edge_file_path = os.path.join(res_4_edge_alignment_dir, f"{TARGET}", "gap_4make_edge.csv")
-output_file_path = os.path.join(res_file_dir, f'df_res_{TARGET}.csv')
-
-#gtf
-gtf_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.usecol")
-gtf_exon_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.exon")
-
-mmap2_align2genome_path = os.path.join(intermediate_file_dir, f"{TARGET}_genome.csv")
-mmap2_align2refseq_path = os.path.join(intermediate_file_dir, f"{TARGET}_refseq.csv")
-out_col=['TARGET','hit_rid','g1_clst','g2_clst','g1_g2_clst','name','name2_clst','support_read']
-
-#### ファイル読み込み--------------------------------------------------------------------------------------------
-gtf = prep_gtf(pd.read_csv(gtf_path))
-multihit_id,mmap2_refseq_org, mmap2_refseq = filter_refseq_paf(paffile_refseq_path, gtf_path)  
-edge_start_end_ov = pd.read_csv(for_make_edge_file_path).rename(columns={'length':'gap_len_tmp'})
-mmap2_Nth2_rmcross_rmdir = pd.read_csv(mmap2_align2genome_path)
-mmap2_Nth2_rmcross_rmdir=mmap2_Nth2_rmcross_rmdir.rename(columns={'Qstart':'Qstart_org',"Qend":"Qend_org","Tstart":"Tstart_org","Tend":"Tend_org","Qstart_fix":"Qstart","Qend_fix":"Qend","Tstart_fix":"Tstart","Tend_fix":"Tend"})
-
-#gapがヒットする遺伝子名を取得
-mmap2_gap=prep_blat_edge_4gaponly(gap_genome_blat_path)
-mmap2_gap=pd.merge(mmap2_gap,edge_start_end_ov[['Qname','gap_len_tmp']],on="Qname")
-mmap2_gap['gap_mapping_rate']=mmap2_gap['alignment_length']/mmap2_gap['gap_len_tmp']
-mmap2_gap=mmap2_gap.query('gap_mapping_rate>=@gap_mapping_rate_cutoff').query('evalue<=@gap_evalue_cutoff')
-mmap2_gap['gene_gap']=mmap2_gap.apply(lambda x: get_gene_name_start_end(gtf, x['Tname'],x['Tstart'],x['Tend']), axis=1)
-mmap2_gap_use=filterout_multigene_hit(mmap2_gap,"gene_gap").query('gene_gap!="intron"')
-
-### gapの配列を使ってフィルタ----------------------------------------------------------------------------------------------------------
-### gapの配列の結果とgap長をマージ
-mmap2_Nth2_rmcross_rmdup_gap =pd.merge(mmap2_Nth2_rmcross_rmdir,mmap2_gap_use[['Qname','Tname','Tend','Tstart','gene_gap','alignment_length']],on=['Qname','Tname'],how='left',suffixes=['','_gap'])
-mmap2_Nth2_rmcross_rmdup_gap = pd.merge(mmap2_Nth2_rmcross_rmdup_gap,edge_start_end_ov[['Qname','gap_len_tmp']],how='left',on=['Qname'])
-
-# genoem とgap でgene名が同じもののみ採用する
-mmap2_Nth2_rmcross_rmdup_gap=mmap2_Nth2_rmcross_rmdup_gap.query('gene!="intron"') #gap_len_tmpが50より大きく、gapもヒットしないものはdrop
-mmap2_Nth2_rmcross_rmdup_gap_use=flging_gap_use_read_v2(mmap2_Nth2_rmcross_rmdup_gap)
-mmap2_Nth2_rmcross_rmdup_gap_use["gene_gap_equal"]=mmap2_Nth2_rmcross_rmdup_gap_use.apply(lambda x:check_gene_genegap(x["gene"],x['gene_gap']),axis=1)
-
-# gapでヒットするupdate
-mmap2_Nth2_rmcross_rmdup_gap_use=bp_update_v3(mmap2_Nth2_rmcross_rmdup_gap_use)  #v24.4.2.2
-mmap2_Nth2_rmcross_rmdup_gap_use=fix_start_end(mmap2_Nth2_rmcross_rmdup_gap_use)  #v24.4.2
-
-#  フラグメントの融合のペアを算出-----------------------------------------------------------------------------------------
-df_fusioncand_g = cul_fusioncand_v4(mmap2_Nth2_rmcross_rmdup_gap_use)
-
-#  genome側のクロスオーバー除去----------------------------------------------------------------------------------------
-df_fusioncand_g,drop_rid_cross_over_genome = rm_cross_over(df_fusioncand_g)
-df_fusioncand_g=df_fusioncand_g.astype({"start1":int,"end1":int,"start2":int,"end2":int})
-
-### gapでフィルタ---------------------------------------------------------------------------------------------------------
-df_fusioncand_g_gap = pd.merge(df_fusioncand_g,mmap2_gap_use[['Qname','gene_gap']],left_on="hit_rid",right_on="Qname",how='left')
-df_fusioncand_g_gap_use=df_fusioncand_g_gap.copy()
-
-# gapと遺伝子名が違うものは除去
-df_fusioncand_g_gap_use=pd.merge(df_fusioncand_g_gap_use,mmap2_Nth2_rmcross_rmdup_gap_use.groupby('Qname',as_index=False)['gene_gap_equal'].max(),how="left").drop("Qname",axis=1)
-df_fusioncand_g_gap_use = df_fusioncand_g_gap_use.query('-1*@buffer<=gap_len<=@gap_len_cutoff or gene_gap_equal==1') #v24.4.2.3
-
-# ### breakpointを特定---------------------------------------------------------------------------------------------------------
-df_fusioncand_g_gap_use= make_name_col_nodev(df_fusioncand_g_gap_use)
-df_fusioncand_g_gap_use = change_order_g1g2_v3(df_fusioncand_g_gap_use,"genome").rename(columns={'gene1':'g1','gene2':'g2'})
-
-#name2の順番入れ替え
-df_fusioncand_g_gap_use['name2']=df_fusioncand_g_gap_use['name2'].apply(lambda x: "___".join(sorted([x.split("___")[0],x.split("___")[1]],reverse=False)))
-
-### 2geneに当たるもののみ採用
-df_fusioncand_g_gap_use_2gene  = filter_only_2pairofgene(df_fusioncand_g_gap_use,'g1','g2')
-
-# # #intronにヒットするものやg1・g2が包含されるものは除く（除ききれなかったスプライシング）
-df_fusioncand_g_gap_use_2gene_filtered = df_fusioncand_g_gap_use_2gene.query('g1!="intron"&g2!="intron"')
-df_fusioncand_g_gap_use_2gene_filtered = df_fusioncand_g_gap_use_2gene_filtered[df_fusioncand_g_gap_use_2gene_filtered.apply(lambda x: (x['g1'] not in x['g2']) and ( x['g2'] not in x['g1']),axis=1)]
-
-### transcriptの結果を使うための前処理
-##intronにヒットするものやg1・g2が包含されるものは除く
-rid = df_fusioncand_g_gap_use_2gene_filtered.hit_rid.unique()
-mmap2_refseq_use = mmap2_refseq.query('Qname in @rid')
-mmap2_refseq_use = mmap2_refseq_use.drop_duplicates(subset=['Qname','gene'])
-mmap2_refseq_use = add_Nth_hit(mmap2_refseq_use)
-df_fusioncand_r = cul_fusioncand_v4_4refseq(mmap2_refseq_use)
-df_refseq_r_tmp = df_fusioncand_r[['hit_rid','g1','g2']].drop_duplicates()
-df_fusioncand_g_gap_use_2gene_filtered_refseq = pd.merge(df_fusioncand_g_gap_use_2gene_filtered,df_refseq_r_tmp,on='hit_rid',suffixes=['','_r'],how='inner')
-
-### genomeのみ検出を捨てる
-df_fusioncand_g_gap_use_2gene_filtered_refseq.query('g1_r.notna() and g2_r.notna()',inplace=True)
-df_fusioncand_g_gap_use_2gene_filtered_refseq[['g1_r','g2_r']] = df_fusioncand_g_gap_use_2gene_filtered_refseq.apply(lambda x: sorted(pd.Series([x['g1_r'], x['g2_r']]), reverse=False), axis=1,result_type='expand')
-
-# ##refsqも同様g1・g2が包含されるものは除く
-df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered = df_fusioncand_g_gap_use_2gene_filtered_refseq[df_fusioncand_g_gap_use_2gene_filtered_refseq.apply(lambda x: (x['g1_r'] not in x['g2_r']) and ( x['g2_r'] not in x['g1_r']),axis=1)]
-df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered['diff_refseq']=df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered.apply(lambda x:drop_different_genepair_reseq(x['g1'],x['g2'],x['g1_r'],x['g2_r']),axis=1)
-df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered = df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered.query('diff_refseq==0')
-
-### クラスタリング準備--------------------------------------------------------------------------------------------------------------------------------
-df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered["name"]=df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered.apply(lambda x:make_breakpoint_divX(x['name2'],clst_bp),axis=1)
-
-df_fusioncand_4clst=df_fusioncand_g_gap_use_2gene_filtered_refseq_filtered.query('mapQ1!=0&mapQ2!=0')
-df_fusioncand_4clst=df_fusioncand_4clst.query('-1*@buffer<=gap_len<=@gap_len_cutoff or gene_gap_equal==1')
-df_fusioncand_4clst = add_g1_g2_clst_col_v3(df_fusioncand_4clst, 'name', 'g1_r', 'g2_r', 'g1_clst', 'g2_clst', 'g1_clst_pct', 'g2_clst_pct',clst_percent_cutoff)
-
-df_fusioncand_4clst_major=df_fusioncand_4clst.query('g1_clst!=""').query('g2_clst!=""')
-df_fusioncand_4clst_major=add_clst_count_v2(df_fusioncand_4clst_major, 'name',1).sort_values(['clst_count','gap_len'],ascending=[False,True])
-df_fusioncand_4clst_major=df_fusioncand_4clst_major.drop_duplicates("hit_rid")
-df_fusioncand_4clst_major['g1_g2_clst'] = df_fusioncand_4clst_major['g1_clst'] + "--" + df_fusioncand_4clst_major["g2_clst"]
-
-#bpを最頻値で
-df_fusioncand_4clst_major_bp=make_bp_clst_mode_v2(df_fusioncand_4clst_major)
-
-## データ出力 -------------------------------------------------------------------------------------------------------------------------------
-df_fusioncand_4clst_major_bp.insert(0, 'TARGET', TARGET)   
-df_out=df_fusioncand_4clst_major_bp[out_col].drop_duplicates(['hit_rid','g1_g2_clst'])
-df_out.to_csv(output_file_path, index=False)
-#df_fusioncand_4clst_major_bp[['TARGET','hit_rid','g1_g2_clst','support_read','name2_clst','gap_len']].to_csv(output_file_path, index=False)
-#df_fusioncand_4clst_major_bp.query('name2_pos1_count>1 and name2_pos2_count>1').to_csv(output_file_path, index=False)
-
-
-
-
-
+if __name__ == '__main__':
+    root = sys.argv[1]
+    TARGET=sys.argv[2] #TARGET="MCF7"
+    reference_data_path=sys.argv[3]
+    genome_name=sys.argv[4] #"hg38"
+    gtf_name=sys.argv[5] #"genCode44"
+    cytoband_path=sys.argv[6] if len(sys.argv) > 6 else None #UCSC の cytoBand.txt (任意)
+
+    # root = "/data2/chimericRNA_detection/datasets/real_data/K562"
+    # TARGET="MCF7" #TARGET="MCF7"
+    # reference_data_path="/data2/chimericRNA_detection/code/Reference_data"
+    # genome_name="hg38" #"hg38"
+    # gtf_name="genCode44" #"genCode44"
+
+    #input
+    paf_dir = os.path.join(root, "FUGAREC")
+    paffile_name = f"{TARGET}_{genome_name}.paf"
+    paffile_name_refseq=f"{TARGET}_refseq.paf"
+    gap_genome_blat_name = f"{TARGET}_gap_blat_min15_stp5.psl"
+    paffile_path = os.path.join(paf_dir, paffile_name)
+    paffile_refseq_path = os.path.join(paf_dir, paffile_name_refseq)
+    gap_genome_blat_path = os.path.join(paf_dir, gap_genome_blat_name)
+
+    #outdir
+    res_file_dir = paf_dir
+    intermediate_file_dir = os.path.join(res_file_dir, "intermediate")
+    res_genome_dir = os.path.join(res_file_dir, "genome")
+    res_genome_path = os.path.join(res_genome_dir, f"{TARGET}_df_fusioncand_genome.csv")
+    res_refseq_path = os.path.join(res_genome_dir, f"{TARGET}_df_fusioncand_refseq.csv")
+    res_4_edge_alignment_dir = os.path.join(res_file_dir, "for_edge_alignment")
+    for_make_edge_file_path = os.path.join(res_4_edge_alignment_dir, f"{TARGET}", "gap_4make_edge.csv")
+    output_file_path = os.path.join(res_file_dir, f'df_res_{TARGET}.csv')
+
+    #gtf
+    gtf_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.usecol")
+    gtf_exon_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.exon")
+
+    mmap2_align2genome_path = os.path.join(intermediate_file_dir, f"{TARGET}_genome.csv")
+    mmap2_align2refseq_path = os.path.join(intermediate_file_dir, f"{TARGET}_refseq.csv")
+
+    #### ファイル読み込み--------------------------------------------------------------------------------------------
+    gene_index = load_gene_index(gtf_path)
+    multihit_id, mmap2_refseq = filter_refseq_paf(paffile_refseq_path, gtf_path)  
+    edge_start_end_ov = read_intermediate(for_make_edge_file_path, gap_intermediate_col)
+    mmap2_Nth2_rmcross_rmdir = read_intermediate(mmap2_align2genome_path, genome_intermediate_col)
+    mmap2_gap=prep_blat_edge_4gaponly(gap_genome_blat_path)
+
+    cytoband_index = load_bed_index(cytoband_path, 'chr_pq') if cytoband_path is not None else None
+    df_out = detect_fusion(mmap2_Nth2_rmcross_rmdir, edge_start_end_ov, mmap2_gap, mmap2_refseq, gene_index, TARGET, cytoband_index)
+    df_out.to_csv(output_file_path, index=False)
+    #df_fusioncand_4clst_major_bp[['TARGET','hit_rid','g1_g2_clst','support_read','name2_clst','gap_len']].to_csv(output_file_path, index=False)
+    #df_fusioncand_4clst_major_bp.query('name2_pos1_count>1 and name2_pos2_count>1').to_csv(output_file_path, index=False)
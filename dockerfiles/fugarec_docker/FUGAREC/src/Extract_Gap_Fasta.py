@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# coding: utf-8
+# gap_4make_edge.csv (.parquet) の gap 部分だけを fastq から切り出して fasta にする
+# usage: python Extract_Gap_Fasta.py <fastq> <gap_4make_edge.csv> <out.fa>
+# 見出しは >Qname gapの開始-終了 (空白までの Qname が配列名になり、Detect_Fusion.py の prep_blat_edge_4gaponly で
+# Qname として gap_4make_edge.csv と結合される。開始-終了 はコメント)
+import sys
+from fugarec_utils import write_gap_fasta, read_intermediate
+
+fastq_path = sys.argv[1]
+for_make_edge_file_path = sys.argv[2]
+out_path = sys.argv[3]
+
+edge_start_end_ov = read_intermediate(for_make_edge_file_path, ['Qname', 'Qstart', 'Qend'])
+n_gap = write_gap_fasta(fastq_path, edge_start_end_ov, out_path)
+print(f'gap sequences: {n_gap} / {edge_start_end_ov.Qname.nunique()} reads -> {out_path}')
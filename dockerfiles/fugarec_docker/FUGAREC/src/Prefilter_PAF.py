@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# coding: utf-8
+# minimap2 の出力 (PAF) を標準入力から読み、FUGAREC で候補になりうるreadの行だけを書き出す
+# 全readのPAFをディスクに書かずに、融合遺伝子の候補にならないreadをここで落とす
+# genome: QstartとQendが1種類ではなく、重ならないヒットがちょうど2つのread (Prep_Gap-Realignment の filter_out_Nth_hit_ov2 まで残るread)
+# refseq: 当たる遺伝子が1つだけのreadを除く (Detect_Fusion の filter_refseq_paf と同じ判定)
+# どちらもreadごとの判定なので、後段の結果は全readのPAFを読んだ場合と同じ。出力はPAFの先頭12列
+# usage: minimap2 ... | python Prefilter_PAF.py genome <out.paf>
+#        minimap2 ... | python Prefilter_PAF.py refseq <out.paf> <genome_gtf.tab.usecol>
+import sys
+import pandas as pd
+from fugarec_utils import PAF_COL, iter_paf_reads, filter_genome_candidate
+
+paf_type = sys.argv[1]
+out_path = sys.argv[2]
+
+if paf_type == 'genome':
+    from importlib import import_module
+    Nth_hit_buffer = import_module('Prep_Gap-Realignment').Nth_hit_buffer
+    filter_func = lambda chunk: filter_genome_candidate(chunk, Nth_hit_buffer)
+elif paf_type == 'refseq':
+    from Detect_Fusion import make_refseq_chunk_filter
+    filter_refseq_chunk = make_refseq_chunk_filter(sys.argv[3])
+    filter_func = lambda chunk: chunk[chunk['Qname'].isin(filter_refseq_chunk(chunk.copy())['Qname'])]
+else:
+    sys.exit(f'unknown PAF type: {paf_type} (genome or refseq)')
+
+n_read, n_keep = 0, 0
+with open(out_path, 'w') as out:
+    try:
+        for chunk in iter_paf_reads(sys.stdin):
+            keep = filter_func(chunk)
+            n_read += chunk['Qname'].nunique()
+            n_keep += keep['Qname'].nunique()
+            keep[PAF_COL].to_csv(out, sep='\t', header=False, index=False)
+    except pd.errors.EmptyDataError:
+        pass
+print(f'{paf_type}: {n_keep} / {n_read} reads -> {out_path}')
@@ -1,17 +1,6 @@
 #!/usr/bin/env python
 # coding: utf-8
 import sys
-root = sys.argv[1]
-TARGET=sys.argv[2] #TARGET="MCF7"
-reference_data_path=sys.argv[3]
-genome_name=sys.argv[4] #"hg38"
-gtf_name=sys.argv[5] #"genCode44"
-
-# root = "/data2/chimericRNA_detection/datasets/real_data/K562"
-# TARGET="MCF7" #TARGET="MCF7"
-# reference_data_path="/data2/chimericRNA_detection/code/Reference_data"
-# genome_name="hg38" #"hg38"
-# gtf_name="genCode44" #"genCode44"
 
 ver="24.4.2.4"
 mapping_rate_criteria_trans=0.99
@@ -41,6 +30,7 @@ from pathlib import Path
 import itertools
 from collections import Counter
 from glob import glob 
+from fugarec_utils import build_interval_index, annotate_intervals, load_gene_index, load_exon_index, load_tx2gene, split_tname, snap_exon_boundary, add_Nth_hit, judge_cross_over_v3, pair_fusioncand, pair_gap, read_paf_filtered, filter_qstart_qend_not_unique, partition_filter, resolve_clst_final, write_gap_fasta, write_intermediate
 #import matplotlib.pyplot as plt
 #import collections
 #mport pandas_bj
@@ -87,24 +77,6 @@ def rm_cross_over(df_fusioncand,buffer=buffer):
     #print('クロスオーバーで除く本数は{}本'.format(df_fusioncand.shape[0] - df_fusioncand_rmcross.shape[0]))
     return df_fusioncand_rmcross,drop_rid
 
-def judge_cross_over_v3(mmap2_paired,buffer,s,e):
-
-    rids=[]
-    if mmap2_paired['Nth_hit'].value_counts()[1] != mmap2_paired['Nth_hit'].value_counts()[2]:
-        drop_rid_nopaired = pd.DataFrame(mmap2_paired.groupby('Qname')['Nth_hit'].nunique() == 1).query('Nth_hit==True').index
-        mmap2_paired = mmap2_paired.query('Qname not in @drop_rid_nopaired')
-    for x,rid in enumerate(tqdm(mmap2_paired.Qname.unique())):
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        N=mmap2_paired_sub.Nth_hit.min()
-        first_end_pos = int(mmap2_paired_sub.query('Nth_hit==@N')[e].max())
-        try:
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit==@N+1')[s].min())
-        except:
-            assert mmap2_paired_sub['Nth_hit'].nunique()==2 ,'Nth_hitが3以上です'
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit!=@N')[s].min())
-        if first_end_pos - buffer > second_start_pos:
-            rids.append(rid)
-    return rids
 
 
 def cul_mapping_rate_all(df):
@@ -126,69 +98,11 @@ def cul_mapping_GAP(df):
     return df_out
 
 
-def get_gene_name_start_end(gtf,chr,s,e,buffer=15):
-    gtf['len']=gtf['end']-gtf['start']
-    multi_hit_flg=0
-    gtf_sub1=gtf.query('chr==@chr & start-@buffer <= @s <= end + @buffer and chr==@chr & start-@buffer <= @e <= end+@buffer') #gtfの中にstart,endともに張り付いている
-    if len(gtf_sub1) >= 1:
-        gtf_sub1= gtf_sub1.sort_values('len',ascending=False)
-        g_tmp = gtf_sub1['gene'].unique()
-        g_multi="||".join(g_tmp)
-        #g=g_tmp[0]
-        if len(g_tmp) > 1:
-            multi_hit_flg=1
-            g_multi="||".join(g_tmp)
-    else:
-        gtf_sub2=gtf.query('chr==@chr & start-@buffer <= @s <= end+@buffer')
-        gtf_sub3=gtf.query('chr==@chr & start-@buffer <= @e <= end+@buffer')
-        if len(gtf_sub2)>=1: 
-            gtf_sub2= gtf_sub2.sort_values('len',ascending=False)
-            g_tmp = gtf_sub2['gene'].unique()
-            g_multi="||".join(g_tmp)
-            #g=g_tmp[0]
-            if len(g_tmp) > 1:
-                multi_hit_flg=1
-        elif len(gtf_sub3)>=1: 
-            gtf_sub3= gtf_sub3.sort_values('len',ascending=False)
-            g_tmp = gtf_sub3['gene'].unique()
-            g_multi="||".join(g_tmp)
-            #g=g_tmp[0]
-            if len(g_tmp)>1:
-                multi_hit_flg=1
-        else:
-            #g='no_hit'
-            g_multi='intron'
-        
-    return pd.Series(g_multi)
-
 def prep_gtf(gtf):
     gtf['gene_3char'] = gtf['name2'].str[0:3]
     gtf = gtf.rename(columns={"name2": "gene", 'chrom': 'chr','txStart': 'start', 'txEnd': 'end'}).sort_values(['chr', 'start'])
     return gtf
 
-def add_Nth_hit(mmap2_paired_in,X=Nth_hit_buffer):
-    ##print('Nth hitの判定')
-    mmap2_paired = mmap2_paired_in.sort_values(['Qname','Qstart','Qend','mapQ','match_rate'],ascending=[True,True,True,False,False])
-    res=[]
-    for x,rid in tqdm(enumerate(mmap2_paired.Qname.unique())):
-        counter=1 #Nth
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        for n,(_,r) in enumerate(mmap2_paired_sub.iterrows()):
-            if n==0:
-                res.append(1)
-            else:
-                if (mmap2_paired_sub.iloc[n-1]["Qstart"] >= mmap2_paired_sub.iloc[n]['Qstart'] - X):
-                    counter+=0
-                    res.append(counter)
-                elif (mmap2_paired_sub.iloc[n-1]["Qend"] >= mmap2_paired_sub.iloc[n]['Qend'] -X ): 
-                    counter+=0
-                    res.append(counter)
-                else:
-                    counter+=1
-                    res.append(counter)
-    mmap2_paired["Nth_hit"] = res
-    return mmap2_paired
-
 def filter_out_Nth_hit_ov2(df):
     cond = df.groupby("Qname").Nth_hit.max() == 2
     filterd_qid = cond[cond].index
@@ -211,55 +125,14 @@ def cul_fusioncand_v4_4refseq(mmap2_paired):
     col = ["Qname","Qstart","Qend","dir", "Tname", "Tstart", "Tend", "mapQ","match_rate", "mapping_rate","gene"]
     out_col = ["hit_rid", "Qstart1","Qend1","dir1", "chr1", "start1", "end1", "mapQ1", "match_rate1", "mapping_rate1","g1","Qstart2","Qend2","dir2", "chr2",
                "start2", "end2", "mapQ2", "match_rate2", 'mapping_rate2', "g2","gap_len",'gap_rate']
-    arr=[]
-    for rid in tqdm(mmap2_paired.Qname.unique()):
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        if mmap2_paired_sub.Nth_hit.nunique()==2:
-            mmap2_paired_sub_Nth1= mmap2_paired_sub.query('Nth_hit==1')
-            mmap2_paired_sub_Nth2= mmap2_paired_sub.query('Nth_hit==2')
-            for i in range(len(mmap2_paired_sub_Nth1)):
-                for j in range(len(mmap2_paired_sub_Nth2)):
-                    flont_fp = list(mmap2_paired_sub_Nth1.iloc[i][col]) 
-                    rear_fp = list(mmap2_paired_sub_Nth2.iloc[j][col])[1:]
-                    gap_len =  mmap2_paired_sub_Nth2.iloc[j]['Qstart']- mmap2_paired_sub_Nth1.iloc[i]['Qend']
-                    gap_rate =  gap_len / mmap2_paired_sub_Nth1.iloc[i]['Qlen']
-                    res = flont_fp + rear_fp + [gap_len] + [gap_rate] 
-                    arr.append(res)
-                    
-        else:
-            pass
-    df_fusioncand=pd.DataFrame(arr)
-    df_fusioncand.columns=out_col
-    df_fusioncand = df_fusioncand.drop_duplicates()
-    return df_fusioncand
+    return pair_fusioncand(mmap2_paired, col, out_col)
 
 def cul_fusioncand_v4_quick(mmap2_paired):
     ##print('---------------fusion calculation----------------')
     col = ["Qname","Qstart","Qend","dir", "Tname", "Tstart", "Tend", "mapQ","match_rate", "mapping_rate"]
     out_col = ["hit_rid", "Qstart1","Qend1","dir1", "chr1", "start1", "end1", "mapQ1", "match_rate1", "mapping_rate1","Qstart2","Qend2","dir2", "chr2",
                "start2", "end2", "mapQ2", "match_rate2", 'mapping_rate2', "gap_len",'gap_rate']
-    arr=[]
-    for rid in tqdm(mmap2_paired.Qname.unique()):
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        if mmap2_paired_sub.Nth_hit.nunique()==2:
-            mmap2_paired_sub_Nth1= mmap2_paired_sub.query('Nth_hit==1')
-            mmap2_paired_sub_Nth2= mmap2_paired_sub.query('Nth_hit==2')
-            for i in range(len(mmap2_paired_sub_Nth1)):
-                for j in range(len(mmap2_paired_sub_Nth2)):
-                    flont_fp = list(mmap2_paired_sub_Nth1.iloc[i][col]) 
-                    rear_fp = list(mmap2_paired_sub_Nth2.iloc[j][col])[1:]
-                    gap_len =  mmap2_paired_sub_Nth2.iloc[j]['Qstart']- mmap2_paired_sub_Nth1.iloc[i]['Qend']
-                    gap_rate =  gap_len / mmap2_paired_sub_Nth1.iloc[i]['Qlen']
-                    res = flont_fp + rear_fp + [gap_len] + [gap_rate] 
-                    arr.append(res)
-                    
-        else:
-            pass
-
-        df_fusioncand=pd.DataFrame(arr)
-        df_fusioncand.columns=out_col
-        df_fusioncand = df_fusioncand.drop_duplicates()
-    return df_fusioncand
+    return pair_fusioncand(mmap2_paired, col, out_col)
 
 
 def prep_paf_edge_4gaponly(path):
@@ -276,24 +149,10 @@ def prep_paf_edge_4gaponly(path):
         return df
 
 def prep_subseq_read_gaponly(df_in):
-    res_df=pd.DataFrame()
-    ##print('----start prep_subseq_read gap only -------')
     df = df_in[['Qname','Qlen' ,'Qstart', 'Qend','Nth_hit']].drop_duplicates()
     out_col=['Qname', 'Qstart', 'Qend']
-    for rid in tqdm(df.Qname.unique()):
-        df_sub = df.query('Qname in @rid')
-        Nths = df_sub.Nth_hit.nunique()
-        if Nths==2: 
-            df_sub1=df_sub.query('Nth_hit == 1')
-            df_sub2=df_sub.query('Nth_hit == 2')
-            N=0
-            for (_,r1) in df_sub1.iterrows():
-                for (_,r2) in df_sub2.iterrows():
-                    res = pd.Series([rid, int(r1['Qend']),int(r2['Qstart'])],index=out_col)
-                    res_df = res_df.append(res,ignore_index=True)
-                    N=N+1
-
-    res_df = res_df.astype({'Qend':int,'Qstart':int}).sort_values(['Qname','Qstart','Qend'])[out_col].drop_duplicates(subset=['Qname','Qstart','Qend'])
+    res_df = pair_gap(df,'Qstart','Qend')
+    res_df = res_df.sort_values(['Qname','Qstart','Qend'])[out_col].drop_duplicates(subset=['Qname','Qstart','Qend'])
     assert res_df.Qname.nunique()==df.Qname.nunique()
     return res_df
 
@@ -328,28 +187,6 @@ def drop_different_genepair_reseq(g1,g2,g1_r,g2_r):
     return res
 
 
-def add_g1_g2_clst_col_v3(df_fusioncand_clst_tmp,clst_col,g1_col,g2_col,out_g1_col,out_g2_col,out_g1_pct_col,out_g2_pct_col,criteria):
-   res_df=pd.DataFrame()
-   for clst in df_fusioncand_clst_tmp[clst_col].unique():
-      df_fusioncand_clust_sub= df_fusioncand_clst_tmp[df_fusioncand_clst_tmp[clst_col]==clst]
-      ratio1 = df_fusioncand_clust_sub[g1_col].value_counts(normalize=True)
-      ratio2 = df_fusioncand_clust_sub[g2_col].value_counts(normalize=True)
-      cond1 = ratio1 >= criteria
-      cond2 = ratio2 >= criteria
-      g1_multi_clst="_".join(list((cond1.index[cond1])))
-      g2_multi_clst="_".join(list((cond2.index[cond2])))
-      g1_multi_clst_pct="_".join(list((ratio1[cond1].round(2)*100).astype(int).astype(str) + '%'))
-      g2_multi_clst_pct="_".join(list((ratio2[cond2].round(2)*100).astype(int).astype(str) + '%'))
-      #g1_multi_clst_pct=ratio1[cond1][0].round(2)
-      #g2_multi_clst_pct=ratio2[cond2][0].round(2)
-      
-      df_fusioncand_clust_sub[out_g1_col]=g1_multi_clst
-      df_fusioncand_clust_sub[out_g2_col]=g2_multi_clst
-      df_fusioncand_clust_sub[out_g1_pct_col]=g1_multi_clst_pct
-      df_fusioncand_clust_sub[out_g2_pct_col]=g2_multi_clst_pct
-      res_df = res_df.append(df_fusioncand_clust_sub)
-   return res_df
-
 def filter_out_Nth_hit(df,N):
     cond = df.groupby("Qname").Nth_hit.max() == N
     filterd_qid = cond[cond].index
@@ -357,48 +194,40 @@ def filter_out_Nth_hit(df,N):
     return df_out
 
 
-def filter_refseq_paf(local_file_path_refseq,gtf_path,N=1):
-    gtf = pd.read_csv(gtf_path, usecols=[0,5],names=['Tname','gene'],header=0,index_col=False)
-    paf_col = ["Qname", "Qlen", "Qstart", "Qend", "dir", "Tname","Tlen", "Tstart", "Tend", "match", "block", "mapQ"]
-    mmap2_refseq = pd.read_table(local_file_path_refseq, index_col=False, header=None,names=paf_col, usecols=range(0, 12)).drop('Tlen', axis=1)
-    mmap2_refseq['Tname'] = mmap2_refseq['Tname'].str.split("_").str[2]
-    mmap2_refseq = pd.merge(mmap2_refseq, gtf,how='left')
-    
-    #1gene
-    cond1=mmap2_refseq.groupby('Qname')['gene'].nunique()!=N
-    filterd_qid1=cond1[cond1].index
-    mmap2_refseq_cand1=mmap2_refseq.query('Qname in @filterd_qid1')
-    
-    #start-end
-    cond2 = (mmap2_refseq_cand1.groupby('Qname')['Qstart'].nunique() != 1) & (mmap2_refseq_cand1.groupby('Qname')['Qend'].nunique() != 1)
-    filterd_qid2=cond2[cond2].index
-    mmap2_refseq_cand2=mmap2_refseq_cand1.query('Qname in @filterd_qid2')
+def filter_refseq_paf(local_file_path_refseq,gtf_path,N=1,part=0,n_part=1):
+    tx2gene = load_tx2gene(gtf_path)
+
+    def filter_refseq_chunk(mmap2_refseq):
+        mmap2_refseq['Tname'] = split_tname(mmap2_refseq['Tname'], "_", 2)
+        mmap2_refseq = pd.merge(mmap2_refseq, tx2gene,how='left')
+        #1gene
+        mmap2_refseq_cand1 = mmap2_refseq[mmap2_refseq.groupby('Qname',observed=True)['gene_code'].transform('nunique')!=N].drop(columns='gene_code')
+        #startとendが一致しているものは落とす
+        return filter_qstart_qend_not_unique(mmap2_refseq_cand1)
+
+    # PAFはchunkごとに読み、readごとのフィルタを通った行だけを残す (n_part>1 なら part 番目のパーティションのreadだけ)
+    mmap2_refseq_cand2 = read_paf_filtered(local_file_path_refseq, partition_filter(filter_refseq_chunk, part, n_part))
     mmap2_refseq_cand2['match_rate'] = (mmap2_refseq_cand2['match']) / (mmap2_refseq_cand2['Qend']-mmap2_refseq_cand2['Qstart']+1)
     mmap2_refseq_cand2['mapping_rate'] = (mmap2_refseq_cand2['Qend']-mmap2_refseq_cand2['Qstart']+1)/mmap2_refseq_cand2['Qlen']
-    cond2 = (mmap2_refseq_cand2.groupby('Qname')['Qstart'].nunique() != 1) & (mmap2_refseq_cand2.groupby('Qname')['Qend'].nunique() != 1)
-    filterd_qid2=cond2[cond2].index
-    mmap2_refseq_cand2=mmap2_refseq_cand2.query('Qname in @filterd_qid2').sort_values('Qname')
+    mmap2_refseq_cand2=mmap2_refseq_cand2.sort_values('Qname',kind='stable') #read内はPAFの行順
     multi_gene_id=mmap2_refseq_cand2.Qname.unique()
     
-    return multi_gene_id,mmap2_refseq, mmap2_refseq_cand2
+    return multi_gene_id, mmap2_refseq_cand2
 
-def prep_paf_file_v3(paffile_path, filterd_qid, Nth_hit_flg=1):
-    paf_col = ["Qname", "Qlen", "Qstart", "Qend", "dir", "Tname","Tlen", "Tstart", "Tend", "match", "block", "mapQ"]
-    mmap2 = pd.read_table(paffile_path, index_col=False, header=None,names=paf_col, usecols=range(0, 12)).drop('Tlen', axis=1)
-    if len(filterd_qid)!=0: 
-        mmap2_cand1=mmap2.query('Qname in @filterd_qid')
-    else:
-        mmap2_cand1=mmap2.copy()
-    cond3 = (mmap2_cand1.groupby('Qname')['Qstart'].nunique() != 1) & (mmap2_cand1.groupby('Qname')['Qend'].nunique() != 1)
-    filterd_qid3 = cond3[cond3].index
-    mmap2_cand2 = mmap2_cand1.query('Qname in @filterd_qid3')
+def prep_paf_file_v3(paffile_path, filterd_qid, Nth_hit_flg=1, part=0, n_part=1):
+    def filter_genome_chunk(mmap2):
+        if len(filterd_qid)!=0: 
+            mmap2=mmap2[mmap2['Qname'].isin(filterd_qid)]
+        return filter_qstart_qend_not_unique(mmap2)
+
+    # PAFはchunkごとに読み、refseqで候補になったreadかつQstart,Qendが1種類ではないreadの行だけを残す
+    mmap2_cand2 = read_paf_filtered(paffile_path, partition_filter(filter_genome_chunk, part, n_part))
     mmap2_cand2['Qhit']=mmap2_cand2['Qend']-mmap2_cand2['Qstart']+1
     mmap2_cand2['match_rate'] = (mmap2_cand2['match']) / (mmap2_cand2['Qend']-mmap2_cand2['Qstart']+1)
     mmap2_cand2['mapping_rate'] = (mmap2_cand2['Qend']-mmap2_cand2['Qstart']+1)/mmap2_cand2['Qlen']
     if Nth_hit_flg==1:
-        mmap2['Tname'] = mmap2['Tname'].str.split("_").str[2]
-        mmap2_cand2 = add_Nth_hit(mmap2_cand2)
-    return mmap2,mmap2_cand2
+        mmap2_cand2 = add_Nth_hit(mmap2_cand2,Nth_hit_buffer)
+    return mmap2_cand2
 
 def flging_gap_use_read(df):
     Qnames=df.query('gene==gene_gap').Qname.unique()
@@ -418,28 +247,7 @@ def cul_fusioncand_v4(mmap2_paired):
     #          "start2", "end2", "mapQ2", "match_rate2", 'mapping_rate2', "gap_len",'gap_rate']
     out_col = ["hit_rid", "Qstart1","Qend1","dir1", "chr1", "start1", "end1", "mapQ1","gene1","Qstart2","Qend2","dir2", "chr2",
                "start2", "end2", "mapQ2", "gene2","gap_len",'gap_rate']
-    arr=[]
-    for rid in tqdm(mmap2_paired.Qname.unique()):
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        if mmap2_paired_sub.Nth_hit.nunique()==2:
-            mmap2_paired_sub_Nth1= mmap2_paired_sub.query('Nth_hit==1')
-            mmap2_paired_sub_Nth2= mmap2_paired_sub.query('Nth_hit==2')
-            for i in range(len(mmap2_paired_sub_Nth1)):
-                for j in range(len(mmap2_paired_sub_Nth2)):
-                    flont_fp = list(mmap2_paired_sub_Nth1.iloc[i][col]) 
-                    rear_fp = list(mmap2_paired_sub_Nth2.iloc[j][col])[1:]
-                    gap_len =  mmap2_paired_sub_Nth2.iloc[j]['Qstart']- mmap2_paired_sub_Nth1.iloc[i]['Qend']
-                    gap_rate =  gap_len / mmap2_paired_sub_Nth1.iloc[i]['Qlen']
-                    res = flont_fp + rear_fp + [gap_len] + [gap_rate] 
-                    arr.append(res)
-                    
-        else:
-            pass
-
-        df_fusioncand=pd.DataFrame(arr)
-        df_fusioncand.columns=out_col
-        df_fusioncand = df_fusioncand.drop_duplicates()
-    return df_fusioncand
+    return pair_fusioncand(mmap2_paired, col, out_col)
 
 def change_order_g1g2_v3(df_fusioncand_in,type):
     df_fusioncand = df_fusioncand_in.copy()
@@ -467,20 +275,8 @@ def get_major_clst(clst1,count1,clst2,count2):
         return clst2
 
 def make_descendants_table(df,df_count):
-    import networkx as nx
-    x=df
-    G = nx.DiGraph()
-    G.add_weighted_edges_from([tuple(x) for x in x.values])
-    nx.info(G)
-    df_descendants=pd.DataFrame(columns=['clst_1st','clst_final'])
-    for node in G.nodes():
-        descendant=nx.descendants(G, node)
-        if len(descendant)==0:
-            descendant_=node
-        else:
-            descendant_=(list(descendant)[0])
-        var_ser=pd.Series([node,descendant_],index=df_descendants.columns)
-        df_descendants=df_descendants.append( var_ser, ignore_index=True )
+    # clst_1st -> clst_final を最後までたどった major クラスタを clst_final にする (1回で収束するので繰り返さない)
+    df_descendants=pd.DataFrame({'clst_1st':df.iloc[:,0].to_numpy(),'clst_final':resolve_clst_final(df.iloc[:,0],df.iloc[:,1])})
     df_descendants=df_descendants.query('clst_1st!=clst_final')
     df_descendants=pd.merge(df_descendants,df_count.drop_duplicates(),on='clst_1st',how='left')
     return df_descendants
@@ -501,47 +297,16 @@ def re_clst_miner2major_v3(df_in,clst_col,clst_count_col,g1_r,g2_r,dont_reclust_
         
     
     df_clst_count_in=df_clst_count[[clst_col,clst_count_col]].drop_duplicates()
-    df_clst_f2_upd = make_descendants_table(df_clst_f2,df_clst_count_in)
-    df_clst_f2_upd2 = make_descendants_table(df_clst_f2_upd,df_clst_count_in)
-    df_clst_f2_upd3 = make_descendants_table(df_clst_f2_upd2,df_clst_count_in)
-    assert df_clst_f2_upd3.equals(df_clst_f2_upd2)
+    df_clst_f2_upd3 = make_descendants_table(df_clst_f2,df_clst_count_in)
      
     df_out = pd.merge(df,df_clst_f2_upd3,on=[clst_col,clst_count_col],how='left')
     df_out.loc[df_out.clst_final.isna(),'clst_final']=df_out[clst_col]
     return df_out
 
-def get_cytoband_start_end(cytoband,chr,s,e,buffer=15):
-    cytoband['len']=cytoband['end']-cytoband['start']
-    cytoband_col="chr_pq"
-    multi_hit_flg=0
-    gtf_sub1=cytoband.query('chr==@chr & start-@buffer <= @s <= end + @buffer and chr==@chr & start-@buffer <= @e <= end+@buffer') #gtfの中にstart,endともに張り付いている
-    if len(gtf_sub1) >= 1:
-        gtf_sub1= gtf_sub1.sort_values('len',ascending=False)
-        g_tmp = gtf_sub1[cytoband_col].unique()
-        g_multi="||".join(g_tmp)
-        #g=g_tmp[0]
-        if len(g_tmp) > 1:
-            multi_hit_flg=1
-            g_multi="||".join(g_tmp)
-    else:
-        cytoband2=cytoband.query('chr==@chr & start-@buffer <= @s <= end+@buffer')
-        cytoband3=cytoband.query('chr==@chr & start-@buffer <= @e <= end+@buffer')
-        if len(cytoband2)>=1: 
-            cytoband2= cytoband2.sort_values('len',ascending=False)
-            g_tmp = cytoband2[cytoband_col].unique()
-            g_multi="||".join(g_tmp)
-            #g=g_tmp[0]
-            if len(g_tmp) > 1:
-                multi_hit_flg=1
-        elif len(cytoband3)>=1: 
-            cytoband3= cytoband3.sort_values('len',ascending=False)
-            g_tmp = cytoband3[cytoband_col].unique()
-            g_multi="||".join(g_tmp)
-            #g=g_tmp[0]
-            if len(g_tmp)>1:
-                multi_hit_flg=1
-        
-    return pd.Series(g_multi)
+def get_cytoband_start_end_v2(cytoband_index,chrs,s,e,buffer=15):
+    # get_cytoband_start_end を全行まとめて計算する (cytoband_index = load_bed_index(cytoband_path, 'chr_pq'))
+    # 優先順位は遺伝子と同じ。どのbandにも当たらない行は NaN
+    return annotate_intervals(cytoband_index, chrs, s, e, buffer, no_hit=np.nan)
 
 def add_TF_columns_genename_v2(true_gA,true_gB, g1, g2):
     res=0;index=9999
@@ -555,16 +320,6 @@ def add_TF_columns_genename_v2(true_gA,true_gB, g1, g2):
                     index=row_g1
     return pd.Series([res,index])
 
-def add_clst_count_v2(df,clst_col,col_name,support_flg=1):
-    df_clst_count = df[clst_col].value_counts().to_frame().reset_index().rename(columns={clst_col: "clst_count", 'index': clst_col})
-    df_out=pd.merge(df,df_clst_count,on=clst_col)
-    if support_flg==1:
-        df_out["support_read"]=df_out.apply(lambda x:int(x["clst_count"])*float(x['g1_clst_pct'].split("_")[0].replace("%",""))*float(x['g2_clst_pct'].split("_")[0].replace("%",""))*0.01*0.01,axis=1)
-    else:
-        pass
-    assert df[clst_col].nunique()==df_out[clst_col].nunique()
-    return df_out
-
 def make_breakpoint_divX(X,by=10000):
     bp=X
     chr1=bp.split("___")[0].split("__")[0]
@@ -580,7 +335,8 @@ def prep_blat_edge_4gaponly(path,topscore=1):
     df=pd.read_table(path,names=["Qname","Tname","identity","alignment_length","mismatches","gap_openings","Qstart","Qend","Tstart","Tend","evalue","bitscore"])
     if topscore==1:
         df=df.sort_values(['Qname','evalue','bitscore'],ascending=[True,True,False])
-        df=(df.groupby(['Qname'],as_index=False).apply(select,col='evalue',kind='min'))
+        # read ごとに evalue 最小の行 (select(col='evalue',kind='min') と同じ、pandas 3 の groupby.apply は Qname 列を渡さない)
+        df=df[df['evalue']==df.groupby('Qname')['evalue'].transform('min')].drop_duplicates()
 
     else:
         pass
@@ -603,23 +359,8 @@ def select(df, **kwargs):
     return val_r
 
 def add_exon_s_e(df,gtf_exon_path):
-    df=df.assign(gene2=df['gene'].str.split("\|\|")).explode('gene2')
-    df_exon=pd.read_csv(gtf_exon_path)
-    df_merged=pd.merge(df,df_exon[['gene','exstart','exend']],left_on='gene2',right_on="gene")
-    df_merged['diff_s']=abs(df_merged['Tstart']-df_merged['exstart'])
-    df_merged['diff_e']=abs(df_merged['exend']-df_merged['Tend'])
-
-    tmp1=df_merged.groupby(['Qname','Nth_hit'],as_index=False).diff_s.min()
-    tmp2=df_merged.groupby(['Qname','Nth_hit'],as_index=False).diff_e.min()
-    df_merged_t=pd.merge(df_merged,tmp1,how='inner')
-    df_start=df_merged_t[['Qname','Nth_hit','exstart','diff_s']].drop_duplicates()
-    df_merged_t=pd.merge(df_merged,tmp2,how='inner')
-    df_end=df_merged_t[['Qname','Nth_hit','exend','diff_e']].drop_duplicates()
-    df_s_e=pd.merge(df_start,df_end)
-    df_out=pd.merge(df,df_s_e).sort_values(['Qname','Nth_hit'])
-    df_out['diff_s']=df_out['Tstart']-df_out['exstart']
-    df_out['diff_e']=df_out['exend']-df_out['Tend']
-    return df_out
+    # Tstart,Tend に一番近いエキソンの端 (exstart,exend) と diff_s,diff_e を付ける。エキソンの表は1回だけ読んで遺伝子ごとにソートしておく
+    return snap_exon_boundary(df, load_exon_index(gtf_exon_path))
 
 def fix_start_end(df_in):
     df=df_in.copy()
@@ -641,104 +382,9 @@ def fix_start_end(df_in):
     return df
             
 def prep_subseq_read_gaponly_v2(df_in):
-    res_df=pd.DataFrame()
-    ##print('----start prep_subseq_read gap only -------')
-    df = df_in[['Qname','Qlen' ,'Qstart_fix', 'Qend_fix','Nth_hit']].drop_duplicates()
-    out_col=['Qname', 'Qstart', 'Qend']
-    for rid in tqdm(df.Qname.unique()):
-        df_sub = df.query('Qname in @rid')
-        Nths = df_sub.Nth_hit.nunique()
-        if Nths==2: 
-            df_sub1=df_sub.query('Nth_hit == 1')
-            df_sub2=df_sub.query('Nth_hit == 2')
-            N=0
-            for (_,r1) in df_sub1.iterrows():
-                for (_,r2) in df_sub2.iterrows():
-                    res = pd.Series([rid, int(r1["Qend_fix"]),int(r2["Qstart_fix"])],index=out_col)
-                    res=pd.DataFrame(res).T
-                    res_df = pd.concat([res_df, res], ignore_index=True, axis=0)
-                    
-                    N=N+1
-    return res_df
-
-
-def judge_cross_over_v3(mmap2_paired,buffer,s,e):
-
-    rids=[]
-    if mmap2_paired['Nth_hit'].value_counts()[1] != mmap2_paired['Nth_hit'].value_counts()[2]:
-        drop_rid_nopaired = pd.DataFrame(mmap2_paired.groupby('Qname')['Nth_hit'].nunique() == 1).query('Nth_hit==True').index
-        mmap2_paired = mmap2_paired.query('Qname not in @drop_rid_nopaired')
-    for x,rid in enumerate(tqdm(mmap2_paired.Qname.unique())): #read_idごと
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        N=mmap2_paired_sub.Nth_hit.min()
-        first_end_pos = int(mmap2_paired_sub.query('Nth_hit==@N')[e].max())
-        try:
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit==@N+1')[s].min())
-        except:
-            assert mmap2_paired_sub['Nth_hit'].nunique()==2 ,'Nth_hitが3以上です'
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit!=@N')[s].min())
-        if first_end_pos - buffer > second_start_pos:
-            rids.append(rid)
-    return rids
-
-def add_exon_s_e(df,gtf_exon_path):
-    df=df.assign(gene2=df['gene'].str.split("\|\|")).explode('gene2')
-    df_exon=pd.read_csv(gtf_exon_path)
-    df_merged=pd.merge(df,df_exon[['gene','exstart','exend']],left_on='gene2',right_on="gene")
-    df_merged['diff_s']=abs(df_merged['Tstart']-df_merged['exstart'])
-    df_merged['diff_e']=abs(df_merged['exend']-df_merged['Tend'])
-
-    tmp1=df_merged.groupby(['Qname','Nth_hit'],as_index=False).diff_s.min()
-    tmp2=df_merged.groupby(['Qname','Nth_hit'],as_index=False).diff_e.min()
-    df_merged_t=pd.merge(df_merged,tmp1,how='inner')
-    df_start=df_merged_t[['Qname','Nth_hit','exstart','diff_s']].drop_duplicates()
-    df_merged_t=pd.merge(df_merged,tmp2,how='inner')
-    df_end=df_merged_t[['Qname','Nth_hit','exend','diff_e']].drop_duplicates()
-    df_s_e=pd.merge(df_start,df_end)
-    df_out=pd.merge(df,df_s_e).sort_values(['Qname','Nth_hit'])
-    df_out['diff_s']=df_out['Tstart']-df_out['exstart']
-    df_out['diff_e']=df_out['exend']-df_out['Tend']
-    return df_out
-
-def fix_start_end(df_in):
-    df=df_in.copy()
-    df[['Qstart_fix','Qend_fix','Tstart_fix','Tend_fix']]=df[['Qstart','Qend','Tstart','Tend']].copy()
-    #Nth1 dir +
-    df.loc[(df['Nth_hit']==1) & (df['dir']=="+"),"Tend_fix"]=df['exend']
-    df.loc[(df['Nth_hit']==1) & (df['dir']=="+"),'Qend_fix']=df['Qend']+df['diff_e']
-    #Nth1 dir -
-    df.loc[(df['Nth_hit']==1) & (df['dir']=="-"),"Tstart_fix"]=df['exstart']
-    df.loc[(df['Nth_hit']==1) & (df['dir']=="-"),'Qend_fix']=df['Qend']+df['diff_s']
-    #df.loc[(df['Nth_hit']==1) & (df['dir']=="-")]
-
-    #Nth2 dir +
-    df.loc[(df['Nth_hit']==2) & (df['dir']=="+"),"Tstart_fix"]=df['exstart']
-    df.loc[(df['Nth_hit']==2) & (df['dir']=="+"),'Qstart_fix']=df['Qstart']-df['diff_s']
-    #Nth1 dir -
-    df.loc[(df['Nth_hit']==2) & (df['dir']=="-"),"Tend_fix"]=df['exend']
-    df.loc[(df['Nth_hit']==2) & (df['dir']=="-"),'Qstart_fix']=df['Qstart']-df['diff_e']
-    return df
-            
+    # Nth_hit==1 の Qend_fix から Nth_hit==2 の Qstart_fix までを gap とする (全ペア)
+    return pair_gap(df_in,'Qstart_fix','Qend_fix')
 
-def judge_cross_over_v3(mmap2_paired,buffer,s,e):
-
-    rids=[]
-    if mmap2_paired['Nth_hit'].value_counts()[1] != mmap2_paired['Nth_hit'].value_counts()[2]:
-        drop_rid_nopaired = pd.DataFrame(mmap2_paired.groupby('Qname')['Nth_hit'].nunique() == 1).query('Nth_hit==True').index
-        mmap2_paired = mmap2_paired.query('Qname not in @drop_rid_nopaired')
-    for x,rid in enumerate(tqdm(mmap2_paired.Qname.unique())):
-        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
-        N=mmap2_paired_sub.Nth_hit.min()
-        first_end_pos = int(mmap2_paired_sub.query('Nth_hit==@N')[e].max())
-        try:
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit==@N+1')[s].min())
-        except:
-            assert mmap2_paired_sub['Nth_hit'].nunique()==2 ,'Nth_hitが3以上です'
-            second_start_pos = int(mmap2_paired_sub.query('Nth_hit!=@N')[s].min())
-        if first_end_pos - buffer > second_start_pos:
-            rids.append(rid)
-    return rids
-    
 def split_bp(bp):
     chr1=bp.split("___")[0].split("__")[0]
     pos1=int(bp.split("___")[0].split("__")[1])
@@ -759,21 +405,8 @@ def make_bp_clst_mode(df):
     return df
 
 def cul_gaplen(df_in,Qstart,Qend):
-    df = df_in[['Qname','Qlen' ,Qstart, Qend,'Nth_hit']].drop_duplicates()
-    res_df=pd.DataFrame()
-    for rid in tqdm(df.Qname.unique()):
-        df_sub = df.query('Qname in @rid')
-        Nths = df_sub.Nth_hit.nunique()
-        if Nths==2: 
-            df_sub1=df_sub.query('Nth_hit == 1')
-            df_sub2=df_sub.query('Nth_hit == 2')
-            N=0
-            for (_,r1) in df_sub1.iterrows():
-                for (_,r2) in df_sub2.iterrows():
-                    res = pd.Series([rid, int(r2[Qstart])-int(r1[Qend])],index=['rid','gaplen'])
-                    res_df = res_df.append(res,ignore_index=True)
-                    N=N+1
-    return res_df
+    res_df = pair_gap(df_in,Qstart,Qend)
+    return pd.DataFrame({'rid':res_df['Qname'],'gaplen':res_df['Qend']-res_df['Qstart']})
 
 def bp_update_v3(df_in):
     df=df_in.copy()
@@ -825,90 +458,116 @@ def bp_update_v4(df_in):
     return df
 
 
-
-
-
-# remote_file_dir = Path("/raidc/keigo.masuda/analysis/minimap2/MCF7/FLBEA/")
-#input
-paf_dir = os.path.join(root, "FUGAREC")
-paffile_name = f"{TARGET}_hg38.paf"
-paffile_name_refseq=f"{TARGET}_refseq.paf"
-paffile_path = os.path.join(paf_dir, paffile_name)
-paffile_refseq_path = os.path.join(paf_dir, paffile_name_refseq)
-
-#outdir
-res_file_dir = paf_dir
-intermediate_file_dir = os.path.join(res_file_dir, "intermediate")
-res_genome_dir = os.path.join(res_file_dir, "genome")
-res_genome_path = os.path.join(res_genome_dir, f"{TARGET}_df_fusioncand_genome.csv")
-res_refseq_path = os.path.join(res_genome_dir, f"{TARGET}_df_fusioncand_refseq.csv")
-res_4_edge_alignment_dir = os.path.join(res_file_dir, "for_edge_alignment")
-for_make_edge_file_path = os.path.join(res_4_edge_alignment_dir, f"{TARGET}", "gap_4make_edge.csv")
-
-#gtf
-gtf_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.usecol")
-gtf_exon_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.exon")
-
-mmap2_align2genome_path = os.path.join(intermediate_file_dir, f"{TARGET}_genome.csv")
-
-### saving
-if not os.path.exists(res_file_dir):
-    os.makedirs(res_file_dir)
-if not os.path.exists(intermediate_file_dir):
-    os.makedirs(intermediate_file_dir)
-if not os.path.exists(res_genome_dir):
-    os.makedirs(res_genome_dir)
-if not os.path.exists(res_4_edge_alignment_dir):
-    os.makedirs(res_4_edge_alignment_dir)
-    if not os.path.exists(os.path.join(res_4_edge_alignment_dir, TARGET)):
-        os.makedirs(os.path.join(res_4_edge_alignment_dir, TARGET))
-
-
-#gtfファイル読み込み
-gtf = prep_gtf(pd.read_csv(gtf_path))
-
-#refseqの処理-----------------------------------------------------------
-#refseqに1geneにしか当たらないリードは除外
-multihit_id,mmap2_refseq_org, mmap2_refseq = filter_refseq_paf(paffile_refseq_path, gtf_path)  
-
-#genomeの処理-----------------------------------------------------------
-mmap2_org,mmap2 = prep_paf_file_v3(paffile_path, multihit_id, 1)
-
-#Nth=2を採用
-mmap2_Nth2 = filter_out_Nth_hit_ov2(mmap2)
-
-
-# ### クエリ側のクロスオーバーの判定とクロスオーバーの除去
-cross_over_rids = judge_cross_over_v3(mmap2_Nth2,15,'Qstart','Qend')
-mmap2_Nth2_rmcross = mmap2_Nth2.query('Qname not in @cross_over_rids')
-
-#遺伝子を判定 
-mmap2_Nth2_rmcross['gene']=mmap2_Nth2_rmcross.apply(lambda x: get_gene_name_start_end(gtf, x['Tname'],x['Tstart'],x['Tend']), axis=1)
-drop_rid=mmap2_Nth2_rmcross[mmap2_Nth2_rmcross.gene=="intron"].Qname
-mmap2_Nth2_rmcross=mmap2_Nth2_rmcross.query('Qname not in @drop_rid')
-
-# 重複削除 Qname,Nth_hit,geneがユニークになる様に　クエリ側が多くヒットした配列を優先
-mmap2_Nth2_rmcross_rmdup=mmap2_Nth2_rmcross.sort_values(['Qname','Nth_hit','Qhit'],ascending=[True,True,False]).drop_duplicates(subset=['Qname','Nth_hit'])
-
-#エキソンの端の調整
-mmap2_Nth2_rmcross_rmdup_addex=add_exon_s_e(mmap2_Nth2_rmcross_rmdup,gtf_exon_path)
-mmap2_Nth2_rmcross_rmdup_addex=fix_start_end(mmap2_Nth2_rmcross_rmdup_addex)
-mmap2_Nth2_rmcross_rmdup_addex=mmap2_Nth2_rmcross_rmdup_addex.drop(['gene2'],axis=1).drop_duplicates()
-
-# ### クエリ側のクロスオーバーの判定とクロスオーバーの除去
-cross_over_rids = judge_cross_over_v3(mmap2_Nth2_rmcross_rmdup_addex,15,'Qstart_fix','Qend_fix')
-mmap2_Nth2_rmcross_rmdup_addex_rmcross=mmap2_Nth2_rmcross_rmdup_addex.query('Qname not in @cross_over_rids')
-
-
-edge_start_end=prep_subseq_read_gaponly_v2(mmap2_Nth2_rmcross_rmdup_addex_rmcross.drop_duplicates(subset=['Qname','Qstart_fix','Qend_fix']))
-edge_start_end['length']=edge_start_end['Qend']-edge_start_end['Qstart']+1
-edge_start_end_ov=edge_start_end.query('length>@realign_gap_len_criteria').sort_values('length',ascending=False).drop_duplicates(subset='Qname')
-
-#fileの書き出し------------------------------------------------------------
-mmap2_Nth2_rmcross_rmdup_addex_rmcross.to_csv(mmap2_align2genome_path, index=False)
-edge_start_end_ov=edge_start_end_ov.query('Qstart>=0')
-edge_start_end_ov=pd.merge(edge_start_end_ov,mmap2_Nth2_rmcross_rmdup_addex_rmcross[['Qname','Qlen']]).query('length<Qlen').drop('Qlen',axis=1).drop_duplicates()
-edge_start_end_ov['Qstart']=edge_start_end_ov.Qstart.astype(int)
-edge_start_end_ov['Qend']=edge_start_end_ov.Qend.astype(int)
-edge_start_end_ov.to_csv(for_make_edge_file_path, index=False)
-
+def prep_gap_realignment(paffile_path, multihit_id, gene_index, gtf_exon_path, part=0, n_part=1):
+    # genomeのPAFから multihit_id のreadについて2ヒットのペアを作り、エキソン端で補正したヒットとgapの表を返す
+    # 戻り値は intermediate/{TARGET}_genome.csv と gap_4make_edge.csv に書き出す DataFrame
+    # n_part>1 なら Qname のハッシュが part 番目のreadだけを処理する (readごとに独立なので、全パーティションの結果をQname順につなげると全体の結果と同じ)
+    #genomeの処理-----------------------------------------------------------
+    mmap2 = prep_paf_file_v3(paffile_path, multihit_id, 1, part, n_part)
+
+    #Nth=2を採用
+    mmap2_Nth2 = filter_out_Nth_hit_ov2(mmap2)
+
+
+    # ### クエリ側のクロスオーバーの判定とクロスオーバーの除去
+    cross_over_rids = judge_cross_over_v3(mmap2_Nth2,15,'Qstart','Qend')
+    mmap2_Nth2_rmcross = mmap2_Nth2.query('Qname not in @cross_over_rids')
+
+    #遺伝子を判定 
+    mmap2_Nth2_rmcross['gene']=annotate_intervals(gene_index, mmap2_Nth2_rmcross['Tname'],mmap2_Nth2_rmcross['Tstart'],mmap2_Nth2_rmcross['Tend'])
+    drop_rid=mmap2_Nth2_rmcross[mmap2_Nth2_rmcross.gene=="intron"].Qname
+    mmap2_Nth2_rmcross=mmap2_Nth2_rmcross.query('Qname not in @drop_rid')
+
+    # 重複削除 Qname,Nth_hit,geneがユニークになる様に　クエリ側が多くヒットした配列を優先
+    mmap2_Nth2_rmcross_rmdup=mmap2_Nth2_rmcross.sort_values(['Qname','Nth_hit','Qhit'],ascending=[True,True,False]).drop_duplicates(subset=['Qname','Nth_hit'])
+
+    #エキソンの端の調整
+    mmap2_Nth2_rmcross_rmdup_addex=add_exon_s_e(mmap2_Nth2_rmcross_rmdup,gtf_exon_path)
+    mmap2_Nth2_rmcross_rmdup_addex=fix_start_end(mmap2_Nth2_rmcross_rmdup_addex)
+    mmap2_Nth2_rmcross_rmdup_addex=mmap2_Nth2_rmcross_rmdup_addex.drop(['gene2'],axis=1).drop_duplicates()
+
+    # ### クエリ側のクロスオーバーの判定とクロスオーバーの除去
+    cross_over_rids = judge_cross_over_v3(mmap2_Nth2_rmcross_rmdup_addex,15,'Qstart_fix','Qend_fix')
+    mmap2_Nth2_rmcross_rmdup_addex_rmcross=mmap2_Nth2_rmcross_rmdup_addex.query('Qname not in @cross_over_rids')
+
+
+    edge_start_end=prep_subseq_read_gaponly_v2(mmap2_Nth2_rmcross_rmdup_addex_rmcross.drop_duplicates(subset=['Qname','Qstart_fix','Qend_fix']))
+    edge_start_end['length']=edge_start_end['Qend']-edge_start_end['Qstart']+1
+    edge_start_end_ov=edge_start_end.query('length>@realign_gap_len_criteria').sort_values('length',ascending=False).drop_duplicates(subset='Qname')
+    edge_start_end_ov=edge_start_end_ov.query('Qstart>=0')
+    edge_start_end_ov=pd.merge(edge_start_end_ov,mmap2_Nth2_rmcross_rmdup_addex_rmcross[['Qname','Qlen']]).query('length<Qlen').drop('Qlen',axis=1).drop_duplicates()
+    edge_start_end_ov['Qstart']=edge_start_end_ov.Qstart.astype(int)
+    edge_start_end_ov['Qend']=edge_start_end_ov.Qend.astype(int)
+    return mmap2_Nth2_rmcross_rmdup_addex_rmcross, edge_start_end_ov
+
+
+if __name__ == '__main__':
+    root = sys.argv[1]
+    TARGET=sys.argv[2] #TARGET="MCF7"
+    reference_data_path=sys.argv[3]
+    genome_name=sys.argv[4] #"hg38"
+    gtf_name=sys.argv[5] #"genCode44"
+
+    # root = "/data2/chimericRNA_detection/datasets/real_data/K562"
+    # TARGET="MCF7" #TARGET="MCF7"
+    # reference_data_path="/data2/chimericRNA_detection/code/Reference_data"
+    # genome_name="hg38" #"hg38"
+    # gtf_name="genCode44" #"genCode44"
+
+    # remote_file_dir = Path("/raidc/keigo.masuda/analysis/minimap2/MCF7/FLBEA/")
+    #input
+    paf_dir = os.path.join(root, "FUGAREC")
+    paffile_name = f"{TARGET}_hg38.paf"
+    paffile_name_refseq=f"{TARGET}_refseq.paf"
+    paffile_path = os.path.join(paf_dir, paffile_name)
+    paffile_refseq_path = os.path.join(paf_dir, paffile_name_refseq)
+
+    #outdir
+    res_file_dir = paf_dir
+    intermediate_file_dir = os.path.join(res_file_dir, "intermediate")
+    res_genome_dir = os.path.join(res_file_dir, "genome")
+    res_genome_path = os.path.join(res_genome_dir, f"{TARGET}_df_fusioncand_genome.csv")
+    res_refseq_path = os.path.join(res_genome_dir, f"{TARGET}_df_fusioncand_refseq.csv")
+    res_4_edge_alignment_dir = os.path.join(res_file_dir, "for_edge_alignment")
+    for_make_edge_file_path = os.path.join(res_4_edge_alignment_dir, f"{TARGET}", "gap_4make_edge.csv")
+    for_make_edge_fasta_path = os.path.join(res_4_edge_alignment_dir, f"{TARGET}", "gap_4make_edge.fa")
+    fastq_path = sys.argv[6] if len(sys.argv) > 6 else os.path.join(root, f"{TARGET}.fastq")
+    # 中間ファイルの形式 parquet (default) / csv
+    intermediate_format = sys.argv[7] if len(sys.argv) > 7 else 'parquet'
+
+    #gtf
+    gtf_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.usecol")
+    gtf_exon_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.exon")
+
+    mmap2_align2genome_path = os.path.join(intermediate_file_dir, f"{TARGET}_genome.csv")
+
+    ### saving
+    if not os.path.exists(res_file_dir):
+        os.makedirs(res_file_dir)
+    if not os.path.exists(intermediate_file_dir):
+        os.makedirs(intermediate_file_dir)
+    if not os.path.exists(res_genome_dir):
+        os.makedirs(res_genome_dir)
+    if not os.path.exists(res_4_edge_alignment_dir):
+        os.makedirs(res_4_edge_alignment_dir)
+        if not os.path.exists(os.path.join(res_4_edge_alignment_dir, TARGET)):
+            os.makedirs(os.path.join(res_4_edge_alignment_dir, TARGET))
+
+
+    #gtfファイル読み込み
+    gene_index = load_gene_index(gtf_path)
+
+    #refseqの処理-----------------------------------------------------------
+    #refseqに1geneにしか当たらないリードは除外
+    multihit_id, mmap2_refseq = filter_refseq_paf(paffile_refseq_path, gtf_path)  
+
+    mmap2_Nth2_rmcross_rmdup_addex_rmcross, edge_start_end_ov = prep_gap_realignment(paffile_path, multihit_id, gene_index, gtf_exon_path)
+
+    #fileの書き出し------------------------------------------------------------
+    write_intermediate(mmap2_Nth2_rmcross_rmdup_addex_rmcross, mmap2_align2genome_path, intermediate_format)
+    write_intermediate(edge_start_end_ov, for_make_edge_file_path, intermediate_format)
+
+    #gap配列のfasta書き出し (fastqは1回だけ読む)
+    if os.path.exists(fastq_path):
+        n_gap = write_gap_fasta(fastq_path, edge_start_end_ov, for_make_edge_fasta_path)
+        print(f'gap sequences: {n_gap} -> {for_make_edge_fasta_path}')
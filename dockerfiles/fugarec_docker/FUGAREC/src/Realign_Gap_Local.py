@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# coding: utf-8
+# gap配列を候補2遺伝子のエキソンにローカルアラインして、pblat (blast8) と同じ形式で書き出す
+# usage: python Realign_Gap_Local.py root TARGET reference_data_path genome_name gtf_name genome.fa
+import sys
+root = sys.argv[1]
+TARGET=sys.argv[2]
+reference_data_path=sys.argv[3]
+genome_name=sys.argv[4]
+gtf_name=sys.argv[5]
+genome_path=sys.argv[6]
+
+import os
+from fugarec_utils import read_intermediate
+from gap_realigner import realign_gaps_local, make_cand_gene, load_exon, writable_fai_path, read_fasta
+
+#input
+paf_dir = os.path.join(root, "FUGAREC")
+intermediate_file_dir = os.path.join(paf_dir, "intermediate")
+mmap2_align2genome_path = os.path.join(intermediate_file_dir, f"{TARGET}_genome.csv")
+for_make_edge_fasta_path = os.path.join(paf_dir, "for_edge_alignment", f"{TARGET}", "gap_4make_edge.fa")
+gtf_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.usecol")
+gtf_exon_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.exon")
+#output (Detect_Fusion.py が読む pblat の出力と同じ名前)
+gap_genome_blat_path = os.path.join(paf_dir, f"{TARGET}_gap_blat_min15_stp5.psl")
+
+gap_seq = read_fasta(for_make_edge_fasta_path)
+cand_gene = make_cand_gene(read_intermediate(mmap2_align2genome_path, ['Qname', 'Tname', 'gene']))
+df_exon = load_exon(gtf_exon_path, gtf_path)
+
+df_gap = realign_gaps_local(gap_seq, cand_gene, df_exon, genome_path, writable_fai_path(genome_path, paf_dir))
+df_gap.to_csv(gap_genome_blat_path, sep='\t', header=False, index=False)
+print(f'gap hits: {len(df_gap)} ({df_gap.Qname.nunique()} / {len(gap_seq)} gaps) -> {gap_genome_blat_path}')
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Prep_Gap-Realignment.py -> gapのアラインメント -> Detect_Fusion.py を1プロセスで実行する
+# 中間ファイル (intermediate/{TARGET}_genome.csv, gap_4make_edge.csv) は書かずに DataFrame のまま次の段階に渡す
+# refseqのPAFは1回だけ読んでフィルタし、genomeのPAFの絞り込みと最後のrefseqの照合の両方に使う
+# --workers N: refseq/genomeのPAFの処理とgapのアラインメントを Qname のハッシュで N 個に分けてプロセスプールで並列に行う
+#              (readごとに独立な処理だけを分け、クラスタリングの前につなげるので結果は --workers 1 と同じ)
+# --incremental SAMPLE: TARGET を SAMPLE の fastq の1バッチとして扱う。バッチのreadごとの表 (refseq, genome, gap) を
+#              FUGAREC/incremental/SAMPLE/ に保存し、これまでの全バッチの表をつないでクラスタリングからやり直す
+#              (readは1つのバッチにしか無いので、結果は全バッチをまとめた fastq で SAMPLE を1回実行したときと同じ)
+# --cytoband PATH: UCSC の cytoBand.txt。結果に breakpoint の cytoband (bp1_cytoband, bp2_cytoband) を付ける
+# usage: python Run_FUGAREC.py root TARGET reference_data_path genome_name gtf_name fastq genome.fa [local|pblat] [threads] [--workers N] [--incremental SAMPLE] [--cytoband cytoBand.txt]
+import sys
+workers=1
+if '--workers' in sys.argv:
+    i=sys.argv.index('--workers')
+    workers=int(sys.argv[i+1])
+    del sys.argv[i:i+2]
+sample=None
+if '--incremental' in sys.argv:
+    i=sys.argv.index('--incremental')
+    sample=sys.argv[i+1]
+    del sys.argv[i:i+2]
+cytoband_path=None
+if '--cytoband' in sys.argv:
+    i=sys.argv.index('--cytoband')
+    cytoband_path=sys.argv[i+1]
+    del sys.argv[i:i+2]
+root = sys.argv[1]
+TARGET=sys.argv[2]
+reference_data_path=sys.argv[3]
+genome_name=sys.argv[4]
+gtf_name=sys.argv[5]
+fastq_path=sys.argv[6]
+genome_path=sys.argv[7]
+gap_aligner=sys.argv[8] if len(sys.argv) > 8 else 'local'
+threads=sys.argv[9] if len(sys.argv) > 9 else '1'
+
+import os
+import glob
+import subprocess
+import importlib
+import multiprocessing
+import pandas as pd
+from fugarec_utils import load_gene_index, load_exon_index, load_bed_index, iter_gap_seq, write_gap_fasta, qname_partition, write_intermediate, read_intermediate
+from gap_realigner import realign_gaps_local, make_cand_gene, load_exon, read_fai, writable_fai_path
+prep = importlib.import_module('Prep_Gap-Realignment')
+detect = importlib.import_module('Detect_Fusion')
+
+#input
+paf_dir = os.path.join(root, "FUGAREC")
+paffile_path = os.path.join(paf_dir, f"{TARGET}_{genome_name}.paf")
+paffile_refseq_path = os.path.join(paf_dir, f"{TARGET}_refseq.paf")
+gtf_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.usecol")
+gtf_exon_path = os.path.join(reference_data_path, f"{genome_name}_{gtf_name}.tab.exon")
+genome_2bit_path = os.path.join(reference_data_path, "GRCh38.primary_assembly.genome.2bit")
+ooc_path = os.path.join(reference_data_path, f"{genome_name}.11.ooc")
+
+#output
+for_make_edge_dir = os.path.join(paf_dir, "for_edge_alignment", f"{TARGET}")
+for_make_edge_fasta_path = os.path.join(for_make_edge_dir, "gap_4make_edge.fa")
+gap_genome_blat_path = os.path.join(paf_dir, f"{TARGET}_gap_blat_min15_stp5.psl")
+output_file_path = os.path.join(paf_dir, f'df_res_{TARGET}.csv')
+if sample is not None:
+    incremental_dir = os.path.join(paf_dir, "incremental", sample)
+    output_file_path = os.path.join(paf_dir, f'df_res_{sample}.csv')
+    os.makedirs(incremental_dir, exist_ok=True)
+if not os.path.exists(for_make_edge_dir):
+    os.makedirs(for_make_edge_dir)
+
+
+# パーティションごとの処理。注釈のindexなどはモジュールの変数のまま fork で子プロセスに渡す (読むだけ)
+def refseq_part(part):
+    return detect.filter_refseq_paf(paffile_refseq_path, gtf_path, part=part, n_part=workers)[1]
+
+def genome_part(part):
+    return prep.prep_gap_realignment(paffile_path, multihit_id, gene_index, gtf_exon_path, part=part, n_part=workers)
+
+def gap_part(part):
+    cand_gene_part = cand_gene[qname_partition(cand_gene['Qname'], workers) == part]
+    return realign_gaps_local(gap_seq, cand_gene_part, df_exon, genome_path, fai_path)
+
+def map_partitions(func):
+    # func(0..workers-1) をプロセスプールで実行する。プールは呼ぶたびに作り、その時点のモジュールの変数を子プロセスに引き継ぐ
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        return pool.map(func, range(workers))
+
+def concat_by_qname(dfs, col='Qname'):
+    # 各パーティションの結果 (Qname順、read内は1回で処理したときと同じ順) を Qname 順に並べ直す
+    return pd.concat(dfs, ignore_index=True).sort_values(col, kind='stable', ignore_index=True)
+
+# --incremental で保存するバッチの表 (名前: 変数)
+batch_tables = ['refseq', 'genome', 'gap4edge', 'gaphit']
+
+def save_batch(tables):
+    for key in batch_tables:
+        write_intermediate(tables[key], os.path.join(incremental_dir, f"{TARGET}_{key}.parquet"))
+
+def load_batches():
+    # 保存した全バッチ (同じバッチをもう一度実行した場合は上書きされている) の表をつなぐ
+    batches = sorted(os.path.basename(path)[:-len("_refseq.parquet")] for path in glob.glob(os.path.join(incremental_dir, "*_refseq.parquet")))
+    tables = {key: [read_intermediate(os.path.join(incremental_dir, f"{b}_{key}.parquet")) for b in batches] for key in batch_tables}
+    print(f'batches: {len(batches)}')
+    tables = {key: concat_by_qname(dfs) for key, dfs in tables.items()}
+    tables['gaphit'] = tables['gaphit'].sort_values(['Qname', 'Qstart'], kind='stable', ignore_index=True)
+    return tables
+
+
+#gtfファイル読み込み (Build_Reference.py の index があればそれを読む。workerには fork で引き継ぐ)
+gene_index = load_gene_index(gtf_path)
+load_exon_index(gtf_exon_path)
+
+#refseqの処理 (1回だけ) ----------------------------------------------------
+if workers > 1:
+    mmap2_refseq = concat_by_qname(map_partitions(refseq_part))
+    multihit_id = mmap2_refseq.Qname.unique()
+else:
+    multihit_id, mmap2_refseq = detect.filter_refseq_paf(paffile_refseq_path, gtf_path)
+
+#genomeの処理 -------------------------------------------------------------
+if workers > 1:
+    res = map_partitions(genome_part)
+    mmap2_genome = concat_by_qname([r[0] for r in res])
+    edge_start_end_ov = concat_by_qname([r[1] for r in res])
+else:
+    mmap2_genome, edge_start_end_ov = prep.prep_gap_realignment(paffile_path, multihit_id, gene_index, gtf_exon_path)
+print(f'candidate reads: {mmap2_genome.Qname.nunique()}, gaps: {len(edge_start_end_ov)}')
+
+#gapのアラインメント --------------------------------------------------------
+if gap_aligner == 'pblat':
+    write_gap_fasta(fastq_path, edge_start_end_ov, for_make_edge_fasta_path)
+    subprocess.run(['pblat', '-q=dna', '-t=dna', '-out=blast8', '-minScore=15', '-stepSize=5', f'-threads={threads}',
+                    genome_2bit_path, for_make_edge_fasta_path, gap_genome_blat_path, f'-ooc={ooc_path}'], check=True)
+    mmap2_gap = detect.prep_blat_edge_4gaponly(gap_genome_blat_path)
+else:
+    gap_seq = {name: seq for name, s, e, seq in iter_gap_seq(fastq_path, edge_start_end_ov)}
+    cand_gene = make_cand_gene(mmap2_genome)
+    df_exon = load_exon(gtf_exon_path, gtf_path)
+    fai_path = writable_fai_path(genome_path, paf_dir)
+    if workers > 1:
+        read_fai(genome_path, fai_path) #.faiが無ければ子プロセスより先に作っておく
+        df_gap = concat_by_qname(map_partitions(gap_part))
+    else:
+        df_gap = realign_gaps_local(gap_seq, cand_gene, df_exon, genome_path, fai_path)
+    mmap2_gap = detect.select_blat_edge_4gaponly(df_gap)
+
+#--incremental: このバッチの表を保存して、全バッチの表に置き換える ------------------
+if sample is not None:
+    save_batch({'refseq': mmap2_refseq, 'genome': mmap2_genome, 'gap4edge': edge_start_end_ov, 'gaphit': mmap2_gap})
+    tables = load_batches()
+    mmap2_refseq, mmap2_genome, edge_start_end_ov, mmap2_gap = [tables[key] for key in batch_tables]
+    TARGET = sample
+
+#融合遺伝子の検出 -----------------------------------------------------------
+cytoband_index = load_bed_index(cytoband_path, 'chr_pq') if cytoband_path is not None else None
+df_out = detect.detect_fusion(mmap2_genome, edge_start_end_ov, mmap2_gap, mmap2_refseq, gene_index, TARGET, cytoband_index)
+df_out.to_csv(output_file_path, index=False)
+print(f'fusion reads: {df_out.hit_rid.nunique()} -> {output_file_path}')
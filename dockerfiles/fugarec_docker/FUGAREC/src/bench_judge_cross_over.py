@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf-8
+# judge_cross_over_v3 のベンチマーク
+# usage: python bench_judge_cross_over.py [rows ...]   (default: 1000000 10000000)
+# 旧実装 (readごとのquery) は全行では終わらないため、--old-rows 行で計測して行数の2乗で外挿する
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from fugarec_utils import judge_cross_over_v3
+
+parser = argparse.ArgumentParser()
+parser.add_argument('rows', nargs='*', type=int, default=[1000000, 10000000])
+parser.add_argument('--old-rows', type=int, default=20000)
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+
+def judge_cross_over_v3_loop(mmap2_paired,buffer,s,e):
+    # 置き換え前の実装 (比較用)
+    rids=[]
+    if mmap2_paired['Nth_hit'].value_counts()[1] != mmap2_paired['Nth_hit'].value_counts()[2]:
+        drop_rid_nopaired = pd.DataFrame(mmap2_paired.groupby('Qname')['Nth_hit'].nunique() == 1).query('Nth_hit==True').index
+        mmap2_paired = mmap2_paired.query('Qname not in @drop_rid_nopaired')
+    for x,rid in enumerate(mmap2_paired.Qname.unique()):
+        mmap2_paired_sub = mmap2_paired.query('Qname==@rid')
+        N=mmap2_paired_sub.Nth_hit.min()
+        first_end_pos = int(mmap2_paired_sub.query('Nth_hit==@N')[e].max())
+        try:
+            second_start_pos = int(mmap2_paired_sub.query('Nth_hit==@N+1')[s].min())
+        except:
+            assert mmap2_paired_sub['Nth_hit'].nunique()==2 ,'Nth_hitが3以上です'
+            second_start_pos = int(mmap2_paired_sub.query('Nth_hit!=@N')[s].min())
+        if first_end_pos - buffer > second_start_pos:
+            rids.append(rid)
+    return rids
+
+
+def make_paf_rows(n, rng):
+    # 1readあたり平均4行 (Nth_hit 1,2 に2行ずつ) のPAF相当の表
+    nread = max(n // 4, 1)
+    rid = np.sort(rng.integers(0, nread, n))
+    nth = rng.integers(1, 3, n)
+    qlen = rng.integers(1000, 5000, nread)[rid]
+    cut = (qlen * rng.uniform(0.3, 0.7, n)).astype(np.int64)
+    qstart = np.where(nth == 1, rng.integers(0, 50, n), cut + rng.integers(-30, 30, n))
+    qend = np.where(nth == 1, cut + rng.integers(-30, 30, n), qlen - rng.integers(0, 50, n))
+    return pd.DataFrame({'Qname': pd.Series(rid).map('read_{:09d}'.format), 'Nth_hit': nth,
+                         'Qstart': qstart, 'Qend': qend, 'Qlen': qlen})
+
+
+rng = np.random.default_rng(args.seed)
+df_old = make_paf_rows(args.old_rows, rng)
+t = time.time()
+rids_old = judge_cross_over_v3_loop(df_old, 15, 'Qstart', 'Qend')
+t_old = time.time() - t
+t = time.time()
+rids_new = judge_cross_over_v3(df_old, 15, 'Qstart', 'Qend')
+t_new = time.time() - t
+assert rids_old == rids_new
+print('rows\tloop_sec\tgroupby_sec\tspeedup')
+print('{}\t{:.2f}\t{:.3f}\t{:.0f}x'.format(args.old_rows, t_old, t_new, t_old / t_new))
+for n in args.rows:
+    df = make_paf_rows(n, rng)
+    t = time.time()
+    judge_cross_over_v3(df, 15, 'Qstart', 'Qend')
+    t_new = time.time() - t
+    t_loop = t_old * (n / args.old_rows) ** 2
+    print('{}\t{:.0f} (extrapolated)\t{:.3f}\t{:.0f}x'.format(n, t_loop, t_new, t_loop / t_new))
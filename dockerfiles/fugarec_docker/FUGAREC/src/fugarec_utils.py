@@ -0,0 +1,637 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Prep_Gap-Realignment.py / Detect_Fusion.py 共通の関数
+import os
+import json
+import hashlib
+import pandas as pd
+import numpy as np
+from pandas.api.types import union_categoricals
+
+# chrごとの座標を1本の配列に並べるためのoffset (染色体長+bufferより十分大きい値)
+CHR_SHIFT = 1 << 32
+
+# PAFの先頭12列。Tname,dir は category、座標は int32 で読む
+# Qname は1readのヒットが数行しかなく category にしても小さくならない (遅くなる) ので文字列のまま
+PAF_COL = ["Qname", "Qlen", "Qstart", "Qend", "dir", "Tname", "Tlen", "Tstart", "Tend", "match", "block", "mapQ"]
+PAF_DTYPE = {"Qname": object, "Qlen": np.int32, "Qstart": np.int32, "Qend": np.int32, "dir": "category",
+             "Tname": "category", "Tlen": np.int32, "Tstart": np.int32, "Tend": np.int32,
+             "match": np.int32, "block": np.int32, "mapQ": np.int32}
+PAF_CHUNKSIZE = 1000000
+
+
+def build_interval_index(df, label_col='gene', chr_col='chr', start_col='start', end_col='end'):
+    # chr,startでソートした区間のindexを1回だけ作る
+    # labelの優先順位は元の get_gene_name_start_end と同じく len の降順 (同じlenなら元の行順)
+    df = df[[chr_col, start_col, end_col, label_col]].reset_index(drop=True)
+    chr_codes = {c: i for i, c in enumerate(sorted(df[chr_col].astype(str).unique()))}
+    code = df[chr_col].astype(str).map(chr_codes).to_numpy(np.int64)
+    start = df[start_col].to_numpy(np.int64)
+    end = df[end_col].to_numpy(np.int64)
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[np.lexsort((np.arange(len(df)), -(end - start)))] = np.arange(len(df))
+    order = np.lexsort((start, code))
+    key_start = code[order] * CHR_SHIFT + start[order]
+    key_end = code[order] * CHR_SHIFT + end[order]
+    return {'chr_codes': chr_codes,
+            'start': key_start,
+            'end': key_end,
+            'max_end': np.maximum.accumulate(key_end) if len(key_end) > 0 else key_end,
+            'rank': rank[order],
+            'label': df[label_col].to_numpy()[order]}
+
+
+def _point_hits(index, code, pos, buffer, pos_end=None):
+    # start-buffer <= pos <= end+buffer を満たす (query番号, 区間番号) を全部返す
+    # pos_end を渡すと [pos, pos_end] と重なる (start-buffer <= pos_end かつ pos <= end+buffer) 区間を返す
+    # max_end は累積最大なので、それより手前の区間は pos に届かない
+    key = code * CHR_SHIFT + pos
+    key_end = key if pos_end is None else code * CHR_SHIFT + pos_end
+    lo = np.searchsorted(index['max_end'], key - buffer, side='left')
+    hi = np.searchsorted(index['start'], key_end + buffer, side='right')
+    n = np.maximum(hi - lo, 0)
+    qid = np.repeat(np.arange(len(key)), n)
+    iid = np.repeat(lo - np.cumsum(n) + n, n) + np.arange(n.sum())
+    hit = index['end'][iid] + buffer >= key[qid]
+    return qid[hit], iid[hit]
+
+
+def _precedence_hits(index, code, s_c, e_c, buffer):
+    # start,endともに張り付いている区間 > startのみ > endのみ の (query番号, 区間番号)
+    q_s, i_s = _point_hits(index, code, s_c, buffer)
+    q_e, i_e = _point_hits(index, code, e_c, buffer)
+    key_e = code[q_s] * CHR_SHIFT + e_c[q_s]
+    both = (index['start'][i_s] - buffer <= key_e) & (key_e <= index['end'][i_s] + buffer)
+    q_b, i_b = q_s[both], i_s[both]
+    # 優先順位の高い段階でヒットしたqueryは後の段階から除く
+    done = np.zeros(len(code), dtype=bool)
+    done[q_b] = True
+    sel_s = ~done[q_s]
+    done[q_s] = True
+    sel_e = ~done[q_e]
+    return pd.DataFrame({'qid': np.concatenate([q_b, q_s[sel_s], q_e[sel_e]]),
+                         'iid': np.concatenate([i_b, i_s[sel_s], i_e[sel_e]])})
+
+
+def annotate_intervals(index, chrs, s, e, buffer=15, no_hit='intron', chunksize=200000, overlap=False):
+    # 元の get_gene_name_start_end を全行まとめて計算する
+    # start,endともに張り付いている > startのみ > endのみ > no_hit の順で、lenの長い順に "||" でつなぐ
+    # overlap=True のときは [s, e] と重なる区間を全部 (lenの長い順に) つなぐ (blacklist, segdup など)
+    chrs = pd.Series(chrs)
+    out_index = chrs.index
+    code_all = chrs.astype(str).map(index['chr_codes']).fillna(-1).to_numpy(np.int64)
+    s_all = pd.Series(s).to_numpy(np.int64)
+    e_all = pd.Series(e).to_numpy(np.int64)
+    res = np.full(len(chrs), no_hit, dtype=object)
+    for c in range(0, len(chrs), chunksize):
+        valid = np.flatnonzero(code_all[c:c + chunksize] >= 0) + c
+        if len(valid) == 0:
+            continue
+        code, s_c, e_c = code_all[valid], s_all[valid], e_all[valid]
+        if overlap:
+            q, i = _point_hits(index, code, s_c, buffer, e_c)
+            hits = pd.DataFrame({'qid': q, 'iid': i})
+        else:
+            hits = _precedence_hits(index, code, s_c, e_c, buffer)
+        if len(hits) == 0:
+            continue
+        hits['rank'] = index['rank'][hits['iid'].to_numpy()]
+        hits['label'] = index['label'][hits['iid'].to_numpy()]
+        hits = hits.sort_values(['qid', 'rank'], kind='stable').drop_duplicates(['qid', 'label'])
+        # qid順に並んでいるので、queryごとの範囲を切り出して "||" でつなぐ (ラベルが1つのqueryはそのまま)
+        qid = hits['qid'].to_numpy()
+        label = hits['label'].to_numpy()
+        first = np.flatnonzero(np.r_[True, qid[1:] != qid[:-1]])
+        n = np.diff(np.r_[first, len(qid)])
+        res[valid[qid[first[n == 1]]]] = label[first[n == 1]]
+        label = label.tolist()
+        res[valid[qid[first[n > 1]]]] = ['||'.join(label[i:i + k]) for i, k in zip(first[n > 1].tolist(), n[n > 1].tolist())]
+    return pd.Series(res, index=out_index)
+
+
+BED_COL = ['chr', 'start', 'end', 'name']
+
+
+def read_bed(bed_path):
+    # BED形式の表 (chr, start, end, name, ...) を読む。track行, #行は飛ばす。5列目以降は col5, col6, ... とする
+    df = pd.read_csv(bed_path, sep='\t', header=None, comment='#', dtype={0: str})
+    df = df[~df[0].str.startswith(('track', 'browser'))]
+    df.columns = BED_COL[:df.shape[1]] + [f'col{i + 1}' for i in range(len(BED_COL), df.shape[1])]
+    return df.astype({'start': np.int64, 'end': np.int64}).reset_index(drop=True)
+
+
+def read_cytoband(cytoband_path):
+    # UCSC の cytoBand.txt (chrom, chromStart, chromEnd, name, gieStain) を読み、chr_pq (例: 1p36.33) を付ける
+    cytoband = read_bed(cytoband_path)
+    cytoband['chr_pq'] = cytoband['chr'].str.replace('^chr', '', regex=True) + cytoband['name'].fillna('')
+    return cytoband
+
+
+def load_bed_index(bed_path, label_col='name'):
+    # BED形式の注釈 (cytoband, blacklist, segdup など) の区間index。label_col が無い表は chr:start-end を label にする
+    df = read_cytoband(bed_path) if label_col == 'chr_pq' else read_bed(bed_path)
+    region = df['chr'] + ':' + df['start'].astype(str) + '-' + df['end'].astype(str)
+    df[label_col] = df[label_col].fillna(region) if label_col in df.columns else region
+    return build_interval_index(df, label_col=label_col)
+
+
+def build_exon_index(df_exon):
+    # 遺伝子ごとに exstart / exend をソートした配列を1回だけ作る
+    # 同じ遺伝子で同じ値が複数あるときはexonの表で最初の行を残す (元の merge で最初に出てくる行)
+    gene_codes = {g: i for i, g in enumerate(pd.unique(df_exon['gene']))}
+    code = df_exon['gene'].map(gene_codes).to_numpy(np.int64)
+    row = np.arange(len(df_exon))
+    index = {'gene_codes': gene_codes}
+    for col in ['exstart', 'exend']:
+        pos = df_exon[col].to_numpy(np.int64)
+        order = np.lexsort((row, pos, code))
+        key = code[order] * CHR_SHIFT + pos[order]
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = key[1:] != key[:-1]
+        index[col] = {'key': key[first], 'row': row[order][first]}
+    return index
+
+
+_exon_index_cache = {}
+
+
+def load_exon_index(gtf_exon_path):
+    if gtf_exon_path not in _exon_index_cache:
+        ref = load_reference_index(gtf_exon_path)
+        if ref is not None:
+            _exon_index_cache[gtf_exon_path] = ref['exon_index']
+        else:
+            _exon_index_cache[gtf_exon_path] = build_exon_index(pd.read_csv(gtf_exon_path, usecols=['gene', 'exstart', 'exend']))
+    return _exon_index_cache[gtf_exon_path]
+
+
+def build_gene_index(gtf):
+    # .tab.usecol の表から遺伝子の区間indexを作る (prep_gtf と同じ列名と chr,start の並び)
+    gtf = gtf.rename(columns={"name2": "gene", 'chrom': 'chr', 'txStart': 'start', 'txEnd': 'end'}).sort_values(['chr', 'start'])
+    return build_interval_index(gtf)
+
+
+def load_gene_index(gtf_path):
+    ref = load_reference_index(gtf_path)
+    return ref['gene_index'] if ref is not None else build_gene_index(pd.read_csv(gtf_path))
+
+
+def load_tx2gene(gtf_path):
+    # transcript -> 遺伝子 の表 (Tname, gene, gene_code)。gene_code は遺伝子の整数番号
+    ref = load_reference_index(gtf_path)
+    return ref['tx2gene'] if ref is not None else read_tx2gene(gtf_path)
+
+
+def read_tx2gene(gtf_path):
+    tx2gene = pd.read_csv(gtf_path, usecols=[0, 5], names=['Tname', 'gene'], header=0, index_col=False)
+    tx2gene['gene_code'] = pd.factorize(tx2gene['gene'])[0]
+    return tx2gene
+
+
+def split_tname(tname, sep, i):
+    # Tname.str.split(sep).str[i] と同じ。PAFの Tname は transcript の種類しかないので、種類ごとに1回だけ分割する
+    codes, uniq = pd.factorize(tname)
+    renamed = pd.Series(uniq).str.split(sep, regex=False).str[i].to_numpy(dtype=object)
+    return pd.Series(renamed[codes], index=tname.index, name=tname.name)
+
+
+# 参照の表から作る index (Build_Reference.py が {genome}_{gtf}.index.npz と .manifest.json に書く)
+# npz は numpy の配列だけで持ち (pickle は使わない)、manifest の sha256 が表と npz の両方と一致するときだけ使う
+REFERENCE_INDEX_VERSION = 1
+# 表の場所に書き込めないとき (docker の /FUGAREC/data/ref など) に npz と manifest を置くディレクトリ。表の隣に無ければここを探す
+REFERENCE_INDEX_DIR_ENV = 'FUGAREC_INDEX_DIR'
+_reference_cache = {}
+
+
+def reference_prefix(path):
+    # {genome}_{gtf}.tab.usecol / .tab.exon -> {genome}_{gtf}
+    for ext in ['.tab.usecol', '.tab.exon']:
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def reference_files(prefix, index_dir=None):
+    # index_dir を渡すと npz と manifest は表と別の index_dir に置く
+    index_prefix = prefix if index_dir is None else os.path.join(index_dir, os.path.basename(prefix))
+    return {'usecol': prefix + '.tab.usecol', 'exon': prefix + '.tab.exon',
+            'index': index_prefix + '.index.npz', 'manifest': index_prefix + '.manifest.json'}
+
+
+def reference_index_dirs():
+    # index を探す場所: 表と同じディレクトリ (None)、環境変数 FUGAREC_INDEX_DIR のディレクトリ
+    index_dir = os.environ.get(REFERENCE_INDEX_DIR_ENV)
+    return [None, index_dir] if index_dir else [None]
+
+
+def file_sha256(path, blocksize=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def write_reference_index(prefix, df_exon, source=None, index_dir=None):
+    # 遺伝子の区間index, exonのindexとexonの表 (gene, chr, exstart, exend), transcript -> 遺伝子の整数map を1つの npz に書き、
+    # 表と npz の sha256 を manifest に書く。df_exon は gap_realigner.load_exon の表
+    # npz は一時ファイルに書いてから置き換え、manifest は最後に書く (途中で止まっても壊れた index は使われない)
+    files = reference_files(prefix, index_dir)
+    if index_dir is not None:
+        os.makedirs(index_dir, exist_ok=True)
+    gtf = pd.read_csv(files['usecol'])
+    gene_index = build_gene_index(gtf)
+    exon_index = build_exon_index(pd.read_csv(files['exon'], usecols=['gene', 'exstart', 'exend']))
+    tx2gene = read_tx2gene(files['usecol'])
+    exon_gene_code, exon_gene_names = pd.factorize(df_exon['gene'])
+    exon_chr_code, exon_chr_names = pd.factorize(df_exon['chr'])
+    arrays = {'gene_chr_names': np.array(list(gene_index['chr_codes']), dtype=str),
+              'exon_gene_names': np.array(list(exon_index['gene_codes']), dtype=str),
+              'tx_name': tx2gene['Tname'].to_numpy(dtype=str),
+              'tx_gene_code': tx2gene['gene_code'].to_numpy(np.int64),
+              'tx_gene_names': np.asarray(pd.unique(tx2gene['gene'].dropna()), dtype=str),
+              'df_exon_gene_code': exon_gene_code,
+              'df_exon_gene_names': np.asarray(exon_gene_names, dtype=str),
+              'df_exon_chr_code': exon_chr_code,
+              'df_exon_chr_names': np.asarray(exon_chr_names, dtype=str),
+              'df_exon_exstart': df_exon['exstart'].to_numpy(np.int64),
+              'df_exon_exend': df_exon['exend'].to_numpy(np.int64)}
+    for key in ['start', 'end', 'max_end', 'rank']:
+        arrays[f'gene_{key}'] = gene_index[key]
+    arrays['gene_label'] = gene_index['label'].astype(str)
+    for col in ['exstart', 'exend']:
+        for key in ['key', 'row']:
+            arrays[f'exon_{col}_{key}'] = exon_index[col][key]
+    with open(files['index'] + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(files['index'] + '.tmp', files['index'])
+    manifest = {'version': REFERENCE_INDEX_VERSION,
+                'source': source,
+                'files': {os.path.basename(files[key]): file_sha256(files[key]) for key in ['usecol', 'exon', 'index']}}
+    with open(files['manifest'] + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(files['manifest'] + '.tmp', files['manifest'])
+    _reference_cache.pop(prefix, None)
+    return files
+
+
+def _check_manifest(files):
+    # manifest の version と sha256 が合わなければ理由を返す (合えば None)
+    with open(files['manifest']) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != REFERENCE_INDEX_VERSION:
+        return f"version {manifest.get('version')} != {REFERENCE_INDEX_VERSION}"
+    for key in ['usecol', 'exon', 'index']:
+        name = os.path.basename(files[key])
+        if not os.path.exists(files[key]):
+            return f'{name} not found'
+        if manifest['files'].get(name) != file_sha256(files[key]):
+            return f'{name} checksum mismatch'
+    return None
+
+
+def find_reference_index(prefix, index_dirs=None):
+    # index_dirs (省略時は reference_index_dirs) の順に、表と合う npz と manifest を探す。(files, None) か、見つからなければ (None, 理由)
+    reason = 'not built'
+    for index_dir in index_dirs or reference_index_dirs():
+        files = reference_files(prefix, index_dir)
+        if os.path.exists(files['manifest']) and os.path.exists(files['index']):
+            reason = _check_manifest(files)
+            if reason is None:
+                return files, None
+            reason = f'{reason}: {files["index"]}'
+    return None, reason
+
+
+def load_reference_index(path):
+    # .tab.usecol / .tab.exon のパスから、同じ名前の npz と manifest を読む。無い、または表と合わない場合は None (呼び出し側で表から作る)
+    prefix = reference_prefix(path)
+    if prefix not in _reference_cache:
+        files, reason = find_reference_index(prefix)
+        ref = None
+        if files is not None:
+            ref = _unpack_reference(np.load(files['index'], allow_pickle=False))
+        elif reason != 'not built':
+            print(f'reference index is not used ({reason}), run Build_Reference.py to rebuild')
+        _reference_cache[prefix] = ref
+    return _reference_cache[prefix]
+
+
+def _from_codes(codes, names):
+    # 整数番号と名前の配列から文字列の列を戻す (-1 は NaN)
+    return np.asarray(pd.Categorical.from_codes(codes, names.tolist()).astype(object))
+
+
+def _unpack_reference(z):
+    gene_index = {'chr_codes': {c: i for i, c in enumerate(z['gene_chr_names'].tolist())},
+                  'label': z['gene_label'].astype(object)}
+    for key in ['start', 'end', 'max_end', 'rank']:
+        gene_index[key] = z[f'gene_{key}']
+    exon_index = {'gene_codes': {g: i for i, g in enumerate(z['exon_gene_names'].tolist())}}
+    for col in ['exstart', 'exend']:
+        exon_index[col] = {key: z[f'exon_{col}_{key}'] for key in ['key', 'row']}
+    tx2gene = pd.DataFrame({'Tname': z['tx_name'].astype(object),
+                            'gene': _from_codes(z['tx_gene_code'], z['tx_gene_names']),
+                            'gene_code': z['tx_gene_code']})
+    df_exon = pd.DataFrame({'gene': _from_codes(z['df_exon_gene_code'], z['df_exon_gene_names']),
+                            'chr': _from_codes(z['df_exon_chr_code'], z['df_exon_chr_names']),
+                            'exstart': z['df_exon_exstart'],
+                            'exend': z['df_exon_exend']})
+    return {'gene_index': gene_index, 'exon_index': exon_index, 'tx2gene': tx2gene, 'df_exon': df_exon}
+
+
+def _nearest_boundary(boundary, code, pos):
+    # 同じ遺伝子の境界のうち pos に一番近いもの (左右が同じ距離なら両方) を (query番号, 距離, 値, exonの行) で返す
+    key = boundary['key']
+    q = code * CHR_SHIFT + pos
+    right = np.searchsorted(key, q, side='left')
+    qid, dist, val, row = [], [], [], []
+    for i in (right - 1, right):
+        ok = (code >= 0) & (i >= 0) & (i < len(key))
+        i = np.where(ok, i, 0)
+        ok &= (key[i] // CHR_SHIFT) == code
+        qid.append(np.flatnonzero(ok))
+        val.append(key[i[ok]] - code[ok] * CHR_SHIFT)
+        dist.append(np.abs(val[-1] - pos[ok]))
+        row.append(boundary['row'][i[ok]])
+    qid, dist, val, row = [np.concatenate(x) for x in (qid, dist, val, row)]
+    nearest = np.full(len(code), np.iinfo(np.int64).max)
+    np.minimum.at(nearest, qid, dist)
+    keep = dist == nearest[qid]
+    return qid[keep], dist[keep], val[keep], row[keep]
+
+
+def snap_exon_boundary(df, exon_index):
+    # 元の add_exon_s_e と同じ結果を、ヒットxエキソンの全組み合わせを作らずに求める
+    # Qname,Nth_hitごとに Tstart に一番近い exstart、Tend に一番近い exend (同じ距離なら全部) を付け、
+    # diff_s = Tstart-exstart, diff_e = exend-Tend を返す。"||" でつながった遺伝子は gene2 に分ける
+    ex = df.assign(gene2=df['gene'].str.split("||", regex=False)).explode('gene2')
+    code = ex['gene2'].map(exon_index['gene_codes']).fillna(-1).to_numpy(np.int64)
+    grp = ex.groupby(['Qname', 'Nth_hit'], sort=False).ngroup().to_numpy()
+    cand = []
+    for col, pos_col, diff_col in [('exstart', 'Tstart', 'diff_s'), ('exend', 'Tend', 'diff_e')]:
+        qid, dist, val, row = _nearest_boundary(exon_index[col], code, ex[pos_col].to_numpy(np.int64))
+        c = pd.DataFrame({'grp': grp[qid], 'pos': qid, 'row': row, col: val, diff_col: dist})
+        c = c[c[diff_col] == c.groupby('grp')[diff_col].transform('min')]
+        # 同じ距離の候補は元の merge で最初に出てくる順 (行順 -> 遺伝子順 -> exonの表の行順)
+        c = c.sort_values(['grp', 'pos', 'row']).drop_duplicates(['grp', col])
+        pos = c['pos'].to_numpy()
+        cand.append(pd.DataFrame({'Qname': ex['Qname'].to_numpy()[pos], 'Nth_hit': ex['Nth_hit'].to_numpy()[pos],
+                                  col: c[col].to_numpy(), diff_col: c[diff_col].to_numpy()}))
+    df_s_e = pd.merge(cand[0], cand[1], on=['Qname', 'Nth_hit'])
+    df_out = pd.merge(ex, df_s_e, on=['Qname', 'Nth_hit']).sort_values(['Qname', 'Nth_hit'])
+    df_out['diff_s'] = df_out['Tstart'] - df_out['exstart']
+    df_out['diff_e'] = df_out['exend'] - df_out['Tend']
+    return df_out
+
+
+def add_Nth_hit(mmap2_paired_in, X):
+    # Qname内でQstart順に並べ、直前のヒットとQstart,Qendともに X より離れていれば次のヒット (Nth_hit+1)
+    mmap2_paired = mmap2_paired_in.sort_values(['Qname','Qstart','Qend','mapQ','match_rate'],ascending=[True,True,True,False,False])
+    qname = mmap2_paired['Qname'].to_numpy()
+    qstart = mmap2_paired['Qstart'].to_numpy()
+    qend = mmap2_paired['Qend'].to_numpy()
+    new_read = np.ones(len(mmap2_paired), dtype=bool)
+    new_read[1:] = qname[1:] != qname[:-1]
+    new_hit = np.zeros(len(mmap2_paired), dtype=bool)
+    new_hit[1:] = (qstart[:-1] < qstart[1:] - X) & (qend[:-1] < qend[1:] - X)
+    new_hit[new_read] = False
+    # read先頭からの累積和で Nth_hit を振る
+    counter = np.cumsum(new_hit)
+    read_offset = np.maximum.accumulate(np.where(new_read, counter, 0))
+    mmap2_paired["Nth_hit"] = counter - read_offset + 1
+    return mmap2_paired
+
+
+def judge_cross_over_v3(mmap2_paired, buffer, s, e):
+    # クエリ側のクロスオーバー判定
+    # read毎に最初のNth_hitの e の最大値と次のNth_hitの s の最小値を比べ、buffer以上重なるreadを返す
+    # Nth_hitが1種類しかないreadは除く
+    df = mmap2_paired[['Qname', 'Nth_hit', s, e]]
+    nth = df.groupby(['Qname', 'Nth_hit'], sort=True).agg(first_end_pos=(e, 'max'), second_start_pos=(s, 'min')).reset_index()
+    rank = nth.groupby('Qname').cumcount().to_numpy()
+    first = nth.loc[rank == 0, ['Qname', 'first_end_pos']]
+    second = nth.loc[rank == 1, ['Qname', 'second_start_pos']]
+    pos = pd.merge(first, second, on='Qname')
+    cross = set(pos.loc[pos['first_end_pos'] - buffer > pos['second_start_pos'], 'Qname'])
+    return [rid for rid in pd.unique(df['Qname']) if rid in cross]
+
+
+def pair_Nth_hit(mmap2_paired, col):
+    # Nth_hitが2種類のreadについて Nth_hit==1 の行と Nth_hit==2 の行を Qname で結合して全ペアを作る
+    # 並びは元のループと同じく read の出現順、その中で Nth_hit==1 の行順 x Nth_hit==2 の行順
+    # 同じ長さの (front, rear) を返す
+    nth_count = mmap2_paired.groupby('Qname')['Nth_hit'].transform('nunique')
+    df = mmap2_paired.loc[nth_count == 2, list(dict.fromkeys(['Qname', 'Nth_hit'] + col))]
+    read_order = pd.factorize(df['Qname'])[0]
+    row_order = np.arange(len(df))
+    is1 = (df['Nth_hit'] == 1).to_numpy()
+    is2 = (df['Nth_hit'] == 2).to_numpy()
+    idx = pd.merge(pd.DataFrame({'read': read_order[is1], 'i': row_order[is1]}),
+                   pd.DataFrame({'read': read_order[is2], 'j': row_order[is2]}), on='read')
+    idx = idx.sort_values(['read', 'i', 'j'], kind='stable')
+    front = df[col].iloc[idx['i'].to_numpy()].reset_index(drop=True)
+    rear = df[col].iloc[idx['j'].to_numpy()].reset_index(drop=True)
+    return front, rear
+
+
+def pair_fusioncand(mmap2_paired, col, out_col):
+    # 出力は front(col) + rear(col[1:]) + gap_len + gap_rate の順で out_col の列名をつける
+    front, rear = pair_Nth_hit(mmap2_paired, list(dict.fromkeys(col + ['Qstart', 'Qend', 'Qlen'])))
+    gap_len = rear['Qstart'] - front['Qend']
+    df_fusioncand = pd.concat([front[col], rear[col[1:]].add_suffix('_2'), gap_len, gap_len / front['Qlen']], axis=1)
+    df_fusioncand.columns = out_col
+    df_fusioncand = df_fusioncand.drop_duplicates()
+    return df_fusioncand
+
+
+def pair_gap(df_in, Qstart, Qend):
+    # Nth_hit==1 の Qend と Nth_hit==2 の Qstart の間の gap を全ペアで返す (Qname, Qstart=gap開始, Qend=gap終了)
+    df = df_in[['Qname', 'Qlen', Qstart, Qend, 'Nth_hit']].drop_duplicates()
+    front, rear = pair_Nth_hit(df, ['Qname', Qstart, Qend])
+    return pd.DataFrame({'Qname': front['Qname'],
+                         'Qstart': front[Qend].astype(np.int64),
+                         'Qend': rear[Qstart].astype(np.int64)})
+
+
+def summarize_clst_gene(df, clst_col, g_col, criteria):
+    # クラスタ (clst_col) ごとに g_col の割合が criteria 以上の遺伝子を多い順に "_" でつなぎ、一番多い遺伝子の % を数値で返す
+    # value_counts(normalize=True) と同じく同数は出現順、% は元の文字列と同じ (ratio.round(2)*100).astype(int)
+    # 条件を満たす遺伝子がないクラスタは ("", NaN)
+    vc = df.groupby([clst_col, g_col], sort=False).size().rename('n').reset_index()
+    vc['clst_order'] = pd.factorize(vc[clst_col])[0]
+    vc['ratio'] = vc['n'] / vc.groupby('clst_order')['n'].transform('sum')
+    vc = vc[vc['ratio'] >= criteria].sort_values(['clst_order', 'n'], ascending=[True, False], kind='stable')
+    top = vc[~vc['clst_order'].duplicated()]
+    label = pd.Series(top[g_col].to_numpy(), index=top[clst_col].to_numpy())
+    # 2つ以上の遺伝子が条件を満たすクラスタだけ文字列をつなぐ
+    multi = vc[vc['clst_order'].duplicated(keep=False)]
+    if len(multi) > 0:
+        label.update(multi.groupby(clst_col, sort=False)[g_col].agg('_'.join))
+    pct = pd.Series((top['ratio'].round(2) * 100).astype(int).to_numpy(), index=label.index)
+    return label, pct
+
+
+def add_g1_g2_clst_col_v3(df_fusioncand_clst_tmp, clst_col, g1_col, g2_col, out_g1_col, out_g2_col, out_g1_pct_col, out_g2_pct_col, criteria):
+    # クラスタごとの多数派の遺伝子 (out_g1_col, out_g2_col) とその % (out_g1_pct_col, out_g2_pct_col, 数値) を付ける
+    # 行はクラスタの出現順にまとめて並べ、indexは振り直す (元のクラスタごとの concat と同じ)
+    df = df_fusioncand_clst_tmp.copy()
+    clst = df[clst_col]
+    for g_col, out_col, out_pct_col in [(g1_col, out_g1_col, out_g1_pct_col), (g2_col, out_g2_col, out_g2_pct_col)]:
+        label, pct = summarize_clst_gene(df, clst_col, g_col, criteria)
+        df[out_col] = clst.map(label).fillna("")
+        df[out_pct_col] = clst.map(pct)
+    order = np.argsort(pd.factorize(clst)[0], kind='stable')
+    return df.iloc[order].reset_index(drop=True)
+
+
+def add_clst_count_v2(df, clst_col, support_flg=1):
+    # クラスタのread数 clst_count と、support_read = clst_count * g1の% * g2の% / 100 / 100
+    df_out = df.copy()
+    df_out['clst_count'] = df_out.groupby(clst_col)[clst_col].transform('size')
+    if support_flg == 1:
+        df_out["support_read"] = df_out['clst_count'] * df_out['g1_clst_pct'] * df_out['g2_clst_pct'] * 0.01 * 0.01
+    return df_out
+
+
+def resolve_clst_final(clst_from, clst_to):
+    # clst_from -> clst_to (minor -> major) の辺をたどり、それ以上移らないクラスタを clst_from ごとに返す
+    # クラスタ名を整数に置き換え、parent = parent[parent] (pointer jumping) を変化がなくなるまで繰り返す
+    # 1つのクラスタから出る辺は1本で、clst_count が増える向きにしか移らないので循環はない
+    codes, uniq = pd.factorize(pd.concat([pd.Series(clst_from), pd.Series(clst_to)], ignore_index=True))
+    n = len(clst_from)
+    parent = np.arange(len(uniq))
+    parent[codes[:n]] = codes[n:]
+    for _ in range(len(uniq).bit_length() + 1):
+        parent_next = parent[parent]
+        if (parent_next == parent).all():
+            break
+        parent = parent_next
+    assert (parent[parent] == parent).all()
+    return uniq[parent[codes[:n]]]
+
+
+def iter_gap_seq(fastq_path, edge_start_end):
+    # FASTQを1回だけ読み、gap部分 (read[Qstart:Qend]) を (Qname, Qstart, Qend, 配列) で返す
+    gaps = {}
+    for qname, s, e in edge_start_end[['Qname', 'Qstart', 'Qend']].itertuples(index=False):
+        gaps.setdefault(qname, []).append((int(s), int(e)))
+    with open(fastq_path) as f:
+        for i, line in enumerate(f):
+            if i % 4 == 0:
+                name = line[1:].split()[0] if len(line) > 1 else ''
+            elif i % 4 == 1 and name in gaps:
+                seq = line.rstrip()
+                for s, e in gaps[name]:
+                    yield name, s, e, seq[s:e]
+
+
+def write_gap_fasta(fastq_path, edge_start_end, out_path):
+    # gap部分だけを >Qname 開始-終了 の見出しで書き出す (配列名は空白までの Qname)
+    n = 0
+    with open(out_path, 'w') as out:
+        for name, s, e, seq in iter_gap_seq(fastq_path, edge_start_end):
+            out.write('>' + name + ' ' + str(s) + '-' + str(e) + '\n' + seq + '\n')
+            n += 1
+    return n
+
+
+def _concat_paf(dfs):
+    # category の列はカテゴリを合わせて結合する (pd.concat だと object に戻る)
+    cat_col = [c for c in dfs[0].columns if isinstance(dfs[0][c].dtype, pd.CategoricalDtype)]
+    df = pd.concat([d.drop(cat_col, axis=1) for d in dfs])
+    for c in cat_col:
+        df[c] = union_categoricals([d[c] for d in dfs])
+    return df[dfs[0].columns]
+
+
+def iter_paf_reads(paffile_path, chunksize=None):
+    # PAFを chunksize 行ずつ PAF_DTYPE で読む
+    # minimap2 は同じreadのヒットを続けて出力するので、chunkの最後のreadは次のchunkに回し、readが2つのchunkに分かれないようにする
+    tail = None
+    for chunk in pd.read_table(paffile_path, index_col=False, header=None, names=PAF_COL, usecols=range(0, 12),
+                               dtype=PAF_DTYPE, chunksize=chunksize or PAF_CHUNKSIZE):
+        if len(chunk) == 0:
+            continue
+        if tail is not None:
+            chunk = _concat_paf([tail, chunk])
+        is_tail = (chunk['Qname'] == chunk['Qname'].iloc[-1]).to_numpy()
+        tail = chunk[is_tail]
+        if not is_tail.all():
+            yield chunk[~is_tail]
+    if tail is not None:
+        yield tail
+
+
+def read_paf_filtered(paffile_path, filter_func=None, chunksize=None):
+    # filter_func(chunk) でreadごとに行を選び、残った行だけをつなげる (メモリはPAF全体ではなく候補readの分だけ使う)
+    # 戻り値は Tlen を除いた列で、名前は文字列、数値は int64 (pd.read_table で全部読んだ場合と同じ型・行順)
+    parts = []
+    for chunk in iter_paf_reads(paffile_path, chunksize):
+        chunk = chunk.drop('Tlen', axis=1)
+        if filter_func is not None:
+            chunk = filter_func(chunk)
+        dtype = {c: str for c in chunk.columns if isinstance(chunk[c].dtype, pd.CategoricalDtype)}
+        dtype.update({c: np.int64 for c in chunk.columns if chunk[c].dtype == np.int32})
+        parts.append(chunk.astype(dtype))
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=[c for c in PAF_COL if c != 'Tlen'])
+
+
+def qname_partition(qname, n_part):
+    # Qname のハッシュで 0..n_part-1 のパーティション番号を付ける (プロセスや PYTHONHASHSEED によらず同じ値)
+    return (pd.util.hash_array(np.asarray(qname, dtype=object)) % np.uint64(n_part)).astype(np.int64)
+
+
+def partition_filter(filter_func, part, n_part):
+    # read_paf_filtered に渡すフィルタ。part 番目のパーティションの read だけ残してから filter_func を通す
+    # readは chunk をまたがないので、readごとのフィルタの結果は全体で1回に通したときと同じ
+    if n_part == 1:
+        return filter_func
+
+    def filter_part(chunk):
+        chunk = chunk[qname_partition(chunk['Qname'], n_part) == part]
+        return chunk if filter_func is None else filter_func(chunk)
+    return filter_part
+
+
+def filter_qstart_qend_not_unique(df):
+    # QstartとQendがどちらも1種類ではないreadの行だけを残す
+    g = df.groupby('Qname', observed=True, sort=False)
+    return df[(g['Qstart'].transform('nunique') != 1) & (g['Qend'].transform('nunique') != 1)]
+
+
+def filter_genome_candidate(chunk, X):
+    # genomeのPAFの chunk から、Prep_Gap-Realignment で残りうるreadの行だけを元の形のまま返す
+    # QstartとQendがどちらも1種類ではなく、add_Nth_hit (X) で重ならないヒットがちょうど2つ (Nth_hit の最大が2) のread
+    df = filter_qstart_qend_not_unique(chunk)
+    df = add_Nth_hit(df.assign(match_rate=df['match'] / (df['Qend'] - df['Qstart'] + 1)), X)
+    nth_max = df.groupby('Qname', observed=True)['Nth_hit'].max()
+    return chunk[chunk['Qname'].isin(nth_max.index[nth_max == 2])]
+
+
+def intermediate_path(path, fmt):
+    # 中間ファイルは拡張子だけを変える (xxx.csv -> xxx.parquet)
+    return os.path.splitext(path)[0] + ('.parquet' if fmt == 'parquet' else '.csv')
+
+
+def write_intermediate(df, path, fmt='parquet'):
+    # parquet: 型を保ったまま書き、読むときに必要な列だけ読める / csv: これまでと同じCSV
+    path = intermediate_path(path, fmt)
+    if fmt == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def read_intermediate(path, columns=None):
+    # 同じ名前の parquet と csv のうち新しい方を読む。columns を指定するとその列だけ読む
+    cand = [p for p in [intermediate_path(path, 'parquet'), intermediate_path(path, 'csv')] if os.path.exists(p)]
+    if len(cand) == 0:
+        raise FileNotFoundError(path)
+    path = max(cand, key=os.path.getmtime)
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.read_csv(path, usecols=columns)
+    return df if columns is None else df[columns]
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# coding: utf-8
+# gap配列を候補2遺伝子のエキソン配列だけにアラインする (pblatのゲノム全体検索の代わり)
+# k-merのseedで対角線を決め、その周辺だけ banded Smith-Waterman を行い、blast8 (prep_blat_edge_4gaponly) と同じ列を返す
+import os
+import math
+import numpy as np
+import pandas as pd
+from fugarec_utils import load_reference_index
+
+blast8_col = ["Qname", "Tname", "identity", "alignment_length", "mismatches", "gap_openings", "Qstart", "Qend", "Tstart", "Tend", "evalue", "bitscore"]
+
+# blastn の既定スコア (reward 2, penalty -3, gap 5/2) と対応する Karlin-Altschul パラメータ
+MATCH, MISMATCH, GAP_OPEN, GAP_EXTEND = 2, -3, 5, 2
+LAMBDA, K = 0.625, 0.41
+NEG = -(1 << 30)
+
+_code = np.full(256, 4, dtype=np.int8)
+for _i, _c in enumerate('ACGT'):
+    _code[ord(_c)] = _i
+    _code[ord(_c.lower())] = _i
+_revcomp = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
+
+def encode(seq):
+    # A,C,G,T -> 0..3, それ以外 -> 4
+    return _code[np.frombuffer(seq.encode(), dtype=np.uint8)]
+
+
+def read_fai(genome_path, fai_path=None):
+    # samtools faidx と同じ .fai を読む (無ければ作る)
+    if fai_path is None:
+        fai_path = genome_path + '.fai'
+    if not os.path.exists(fai_path):
+        build_fai(genome_path, fai_path)
+    fai = pd.read_table(fai_path, header=None, usecols=range(5), names=['chr', 'length', 'offset', 'linebases', 'linewidth'], dtype={'chr': str})
+    return {r.chr: (r.length, r.offset, r.linebases, r.linewidth) for r in fai.itertuples(index=False)}
+
+
+def writable_fai_path(genome_path, out_dir):
+    # genomeの.faiが無く、genomeの場所に書き込めない場合は out_dir に作る
+    fai_path = genome_path + '.fai'
+    if not os.path.exists(fai_path) and not os.access(os.path.dirname(os.path.abspath(genome_path)), os.W_OK):
+        fai_path = os.path.join(out_dir, os.path.basename(genome_path) + '.fai')
+    return fai_path
+
+
+def build_fai(genome_path, fai_path):
+    with open(genome_path, 'rb') as f, open(fai_path, 'w') as out:
+        name, length, offset, linebases, linewidth = None, 0, 0, 0, 0
+        pos = 0
+        for line in f:
+            if line[:1] == b'>':
+                if name is not None:
+                    out.write(f'{name}\t{length}\t{offset}\t{linebases}\t{linewidth}\n')
+                name = line[1:].split()[0].decode()
+                length, offset, linebases, linewidth = 0, pos + len(line), 0, 0
+            else:
+                if linebases == 0:
+                    linebases, linewidth = len(line.rstrip(b'\r\n')), len(line)
+                length += len(line.rstrip(b'\r\n'))
+            pos += len(line)
+        if name is not None:
+            out.write(f'{name}\t{length}\t{offset}\t{linebases}\t{linewidth}\n')
+
+
+def fetch(fh, fai, chr, start, end):
+    # 0-based, end含まず
+    length, offset, linebases, linewidth = fai[chr]
+    start, end = max(start, 0), min(end, length)
+    if end <= start:
+        return ''
+    s = offset + (start // linebases) * linewidth + start % linebases
+    e = offset + ((end - 1) // linebases) * linewidth + (end - 1) % linebases + 1
+    fh.seek(s)
+    return fh.read(e - s).replace(b'\n', b'').replace(b'\r', b'').decode().upper()
+
+
+def merge_exon(df_exon, flank):
+    # 遺伝子ごとにエキソンを flank 分広げて重なりをまとめる
+    df = df_exon.sort_values(['gene', 'chr', 'exstart'])
+    s = df['exstart'].to_numpy(np.int64) - flank
+    e = df['exend'].to_numpy(np.int64) + flank
+    key = (df['gene'].astype(str) + '\t' + df['chr'].astype(str)).to_numpy()
+    same = key[1:] == key[:-1]
+    grp = np.concatenate([[0], np.cumsum(~same)]) if len(df) > 0 else np.zeros(0, dtype=np.int64)
+    run_end = pd.Series(e).groupby(grp).cummax().to_numpy()
+    new = np.ones(len(df), dtype=bool)
+    # 同じ遺伝子内で直前までの最大endより後ろから始まる区間で切る
+    new[1:] = ~same | (s[1:] > run_end[:-1])
+    block = np.cumsum(new) - 1
+    return pd.DataFrame({'gene': df['gene'].to_numpy()[new], 'chr': df['chr'].to_numpy()[new],
+                         'start': np.maximum(s[new], 0),
+                         'end': pd.Series(e).groupby(block).max().to_numpy()})
+
+
+class GeneTargets:
+    # 1遺伝子分のエキソン配列を N でつないだ配列と、その k-mer index (sort済み) をまとめて持つ
+    def __init__(self, regions, fh, fai, k):
+        seqs, offsets, starts, chrs = [], [], [], []
+        pos = 0
+        for chr, s, e in regions:
+            if chr not in fai:
+                continue
+            seq = fetch(fh, fai, chr, s, e)
+            seqs.append(seq)
+            offsets.append(pos)
+            starts.append(s)
+            chrs.append(chr)
+            pos += len(seq) + 1
+        self.seq = encode('N'.join(seqs)) if seqs else np.zeros(0, dtype=np.int8)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.lengths = np.array([len(x) for x in seqs], dtype=np.int64)
+        self.starts = np.array(starts, dtype=np.int64)
+        self.chrs = chrs
+        self.kmer, self.kpos = kmer_index(self.seq, k)
+
+
+def kmer_codes(seq, k):
+    # 2bit で k-mer を整数にする。Nを含む k-mer は -1
+    n = len(seq) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    s = seq.astype(np.int64)
+    bad = np.convolve((s == 4).astype(np.int64), np.ones(k, dtype=np.int64), 'valid') > 0
+    s = np.where(s == 4, 0, s)
+    codes = np.zeros(n, dtype=np.int64)
+    for i in range(k):
+        codes = codes * 4 + s[i:i + n]
+    codes[bad] = -1
+    return codes
+
+
+def kmer_index(seq, k):
+    codes = kmer_codes(seq, k)
+    pos = np.flatnonzero(codes >= 0)
+    order = np.argsort(codes[pos], kind='stable')
+    return codes[pos][order], pos[order]
+
+
+def seed_diagonals(query, target, k, band, max_diag):
+    # query k-mer と target k-mer の一致から (target上の位置 - query上の位置) の対角線を数え、多い順に返す
+    q = kmer_codes(query, k)
+    qpos = np.flatnonzero(q >= 0)
+    if len(qpos) == 0 or len(target.kmer) == 0:
+        return []
+    lo = np.searchsorted(target.kmer, q[qpos], side='left')
+    hi = np.searchsorted(target.kmer, q[qpos], side='right')
+    n = hi - lo
+    if n.sum() == 0:
+        return []
+    qi = np.repeat(qpos, n)
+    ti = target.kpos[np.repeat(lo - np.cumsum(n) + n, n) + np.arange(n.sum())]
+    diag = ti - qi
+    diag_bin = diag // band
+    bins, count = np.unique(diag_bin, return_counts=True)
+    res = []
+    for b in bins[np.argsort(-count, kind='stable')][:max_diag]:
+        res.append(int(np.median(diag[diag_bin == b])))
+    return res
+
+
+def banded_sw(query, target, diag, band):
+    # query 全体を target の対角線 diag (target位置 - query位置) の前後 band 以内だけで局所アラインメントする
+    # 行 i の帯は offset o (0..2*band) で target の列 j = i + diag - band + o (1-based) に対応
+    # アフィンギャップ (GAP_OPEN, GAP_EXTEND)。E: query側の挿入 (上から), F: target側の挿入 (左から)
+    L, T = len(query), len(target)
+    if L == 0 or T == 0:
+        return None
+    B = 2 * band + 1
+    off = np.arange(B)
+    ext = off.astype(np.int64) * GAP_EXTEND
+    H = np.zeros((L + 1, B), dtype=np.int64)
+    Hn = np.zeros((L + 1, B), dtype=np.int64)
+    E = np.full((L + 1, B), NEG, dtype=np.int64)
+    F = np.full((L + 1, B), NEG, dtype=np.int64)
+    pad = np.array([NEG], dtype=np.int64)
+    for i in range(1, L + 1):
+        j = i + diag - band + off
+        valid = (j >= 1) & (j <= T)
+        t = target[np.clip(j - 1, 0, T - 1)]
+        sub = np.where((t == query[i - 1]) & (t != 4), MATCH, MISMATCH)
+        e = np.maximum(np.concatenate([H[i - 1, 1:], pad]) - GAP_OPEN, np.concatenate([E[i - 1, 1:], pad]) - GAP_EXTEND)
+        e[~valid] = NEG
+        hn = np.maximum(np.maximum(H[i - 1] + sub, e), 0)
+        hn[~valid] = 0
+        # F[o] = max_p<o (Hn[p] - open - (o-1-p)*extend) を累積最大で計算
+        prev = np.concatenate([pad, hn[:-1] + ext[1:]])
+        f = np.maximum(np.maximum.accumulate(prev) - GAP_OPEN - ext, NEG)
+        f[~valid] = NEG
+        h = np.maximum(hn, f)
+        E[i], Hn[i], F[i], H[i] = e, hn, f, h
+    i, o = np.unravel_index(np.argmax(H), H.shape)
+    score = int(H[i, o])
+    if score <= 0:
+        return None
+    # traceback
+    qend, tend = i, i + diag - band + o
+    matches = mismatches = gap_openings = aln_len = 0
+    state = 'H'
+    while i > 0:
+        j = i + diag - band + o
+        if state == 'H':
+            if H[i, o] == 0:
+                break
+            state = 'Hn' if H[i, o] == Hn[i, o] else 'F'
+            continue
+        if state == 'Hn':
+            if Hn[i, o] == 0:
+                break
+            s = MATCH if (query[i - 1] == target[j - 1] and target[j - 1] != 4) else MISMATCH
+            if Hn[i, o] == H[i - 1, o] + s:
+                matches += s == MATCH
+                mismatches += s != MATCH
+                aln_len += 1
+                i -= 1
+                state = 'H'
+            else:
+                state = 'E'
+        elif state == 'E':
+            aln_len += 1
+            if E[i, o] == H[i - 1, o + 1] - GAP_OPEN:
+                gap_openings += 1
+                state = 'H'
+            i, o = i - 1, o + 1
+        else:
+            aln_len += 1
+            if F[i, o] == Hn[i, o - 1] - GAP_OPEN:
+                gap_openings += 1
+                state = 'Hn'
+            o -= 1
+    return {'score': score, 'qstart': i, 'qend': qend, 'tstart': i + diag - band + o, 'tend': tend,
+            'matches': matches, 'mismatches': mismatches, 'gap_openings': gap_openings, 'alignment_length': aln_len}
+
+
+def align_gap(qname, seq, targets, genome_len, k, band, max_diag, min_score):
+    # gap配列を両鎖で候補遺伝子にアラインし、blast8形式の行 (1-based, minus鎖は Tstart>Tend) を返す
+    rows = []
+    L = len(seq)
+    for strand, qseq in (('+', seq), ('-', seq.translate(_revcomp)[::-1])):
+        query = encode(qseq)
+        for target in targets:
+            for diag in seed_diagonals(query, target, k, band, max_diag):
+                # seedのある region だけで SW
+                r = np.searchsorted(target.offsets, diag + L // 2, side='right') - 1
+                if r < 0:
+                    continue
+                r0, r1 = target.offsets[r], target.offsets[r] + target.lengths[r]
+                res = banded_sw(query, target.seq[r0:r1], diag - r0, band)
+                if res is None:
+                    continue
+                blat_score = res['matches'] - res['mismatches'] - res['gap_openings']
+                if blat_score < min_score:
+                    continue
+                bits = (LAMBDA * res['score'] - math.log(K)) / math.log(2)
+                evalue = L * genome_len * 2.0 ** (-bits)
+                gstart = int(target.starts[r] + res['tstart'])
+                gend = int(target.starts[r] + res['tend'])
+                if strand == '+':
+                    qs, qe, ts, te = res['qstart'] + 1, res['qend'], gstart + 1, gend
+                else:
+                    qs, qe, ts, te = L - res['qend'] + 1, L - res['qstart'], gend, gstart + 1
+                rows.append([qname, target.chrs[r], round(100.0 * res['matches'] / res['alignment_length'], 2),
+                             res['alignment_length'], res['mismatches'], res['gap_openings'],
+                             qs, qe, ts, te, float('%.2g' % evalue), round(bits, 1)])
+    return rows
+
+
+def load_exon(gtf_exon_path, gtf_path):
+    # .tab.exon を gene, chr, exstart, exend で読む。染色体の列が無い場合は遺伝子の表 (.tab.usecol) から付ける
+    # Build_Reference.py で作った index があればその表を使う
+    ref = load_reference_index(gtf_exon_path)
+    if ref is not None:
+        return ref['df_exon']
+    df_exon = pd.read_csv(gtf_exon_path).rename(columns={'chrom': 'chr'})
+    if 'chr' not in df_exon.columns:
+        gtf = pd.read_csv(gtf_path).rename(columns={"name2": "gene", 'chrom': 'chr'})
+        df_exon = pd.merge(df_exon, gtf[['gene', 'chr']].drop_duplicates(), on='gene')
+    return df_exon[['gene', 'chr', 'exstart', 'exend']]
+
+
+def make_cand_gene(mmap2_genome):
+    # flankingヒット (Qname, Tname, gene) から read ごとの候補遺伝子 (Qname, gene, chr) を作る。"||" は分割する
+    df = mmap2_genome[['Qname', 'Tname', 'gene']].rename(columns={'Tname': 'chr'})
+    df = df.assign(gene=df['gene'].str.split("||", regex=False)).explode('gene')
+    return df.query('gene!="intron"')[['Qname', 'gene', 'chr']].drop_duplicates()
+
+
+def realign_gaps_local(gap_seq, cand_gene, df_exon, genome_path, fai_path=None, k=11, band=16, flank=30, max_diag=3, min_score=15, cache_size=256):
+    # gap_seq: Qname -> gap配列
+    # cand_gene: Qname, gene, chr (make_cand_gene)
+    # df_exon: gene, chr, exstart, exend
+    # evalue はゲノム全体を検索空間として計算するので pblat の結果と同じ閾値 (gap_evalue_cutoff) が使える
+    fai = read_fai(genome_path, fai_path)
+    genome_len = sum(v[0] for v in fai.values())
+    regions = merge_exon(df_exon, flank)
+    region_by_gene = {key: list(zip(sub['chr'], sub['start'], sub['end'])) for key, sub in regions.groupby(['gene', 'chr'])}
+    cache = {}
+    rows = []
+    with open(genome_path, 'rb') as fh:
+        for qname, sub in cand_gene.drop_duplicates().groupby('Qname', sort=False):
+            if qname not in gap_seq or len(gap_seq[qname]) < k:
+                continue
+            targets = []
+            for key in zip(sub['gene'], sub['chr']):
+                if key not in region_by_gene:
+                    continue
+                if key not in cache:
+                    if len(cache) >= cache_size:
+                        cache.pop(next(iter(cache)))
+                    cache[key] = GeneTargets(region_by_gene[key], fh, fai, k)
+                targets.append(cache[key])
+            rows += align_gap(qname, gap_seq[qname], targets, genome_len, k, band, max_diag, min_score)
+    return pd.DataFrame(rows, columns=blast8_col).drop_duplicates()
+
+
+def read_fasta(path):
+    seqs, name = {}, None
+    for line in open(path):
+        if line[0] == '>':
+            name = line[1:].split()[0]
+            seqs[name] = []
+        elif name is not None:
+            seqs[name].append(line.strip())
+    return {n: ''.join(s) for n, s in seqs.items()}
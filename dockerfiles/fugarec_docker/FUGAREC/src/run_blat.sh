@@ -3,10 +3,11 @@ sample=testdata
 fq_path=${root}/data/${sample}.fastq
 genome_path=${root}/data/ref/hg19.rm.fa
 refseq_path=${root}/data/ref/hg19_genCode19_rename.fa
-fragment_fq_path=${root}/out/out/for_edge_alignment/${sample}/*.csv
+fragment_csv_path=${root}/out/for_edge_alignment/${sample}/gap_4make_edge.csv
+fragment_fa_path=${root}/out/for_edge_alignment/${sample}/gap_4make_edge.fa
 
 # mapping gap seq to genome
-seqkit fq2fa ${fq_path} > ${fq_path%.fastq}.fa
-blat -q=dna -t=dna -out=blast8 -minScore=15 -stepSize=5 ${genome_path} ${fq_path%.fastq}.fa ${root}/out/${sample}_gap_blat_min15_stp5.psl
+python ${root}/src/Extract_Gap_Fasta.py ${fq_path} ${fragment_csv_path} ${fragment_fa_path}
+blat -q=dna -t=dna -out=blast8 -minScore=15 -stepSize=5 ${genome_path} ${fragment_fa_path} ${root}/out/${sample}_gap_blat_min15_stp5.psl
 done
 
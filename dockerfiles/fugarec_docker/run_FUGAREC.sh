@@ -6,6 +6,8 @@ seq_type=$3
 corenum=$4
 genome_name=$5 
 gtf_name=$6
+# local: gaps are aligned to the exons of the two candidate genes (gap_realigner.py), pblat: genome-wide pblat
+gap_aligner=${7:-local}
 
 
 
@@ -31,17 +33,29 @@ elif [ "$seq_type" == "PacBio" ]; then
 else
     echo "Please input right sequencing type, such as ONT_cDNA, ONT_dRNA, PacBio"
 fi
-minimap2 -t $corenum $mini_genome_opt "/Reference/genome.fa" $fq_path > /dataset/$tool_name/${file}_$genome_name.paf 
-minimap2 -t $corenum $mini_transcriptome_opt "/Reference/transcriptome.fa" $fq_path > /dataset/$tool_name/${file}_refseq.paf
 
-python /FUGAREC/src/Prep_Gap-Realignment.py /dataset $file "/FUGAREC/data/ref" $genome_name $gtf_name
-
-seqkit fq2fa $fq_path > ${fq_path%.fastq}.fa
-
-#$seqkit_path split -p $corenum 
-pblat -q=dna -t=dna -out=blast8 -minScore=15 -stepSize=5 -threads=$corenum /FUGAREC/data/ref/GRCh38.primary_assembly.genome.2bit ${fq_path%.fastq}.fa /dataset/$tool_name/${file}_gap_blat_min15_stp5.psl -ooc=/FUGAREC/data/ref/$genome_name.11.ooc
+# typed gene/exon indexes of the reference tables (Build_Reference.py). The image builds them next to the tables;
+# the container runs as the calling user and cannot write /FUGAREC/data/ref, so a missing or stale index is built
+# in /dataset/$tool_name/ref instead (once, kept until the tables change). Without an index the tables are read.
+export FUGAREC_INDEX_DIR=/dataset/$tool_name/ref
+mkdir -p $FUGAREC_INDEX_DIR
+if [ -w "$FUGAREC_INDEX_DIR" ]; then
+    python /FUGAREC/src/Build_Reference.py /FUGAREC/data/ref $genome_name $gtf_name --index-dir $FUGAREC_INDEX_DIR --if-needed \
+        > $FUGAREC_INDEX_DIR/build_${genome_name}_${gtf_name}.log 2>&1 \
+        || echo "reference index not built, reading the tables (see $FUGAREC_INDEX_DIR/build_${genome_name}_${gtf_name}.log)"
+fi
 
-python /FUGAREC/src/Detect_Fusion.py /dataset $file "/FUGAREC/data/ref" $genome_name $gtf_name
+# only the reads that can become fusion candidates are written (the full PAFs are never stored)
+# pipefail: a failed minimap2 (e.g. out of memory) must not leave a truncated PAF that looks like a finished one
+set -o pipefail
+minimap2 -t $corenum $mini_genome_opt "/Reference/genome.fa" $fq_path | python /FUGAREC/src/Prefilter_PAF.py genome /dataset/$tool_name/${file}_$genome_name.paf \
+    || { echo "minimap2 to the genome failed"; rm -f /dataset/$tool_name/${file}_$genome_name.paf; exit 1; }
+minimap2 -t $corenum $mini_transcriptome_opt "/Reference/transcriptome.fa" $fq_path | python /FUGAREC/src/Prefilter_PAF.py refseq /dataset/$tool_name/${file}_refseq.paf "/FUGAREC/data/ref/${genome_name}_${gtf_name}.tab.usecol" \
+    || { echo "minimap2 to the transcriptome failed"; rm -f /dataset/$tool_name/${file}_refseq.paf; exit 1; }
+
+# Prep_Gap-Realignment -> gap alignment ($gap_aligner) -> Detect_Fusion in one process, the tables are handed over in memory
+# the per-read steps run in $corenum worker processes (reads are split by a hash of the read name)
+python /FUGAREC/src/Run_FUGAREC.py /dataset $file "/FUGAREC/data/ref" $genome_name $gtf_name $fq_path /Reference/genome.fa $gap_aligner $corenum --workers $corenum
 
 if [ -f "$fq_path" ]; then
     gzip -c $fq_path > /dataset/$file.fastq.gz